@@ -19,6 +19,7 @@ function App() {
   const [file, setFile] = useState(null);
   const [isProcessing, setIsProcessing] = useState(false);
   const [processedFiles, setProcessedFiles] = useState({});
+  const [error, setError] = useState(null);
   const [activeFilters, setActiveFilters] = useState({
     vocals: true,
     drums: true,
@@ -39,24 +40,50 @@ function App() {
     }
   });
 
+  const pollJob = async (jobId) => {
+    // Poll until the job is done, then swap the live streams for the stored stems
+    while (true) {
+      const response = await fetch(`http://localhost:8000/jobs/${jobId}`);
+      const job = await response.json();
+      if (job.status === 'succeeded') {
+        if (job.result && job.result.files) {
+          setProcessedFiles(job.result.files);
+        }
+        return;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+      await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+  };
+
   const handleUpload = async () => {
     if (!file) return;
 
     setIsProcessing(true);
+    setError(null);
     const formData = new FormData();
     formData.append('file', file);
 
     try {
-      const response = await fetch('http://localhost:8000/process-audio', {
+      const response = await fetch('http://localhost:8000/jobs', {
         method: 'POST',
         body: formData,
       });
       const data = await response.json();
-      if (data.status === 'success' && data.files) {
-        setProcessedFiles(data.files);
+      // Refused uploads (full queue, unsupported format, too large) explain why in detail
+      if (!response.ok) {
+        throw new Error(typeof data.detail === 'string' ? data.detail : `Upload failed (${response.status})`);
       }
+      // Stems can be played from their live streams while separation is still running
+      if (data.streams) {
+        setProcessedFiles(data.streams);
+      }
+      await pollJob(data.job_id);
     } catch (error) {
       console.error('Error uploading file:', error);
+      setError(error.message);
     } finally {
       setIsProcessing(false);
     }
@@ -69,14 +96,20 @@ function App() {
     }));
   };
 
-  const handleDownload = async (url, stemName) => {
+  // Live streams are plain URLs; finished stems carry their URL, format, size and duration
+  const stemUrl = (info) => (typeof info === 'string' ? info : info.url);
+  // Range-served WAV from the stem container when there is one, so the player can seek without downloading everything
+  const playbackUrl = (info) => (typeof info === 'string' ? info : info.range_url || info.url);
+  const stemFormat = (info) => (typeof info === 'string' ? 'wav' : info.format);
+
+  const handleDownload = async (url, stemName, format) => {
     try {
       const response = await fetch(url);
       const blob = await response.blob();
       const downloadUrl = window.URL.createObjectURL(blob);
       const link = document.createElement('a');
       link.href = downloadUrl;
-      link.download = `${stemName}.wav`;
+      link.download = `${stemName}.${format}`;
       document.body.appendChild(link);
       link.click();
       document.body.removeChild(link);
@@ -142,6 +175,12 @@ function App() {
           </Box>
         )}
 
+        {error && (
+          <Typography variant="body2" color="error" sx={{ mt: 2 }}>
+            {error}
+          </Typography>
+        )}
+
         {Object.keys(processedFiles).length > 0 && (
           <Box className="filters-container" sx={{ mt: 3 }}>
             <Typography variant="h6" gutterBottom>
@@ -159,7 +198,7 @@ function App() {
                 </Button>
               ))}
             </Box>
-            {Object.entries(processedFiles).map(([stem, path]) => (
+            {Object.entries(processedFiles).map(([stem, info]) => (
               <Box 
                 key={stem} 
                 sx={{ 
@@ -182,7 +221,7 @@ function App() {
                   <Button
                     variant="outlined"
                     size="small"
-                    onClick={() => handleDownload(path, stem)}
+                    onClick={() => handleDownload(stemUrl(info), stem, stemFormat(info))}
                     startIcon={<CloudDownloadIcon />}
                   >
                     Download
@@ -190,7 +229,7 @@ function App() {
                 </Box>
                 <audio 
                   controls 
-                  src={path} 
+                  src={playbackUrl(info)} 
                   style={{ width: '100%' }} 
                   preload="metadata"
                 />
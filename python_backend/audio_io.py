@@ -0,0 +1,176 @@
+import logging
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+# Lossless formats are written with libsndfile; lossy ones are encoded by FFmpeg at a chosen bitrate
+OUTPUT_FORMATS: Dict[str, Dict[str, Any]] = {
+    'wav': {'extension': 'wav', 'subtype': 'PCM_16'},
+    'flac': {'extension': 'flac', 'subtype': 'PCM_16'},
+    'ogg': {'extension': 'ogg', 'codec': 'libvorbis', 'bitrate': '192k'},
+    'opus': {'extension': 'opus', 'codec': 'libopus', 'bitrate': '128k', 'sample_rate': 48000},
+    'mp3': {'extension': 'mp3', 'codec': 'libmp3lame', 'bitrate': '192k'},
+}
+
+
+class FFmpegReader:
+    """
+    Decodes a file with FFmpeg and exposes its PCM stream through ``read(frames)``.
+
+    FFmpeg writes raw float32 samples to stdout, which are read straight into
+    NumPy buffers, so the decoded audio never touches disk. The interface
+    mirrors ``soundfile.SoundFile.read`` so both can feed ``ChunkedSeparator``.
+    """
+
+    def __init__(self, ffmpeg_path: str, input_path: str, sample_rate: int = 44100, channels: int = 2):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._frame_bytes = 4 * channels
+        self._stderr: List[bytes] = []
+        self._eof = False
+        self._process = subprocess.Popen(
+            [
+                ffmpeg_path,
+                "-nostdin",
+                "-loglevel", "error",
+                "-i", input_path,
+                "-f", "f32le",
+                "-acodec", "pcm_f32le",
+                "-ar", str(sample_rate),
+                "-ac", str(channels),
+                "pipe:1",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # Drain stderr in the background so a chatty decoder can never block on a full pipe
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def read(self, frames: int, dtype: str = 'float32', always_2d: bool = True) -> np.ndarray:
+        """Read up to ``frames`` frames; fewer are returned only at end of stream."""
+        wanted = frames * self._frame_bytes
+        data = self._process.stdout.read(wanted)
+        if len(data) < wanted:
+            self._eof = True
+        usable = len(data) - len(data) % self._frame_bytes
+        block = np.frombuffer(data[:usable], dtype='<f4').reshape(-1, self.channels)
+        if not always_2d and self.channels == 1:
+            block = block[:, 0]
+        return block.astype(dtype, copy=False)
+
+    def close(self):
+        """Wait for FFmpeg to exit and raise if decoding failed."""
+        if not self._eof:
+            # Stopped before end of stream; FFmpeg has nothing left to do
+            self._process.kill()
+        self._process.stdout.close()
+        returncode = self._process.wait()
+        self._stderr_thread.join()
+        if self._eof and returncode != 0:
+            message = b"".join(self._stderr).decode('utf-8', errors='replace')
+            raise RuntimeError(f"FFmpeg decoding failed: {message}")
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._eof = False
+        self.close()
+
+
+def read_all(reader, block_frames: int = 1 << 18) -> np.ndarray:
+    """Read a reader to the end into one array of shape (frames, channels)."""
+    blocks = []
+    while True:
+        block = reader.read(block_frames, dtype='float32', always_2d=True)
+        if len(block):
+            blocks.append(block)
+        if len(block) < block_frames:
+            break
+    if not blocks:
+        return np.zeros((0, reader.channels), dtype=np.float32)
+    return np.concatenate(blocks)
+
+
+class FFmpegWriter:
+    """Encodes float32 blocks with FFmpeg, fed through its stdin; same ``write``/``close`` as SoundFile."""
+
+    def __init__(
+        self,
+        ffmpeg_path: str,
+        path: str,
+        sample_rate: int,
+        channels: int,
+        codec: str,
+        bitrate: str,
+        output_sample_rate: Optional[int] = None,
+    ):
+        self.path = path
+        self._stderr: List[bytes] = []
+        self._process = subprocess.Popen(
+            [
+                ffmpeg_path,
+                "-loglevel", "error",
+                "-f", "f32le",
+                "-ar", str(sample_rate),
+                "-ac", str(channels),
+                "-i", "pipe:0",
+                "-c:a", codec,
+                "-b:a", bitrate,
+                "-ar", str(output_sample_rate or sample_rate),
+                "-y",
+                path,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def write(self, block: np.ndarray):
+        self._process.stdin.write(np.ascontiguousarray(block, dtype='<f4').tobytes())
+
+    def close(self):
+        """Flush the encoder and raise if FFmpeg failed."""
+        self._process.stdin.close()
+        returncode = self._process.wait()
+        self._stderr_thread.join()
+        if returncode != 0:
+            message = b"".join(self._stderr).decode('utf-8', errors='replace')
+            raise RuntimeError(f"FFmpeg encoding failed: {message}")
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line)
+
+
+def open_writer(
+    path: str,
+    output_format: str,
+    sample_rate: int,
+    channels: int,
+    ffmpeg_path: str = "ffmpeg",
+    bitrate: Optional[str] = None,
+):
+    """Open an audio writer for one of ``OUTPUT_FORMATS``."""
+    spec = OUTPUT_FORMATS[output_format]
+    if 'codec' in spec:
+        return FFmpegWriter(
+            ffmpeg_path, path, sample_rate, channels,
+            codec=spec['codec'],
+            bitrate=bitrate or spec['bitrate'],
+            output_sample_rate=spec.get('sample_rate'),
+        )
+    return sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, subtype=spec['subtype'])
@@ -1,23 +1,26 @@
-import librosa
 import numpy as np
-from spleeter.separator import Separator
-import tensorflow as tf
-from tensorflow.keras.models import load_model
 import os
 import soundfile as sf
+from model_registry import ModelRegistry
+from filters import FILTER_TYPES, FilterChain, filter_file
+from features import FeatureStore, detect_instruments, extract_features
+from result_cache import hash_pcm
 
 class AudioProcessor:
     def __init__(self):
-        self.separator = Separator('spleeter:4stems')  # Séparation en 4 pistes : voix, batterie, basse, autres
-        self.instrument_classifier = None  # À implémenter avec un modèle de classification
+        # Séparation en 4 pistes : voix, batterie, basse, autres. Le modèle est chargé au premier usage.
+        self.models = ModelRegistry()
+        # Caractéristiques mises en cache par empreinte audio (float16 .npy)
+        self.features = FeatureStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_cache"))
 
     def separate_tracks(self, audio_path):
         """Sépare l'audio en différentes pistes."""
         # Utilise Spleeter pour séparer les pistes
-        prediction = self.separator.separate_to_file(
-            audio_path,
-            os.path.dirname(audio_path)
-        )
+        with self.models.pool(4).acquire() as separator:
+            separator.separate_to_file(
+                audio_path,
+                os.path.dirname(audio_path)
+            )
         return {
             'vocals': f"{os.path.splitext(audio_path)[0]}/vocals.wav",
             'drums': f"{os.path.splitext(audio_path)[0]}/drums.wav",
@@ -27,39 +30,42 @@ class AudioProcessor:
 
     def identify_instruments(self, audio_path):
         """Identifie les instruments présents dans l'audio."""
-        y, sr = librosa.load(audio_path)
-        
-        # Extraction des caractéristiques
-        mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-        
-        # TODO: Implémenter la classification des instruments
-        # Pour l'instant, retourne une liste fictive d'instruments détectés
-        return ['guitar', 'drums', 'bass', 'piano']
+        # Une seule STFT par bloc, caractéristiques réutilisées si le même audio revient
+        with sf.SoundFile(audio_path) as source:
+            sr = source.samplerate
+            audio_hash = hash_pcm(source)
+
+            def compute():
+                source.seek(0)
+                return extract_features(source, sr)
+            features = self.features.get_or_compute(f"{audio_hash}-{sr}", compute)
+
+        detected = detect_instruments(features, sr)
+        return [instrument for instrument, info in detected.items() if info['present']]
 
     def apply_filter(self, audio_path, filter_type, parameters):
-        """Applique des filtres audio spécifiques."""
-        y, sr = librosa.load(audio_path)
-        
-        if filter_type == 'lowpass':
-            y_filtered = librosa.effects.preemphasis(y, coef=parameters.get('cutoff', 0.97))
-        elif filter_type == 'highpass':
-            y_filtered = y - librosa.effects.preemphasis(y, coef=parameters.get('cutoff', 0.97))
-        elif filter_type == 'isolate_frequency':
-            # Isoler une bande de fréquence spécifique
-            freq_range = parameters.get('freq_range', (500, 2000))
-            D = librosa.stft(y)
-            freq_mask = np.zeros_like(D)
-            freq_bins = librosa.fft_frequencies(sr=sr)
-            mask = (freq_bins >= freq_range[0]) & (freq_bins <= freq_range[1])
-            freq_mask[mask] = 1
-            y_filtered = librosa.istft(D * freq_mask)
-        else:
-            y_filtered = y
+        """Applique des filtres audio spécifiques (passe-bas, passe-haut, passe-bande, coupe-bande, égaliseur)."""
+        # Filtrage par blocs, à la fréquence et au nombre de canaux d'origine
+        with sf.SoundFile(audio_path) as source:
+            sr, channels = source.samplerate, source.channels
+            if filter_type not in FILTER_TYPES:
+                return source.read(dtype='float32'), sr
+            chain = FilterChain([{**parameters, 'type': filter_type}], sr, channels)
+            blocks = [
+                chain.process(block)
+                for block in source.blocks(blocksize=65536, dtype='float32', always_2d=True)
+            ]
+        y_filtered = np.concatenate(blocks) if blocks else np.zeros((0, channels), dtype=np.float32)
+        if y_filtered.shape[1] == 1:
+            y_filtered = y_filtered[:, 0]
 
         return y_filtered, sr
 
+    def filter_file(self, audio_path, output_path, filter_type, parameters):
+        """Filtre un fichier vers un autre sans le charger entièrement en mémoire."""
+        specs = [{**parameters, 'type': filter_type}] if filter_type in FILTER_TYPES else []
+        return filter_file(audio_path, output_path, specs)
+
     def save_audio(self, y, sr, output_path):
         """Sauvegarde l'audio traité."""
         sf.write(output_path, y, sr)
@@ -82,13 +88,13 @@ def process_audio():
         elif processing_type == 'identify':
             result = processor.identify_instruments(audio_path)
         elif processing_type == 'filter':
-            y_filtered, sr = processor.apply_filter(
+            output_path = f"{os.path.splitext(audio_path)[0]}_filtered.wav"
+            processor.filter_file(
                 audio_path,
+                output_path,
                 parameters.get('filter_type'),
                 parameters
             )
-            output_path = f"{os.path.splitext(audio_path)[0]}_filtered.wav"
-            processor.save_audio(y_filtered, sr, output_path)
             result = {'filtered_audio_path': output_path}
         else:
             return jsonify({'error': 'Invalid processing type'}), 400
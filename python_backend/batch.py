@@ -0,0 +1,97 @@
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from separation import CHANNELS, SeparatorPool
+
+logger = logging.getLogger(__name__)
+
+# Spleeter runs its U-Net over segments of T=512 STFT frames with a hop of 1024 samples
+SEGMENT_FRAMES = 512 * 1024
+# Silence kept between packed tracks, longer than one STFT frame (4096 samples)
+GUARD_FRAMES = 8192
+
+T = TypeVar('T')
+
+
+class BatchSeparator:
+    """
+    Separates several tracks in one Spleeter call.
+
+    Tracks are packed into a single waveform, each starting on a model
+    segment boundary and separated from its neighbours by silence, so
+    TensorFlow sees one large batch of segments instead of many small graph
+    calls. The stems are then cut back into per-track arrays.
+    """
+
+    def __init__(
+        self,
+        pool: SeparatorPool,
+        segment_frames: int = SEGMENT_FRAMES,
+        guard_frames: int = GUARD_FRAMES,
+        stems: Optional[Iterable[str]] = None,
+    ):
+        self.pool = pool
+        self.stems = set(stems) if stems is not None else None
+        self.segment_frames = segment_frames
+        self.guard_frames = guard_frames
+
+    def pack(self, waveforms: List[np.ndarray]) -> Tuple[np.ndarray, List[int]]:
+        """Lay tracks out on segment boundaries; return the packed waveform and offsets."""
+        offsets, end = [], 0
+        for waveform in waveforms:
+            start = -(-(end + (self.guard_frames if end else 0)) // self.segment_frames) * self.segment_frames
+            offsets.append(start)
+            end = start + len(waveform)
+        packed = np.zeros((end + self.guard_frames, CHANNELS), dtype=np.float32)
+        for waveform, start in zip(waveforms, offsets):
+            packed[start:start + len(waveform)] = waveform
+        return packed, offsets
+
+    def separate(self, waveforms: List[np.ndarray]) -> List[Dict[str, np.ndarray]]:
+        """Separate each waveform; returns one ``{stem: array}`` per input, in order."""
+        if not waveforms:
+            return []
+        packed, offsets = self.pack(waveforms)
+        with self.pool.acquire() as separator:
+            stems = separator.separate(packed)
+        return [
+            {
+                stem: np.asarray(data[start:start + len(waveform)], dtype=np.float32)
+                for stem, data in stems.items()
+                if self.stems is None or stem in self.stems
+            }
+            for waveform, start in zip(waveforms, offsets)
+        ]
+
+
+def packed_frames(frames: int, segment_frames: int = SEGMENT_FRAMES, guard_frames: int = GUARD_FRAMES) -> int:
+    """Frames a track of ``frames`` takes up in ``BatchSeparator.pack``, padding and guard included."""
+    return -(-(frames + guard_frames) // segment_frames) * segment_frames
+
+
+def iter_batches(
+    items: Iterable[Tuple[T, np.ndarray]],
+    max_frames: int,
+    segment_frames: int = SEGMENT_FRAMES,
+    guard_frames: int = GUARD_FRAMES,
+) -> Iterator[List[Tuple[T, np.ndarray]]]:
+    """
+    Group ``(key, waveform)`` pairs into batches that pack into at most ``max_frames`` frames.
+
+    Each track is charged the whole segments it occupies once packed, not
+    its own length, so many short tracks cannot add up to a packed
+    waveform far larger than the budget. A track over the budget on its
+    own still gets a batch of one.
+    """
+    batch, frames = [], 0
+    for key, waveform in items:
+        cost = packed_frames(len(waveform), segment_frames, guard_frames)
+        if batch and frames + cost > max_frames:
+            yield batch
+            batch, frames = [], 0
+        batch.append((key, waveform))
+        frames += cost
+    if batch:
+        yield batch
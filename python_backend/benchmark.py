@@ -0,0 +1,515 @@
+"""
+Benchmarks for the separation and MIDI pipelines.
+
+Generates synthetic audio and MIDI fixtures, times each pipeline stage on
+its own and writes a JSON report; ``compare`` checks a report against a
+baseline and exits non-zero on regressions.
+
+    python benchmark.py run --durations 10,60,600 --channels 1,2 --output current.json
+    python benchmark.py compare baseline.json current.json --threshold 0.15
+"""
+import argparse
+import json
+import logging
+import os
+import mmap
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import mido
+import numpy as np
+import soundfile as sf
+
+from audio_io import FFmpegReader, read_all
+from ingest import StreamingDecoder
+from midi_analysis import parse_midi
+from midi_processor import MidiProcessor, render_pool
+from model_registry import STEM_MAPPINGS, fake_factory, spleeter_factory
+from separation import CHANNELS, SAMPLE_RATE, ChunkedSeparator, SeparatorPool, StemFileWriter
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('upload', 'decode', 'separate', 'write', 'copy', 'midi_parse', 'midi_render')
+AUDIO_STAGES = STAGES[:5]
+UPLOAD_CHUNK_BYTES = 1 << 16
+BLOCK_FRAMES = 1 << 16
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def live_children() -> List[int]:
+    """Pids of this process's running children (Linux only; empty elsewhere)."""
+    pids = []
+    try:
+        for task in os.listdir('/proc/self/task'):
+            with open(f'/proc/self/task/{task}/children') as f:
+                pids.extend(int(pid) for pid in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def cpu_seconds() -> float:
+    """
+    CPU time of this process and its children.
+
+    Reaped children (FFmpeg) come from ``getrusage``; running ones, like the
+    MIDI render workers, are read from ``/proc`` since they never exit
+    between stages. Without ``resource`` (Windows) only this process counts.
+    """
+    total = time.process_time()
+    try:
+        import resource
+    except ImportError:
+        return total
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    total += children.ru_utime + children.ru_stime
+    for pid in live_children():
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime are fields 14 and 15 of stat; 12 and 13 after the command name
+        total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return total
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Lifetime peak, in KiB on Linux and bytes on macOS; the best left without psutil
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class PeakMemory:
+    """Samples this process's resident memory on a thread and keeps the peak."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self.peak = rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+
+def measure(function: Callable[[], Any]) -> Dict[str, float]:
+    """Wall time, CPU time and peak RSS of one call."""
+    cpu_before = cpu_seconds()
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        function()
+        wall = time.perf_counter() - started
+    return {
+        'wall_seconds': wall,
+        'cpu_seconds': cpu_seconds() - cpu_before,
+        'peak_rss_mb': memory.peak / 1024 ** 2,
+    }
+
+
+def write_audio_fixture(path: str, seconds: float, channels: int, sample_rate: int = SAMPLE_RATE, seed: int = 0):
+    """
+    Deterministic test signal: a bass line, a chord and decaying noise hits.
+
+    Generated and written block by block, so ten minutes never sit in memory.
+    """
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sample_rate)
+    # Slight detune per channel so channels are not identical
+    detune = 1.0 + 0.002 * np.arange(channels)
+    with sf.SoundFile(path, 'w', samplerate=sample_rate, channels=channels, subtype='PCM_16') as f:
+        for start in range(0, total, BLOCK_FRAMES):
+            t = (np.arange(start, min(start + BLOCK_FRAMES, total)) / sample_rate)[:, None]
+            beat = t % 0.5
+            signal = (
+                0.25 * np.sin(2 * np.pi * 55 * detune * t)
+                + 0.1 * sum(np.sin(2 * np.pi * freq * detune * t) for freq in (261.6, 329.6, 392.0))
+                + 0.2 * rng.standard_normal((len(t), channels)) * np.exp(-beat * 30)
+            )
+            f.write((0.8 * signal / 1.2).astype(np.float32))
+
+
+def encode_fixture(ffmpeg_path: str, wav_path: str, output_path: str, bitrate: str = '192k'):
+    subprocess.run(
+        [ffmpeg_path, '-y', '-nostdin', '-loglevel', 'error', '-i', wav_path, '-b:a', bitrate, output_path],
+        check=True,
+    )
+
+
+def write_midi_fixture(path: str, seconds: float, notes_per_second: float = 4.0):
+    """Four General MIDI parts (piano, bass, strings, drums) at 120 BPM for ``seconds``."""
+    ticks_per_beat = 480
+    step = int(ticks_per_beat * 2 / notes_per_second)  # 2 beats per second at 120 BPM
+    count = int(seconds * notes_per_second)
+    midi = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    parts = [('Piano', 0, 0, (60, 64, 67, 72)), ('Bass', 1, 33, (36, 43)), ('Strings', 2, 48, (55, 60)), ('Drums', 9, 0, (36, 38, 42))]
+    for name, channel, program, pitches in parts:
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage('track_name', name=name, time=0))
+        if channel == 0:
+            track.append(mido.MetaMessage('set_tempo', tempo=500000, time=0))
+        track.append(mido.Message('program_change', channel=channel, program=program, time=0))
+        for index in range(count):
+            pitch = pitches[index % len(pitches)]
+            track.append(mido.Message('note_on', channel=channel, note=pitch, velocity=90, time=0 if index == 0 else step // 2))
+            track.append(mido.Message('note_off', channel=channel, note=pitch, velocity=0, time=step // 2))
+        midi.tracks.append(track)
+    midi.save(path)
+
+
+class ArrayReader:
+    """``read(frames)`` over an in-memory array, so separation is timed without decoding."""
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.position = 0
+
+    @property
+    def channels(self) -> int:
+        return self.data.shape[1]
+
+    def read(self, frames: int, dtype: str = 'float32', always_2d: bool = True) -> np.ndarray:
+        block = self.data[self.position:self.position + frames]
+        self.position += len(block)
+        return block
+
+
+def make_separator_pool(kind: str, stems: int) -> SeparatorPool:
+    if kind == 'identity':
+        # No model cost at all: isolates chunking and stitching
+        return SeparatorPool(fake_factory(cost=0.0)(stems))
+    return SeparatorPool(spleeter_factory(stems))
+
+
+def describe(
+    result: Dict[str, Any],
+    fixture: str,
+    stage: str,
+    seconds: float,
+    processed_bytes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Label a ``run_stage`` result and add throughput: audio seconds and megabytes per wall second."""
+    wall = result['wall_seconds']
+    result.update(fixture=fixture, stage=stage, audio_seconds=seconds)
+    result['realtime_factor'] = seconds / wall if wall else None
+    if processed_bytes is not None:
+        result['mb_per_second'] = processed_bytes / 1024 ** 2 / wall if wall else None
+    logger.info("%s %s: %.3fs wall, %.3fs CPU, %.0f MB peak", fixture, stage, wall, result['cpu_seconds'], result['peak_rss_mb'])
+    return result
+
+
+def run_stage(function: Callable[[], Any], repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    """Median of ``repeat`` measured runs; ``setup`` runs untimed before each."""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        runs.append(measure(function))
+    return {
+        'wall_seconds': statistics.median(run['wall_seconds'] for run in runs),
+        'cpu_seconds': statistics.median(run['cpu_seconds'] for run in runs),
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'runs': [round(run['wall_seconds'], 4) for run in runs],
+    }
+
+
+def benchmark_audio(
+    ffmpeg_path: str,
+    work_dir: str,
+    seconds: float,
+    channels: int,
+    stages: List[str],
+    repeat: int,
+    input_format: str = 'mp3',
+    separator: str = 'identity',
+    stems: int = 4,
+    output_format: str = 'wav',
+) -> List[Dict[str, Any]]:
+    fixture = f"audio-{seconds:g}s-{channels}ch-{input_format}"
+    wav_path = os.path.join(work_dir, f"{fixture}.wav")
+    write_audio_fixture(wav_path, seconds, channels)
+    input_path = wav_path
+    if input_format != 'wav':
+        input_path = os.path.join(work_dir, f"{fixture}.{input_format}")
+        encode_fixture(ffmpeg_path, wav_path, input_path)
+    input_bytes = os.path.getsize(input_path)
+    stem_dir = os.path.join(work_dir, f"{fixture}-stems")
+    copy_dir = os.path.join(work_dir, f"{fixture}-copy")
+    results: List[Dict[str, Any]] = []
+
+    def record(stage: str, result: Dict[str, Any], processed_bytes: Optional[int] = None):
+        results.append(describe(result, fixture, stage, seconds, processed_bytes))
+
+    if 'upload' in stages:
+        spool_path = os.path.join(work_dir, "upload-spool.wav")
+
+        def upload():
+            # What /process-audio does per request: feed chunks to FFmpeg while spooling decoded PCM
+            decoder = StreamingDecoder(ffmpeg_path, spool_path, SAMPLE_RATE, CHANNELS, max_frames=1 << 40)
+            with open(input_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b''):
+                    decoder.feed(chunk)
+            decoder.finish()
+        record('upload', run_stage(upload, repeat), input_bytes)
+        os.remove(spool_path)
+
+    def decode():
+        with FFmpegReader(ffmpeg_path, input_path, SAMPLE_RATE, CHANNELS) as reader:
+            while len(reader.read(BLOCK_FRAMES)) == BLOCK_FRAMES:
+                pass
+
+    if 'decode' in stages:
+        record('decode', run_stage(decode, repeat), input_bytes)
+
+    if not {'separate', 'write', 'copy'} & set(stages):
+        return results
+    with FFmpegReader(ffmpeg_path, input_path, SAMPLE_RATE, CHANNELS) as reader:
+        audio = read_all(reader)
+
+    if 'separate' in stages:
+        engine = ChunkedSeparator(make_separator_pool(separator, stems))
+        try:
+            # Load the model before timing
+            with engine.pool.acquire():
+                pass
+        except Exception as e:
+            results.append({'fixture': fixture, 'stage': 'separate', 'skipped': f"{separator} separator unavailable: {e}"})
+        else:
+            result = run_stage(lambda: engine.separate(ArrayReader(audio), lambda blocks: None), repeat)
+            result['separator'] = separator
+            record('separate', result)
+
+    stem_names = list(STEM_MAPPINGS[stems].values())
+    extension = output_format
+
+    def write():
+        os.makedirs(stem_dir, exist_ok=True)
+        paths = {stem: os.path.join(stem_dir, f"{stem}.{extension}") for stem in stem_names}
+        share = audio / len(stem_names)
+        with StemFileWriter(paths, output_format=output_format, ffmpeg_path=ffmpeg_path) as writer:
+            for start in range(0, len(audio), BLOCK_FRAMES):
+                block = share[start:start + BLOCK_FRAMES]
+                writer({stem: block for stem in stem_names})
+
+    if 'write' in stages or 'copy' in stages:
+        if 'write' in stages:
+            record('write', run_stage(write, repeat))
+        else:
+            write()
+    if 'copy' in stages:
+        stem_bytes = sum(os.path.getsize(os.path.join(stem_dir, name)) for name in os.listdir(stem_dir))
+
+        def copy():
+            # Publishing stems into another directory, as the cache and storage tiers do
+            for name in os.listdir(stem_dir):
+                shutil.copyfile(os.path.join(stem_dir, name), os.path.join(copy_dir, name))
+        record('copy', run_stage(copy, repeat, setup=lambda: os.makedirs(copy_dir, exist_ok=True)), stem_bytes)
+    return results
+
+
+def benchmark_midi(work_dir: str, seconds: float, stages: List[str], repeat: int) -> List[Dict[str, Any]]:
+    fixture = f"midi-{seconds:g}s"
+    path = os.path.join(work_dir, f"{fixture}.mid")
+    write_midi_fixture(path, seconds)
+    results = []
+    if 'midi_parse' in stages:
+        result = describe(run_stage(lambda: parse_midi(path), repeat), fixture, 'midi_parse', seconds, os.path.getsize(path))
+        result['notes_per_second'] = len(parse_midi(path).notes) / result['wall_seconds']
+        results.append(result)
+    if 'midi_render' in stages:
+        processor = MidiProcessor()
+        instruments = processor.instruments(parse_midi(path))
+        output_dir = os.path.join(work_dir, f"{fixture}-render")
+        os.makedirs(output_dir, exist_ok=True)
+        # Start the worker processes before timing, as a running server would have them
+        list(render_pool().map(int, range(os.cpu_count() or 1)))
+        results.append(describe(
+            run_stage(lambda: processor.render_tracks(instruments, output_dir), repeat), fixture, 'midi_render', seconds,
+        ))
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    ffmpeg_path: str,
+    durations: List[float],
+    channel_layouts: List[int],
+    stages: List[str],
+    repeat: int = 3,
+    input_format: str = 'mp3',
+    separator: str = 'identity',
+    stems: int = 4,
+    output_format: str = 'wav',
+) -> Dict[str, Any]:
+    """Run every selected stage on every fixture and return the report."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as work_dir:
+        if set(stages) & set(AUDIO_STAGES):
+            for seconds in durations:
+                for channels in channel_layouts:
+                    results.extend(benchmark_audio(
+                        ffmpeg_path, work_dir, seconds, channels, stages, repeat,
+                        input_format=input_format, separator=separator, stems=stems, output_format=output_format,
+                    ))
+        if 'midi_parse' in stages or 'midi_render' in stages:
+            for seconds in durations:
+                results.extend(benchmark_midi(work_dir, seconds, stages, repeat))
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {
+            'durations': durations, 'channels': channel_layouts, 'stages': stages, 'repeat': repeat,
+            'input_format': input_format, 'separator': separator, 'stems': stems, 'output_format': output_format,
+        },
+        'results': results,
+    }
+
+
+def compare_reports(
+    baseline: Dict[str, Any],
+    current: Dict[str, Any],
+    threshold: float = 0.1,
+    min_seconds: float = 0.05,
+    min_rss_mb: float = 32.0,
+) -> List[Dict[str, Any]]:
+    """
+    Stages that got slower or hungrier than the baseline.
+
+    A stage regresses when its wall time grows by more than ``threshold``
+    (a fraction) and by at least ``min_seconds``, or its peak RSS grows by
+    more than ``threshold`` and ``min_rss_mb``; the absolute floors keep
+    timer noise on tiny fixtures from failing a run.
+
+    Returns:
+        One entry per regressed metric with both values and the change
+    """
+    previous = {(r['fixture'], r['stage']): r for r in baseline['results'] if 'skipped' not in r}
+    regressions = []
+    for result in current['results']:
+        before = previous.get((result['fixture'], result['stage']))
+        if before is None or 'skipped' in result:
+            continue
+        for metric, floor in (('wall_seconds', min_seconds), ('peak_rss_mb', min_rss_mb)):
+            old, new = before[metric], result[metric]
+            if new > old * (1 + threshold) and new - old >= floor:
+                regressions.append({
+                    'fixture': result['fixture'],
+                    'stage': result['stage'],
+                    'metric': metric,
+                    'baseline': round(old, 4),
+                    'current': round(new, 4),
+                    'change': round(new / old - 1, 3) if old else None,
+                })
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the benchmarks and write a JSON report")
+    run.add_argument('--durations', default='10,60,600', help="fixture lengths in seconds")
+    run.add_argument('--channels', default='1,2', help="channel layouts of the audio fixtures")
+    run.add_argument('--stages', default=','.join(STAGES), help=f"subset of {','.join(STAGES)}")
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--input-format', default='mp3', choices=['wav', 'mp3', 'flac', 'ogg'])
+    run.add_argument('--separator', default='identity', choices=['identity', 'spleeter'])
+    run.add_argument('--stems', type=int, default=4, choices=sorted(STEM_MAPPINGS))
+    run.add_argument('--output-format', default='wav', choices=['wav', 'flac', 'mp3', 'ogg', 'opus'])
+    run.add_argument('--ffmpeg', default=os.environ.get('FFMPEG_BINARY') or shutil.which('ffmpeg') or 'ffmpeg')
+    run.add_argument('--output', default='benchmark.json')
+
+    compare = commands.add_parser('compare', help="compare a report with a baseline; exit 1 on regressions")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.1, help="allowed relative slowdown")
+    compare.add_argument('--min-seconds', type=float, default=0.05)
+    compare.add_argument('--min-rss-mb', type=float, default=32.0)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'run':
+        stages = [stage for stage in args.stages.split(',') if stage]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {sorted(unknown)}")
+        report = run_benchmarks(
+            args.ffmpeg,
+            [float(value) for value in args.durations.split(',')],
+            [int(value) for value in args.channels.split(',')],
+            stages,
+            repeat=args.repeat,
+            input_format=args.input_format,
+            separator=args.separator,
+            stems=args.stems,
+            output_format=args.output_format,
+        )
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info("Wrote %d results to %s", len(report['results']), args.output)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_reports(baseline, current, args.threshold, args.min_seconds, args.min_rss_mb)
+    for r in regressions:
+        change = f" ({r['change']:+.1%})" if r['change'] is not None else ""
+        logger.error(f"REGRESSION {r['fixture']} {r['stage']} {r['metric']}: {r['baseline']} -> {r['current']}{change}")
+    if regressions:
+        logger.error("%d regression(s) against %s", len(regressions), args.baseline)
+        return 1
+    logger.info("No regressions against %s", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
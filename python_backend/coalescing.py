@@ -0,0 +1,78 @@
+import copy
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time; concurrent callers for a key share it.
+
+    The first caller for a key runs ``fn``. Callers arriving while it runs
+    wait for it and get the same result, or the same exception. Once it
+    finishes the key is forgotten, so later callers start a new run (and
+    normally find the result in the cache by then). Every caller gets its
+    own deep copy of the result, so one caller may mutate its result
+    without affecting the others.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            logger.info("Attached to in-flight computation %s", key)
+            return copy.deepcopy(future.result())
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return copy.deepcopy(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class KeyedLocks:
+    """One lock per key, created on first use and dropped once nobody holds or waits for it."""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._users: Dict[Hashable, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, key: Hashable) -> Iterator[None]:
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+            self._users[key] += 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key]
+                    del self._locks[key]
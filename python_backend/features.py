@@ -0,0 +1,264 @@
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+
+import librosa
+import numpy as np
+from scipy.fft import dct
+from numpy.lib.stride_tricks import sliding_window_view
+
+from separation import FrameLevels
+
+logger = logging.getLogger(__name__)
+
+# Same STFT as Spleeter, so frames line up with what the separator sees
+N_FFT = 4096
+HOP_LENGTH = 1024
+N_MELS = 64
+N_MFCC = 13
+
+# Column layout of a feature matrix (one row per STFT frame)
+COLUMNS = {
+    'mfcc': slice(0, N_MFCC),
+    'centroid': slice(N_MFCC, N_MFCC + 1),
+    'chroma': slice(N_MFCC + 1, N_MFCC + 13),
+    'rms': slice(N_MFCC + 13, N_MFCC + 14),
+    'bands': slice(N_MFCC + 14, N_MFCC + 17),  # energy share below 150 Hz, 200-4000 Hz, above 5 kHz
+    'flux': slice(N_MFCC + 17, N_MFCC + 18),
+}
+N_FEATURES = N_MFCC + 18
+
+# Logistic scorer per instrument over window descriptors: (weights, bias).
+# Hand-set weights; swap in fitted ones through ``detect_instruments(weights=...)``.
+INSTRUMENT_WEIGHTS: Dict[str, Any] = {
+    'vocals': ({'voice': 4.0, 'tonal': 10.0}, -10.0),
+    'drums': ({'flux': 6.0, 'high': 6.0}, -6.0),
+    'bass': ({'sub': 12.0}, -8.0),
+    'piano': ({'tonal': 6.0, 'flux': 6.0, 'high': -3.0}, -6.0),
+}
+SILENCE_DB = -50.0
+
+
+class FeatureExtractor:
+    """
+    Computes frame features from one shared STFT, fed block by block.
+
+    MFCC, spectral centroid, chroma, RMS, band energy shares and spectral
+    flux all come from the same power spectrum, so each frame is
+    transformed once. Only ``N_FFT`` samples are buffered between blocks.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.window = np.hanning(N_FFT + 1)[:-1].astype(np.float32)
+        self.freqs = np.fft.rfftfreq(N_FFT, 1.0 / sample_rate)
+        self.mel_basis = librosa.filters.mel(sr=sample_rate, n_fft=N_FFT, n_mels=N_MELS)
+        self.chroma_basis = librosa.filters.chroma(sr=sample_rate, n_fft=N_FFT)
+        self.band_masks = np.stack([
+            self.freqs < 150,
+            (self.freqs >= 200) & (self.freqs <= 4000),
+            self.freqs > 5000,
+        ]).astype(np.float32)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._seen = 0
+        self._consumed = 0  # absolute position of the first buffered sample
+        self._framed = 0  # samples covered by a frame so far
+        self._prev_log_mel: Optional[np.ndarray] = None
+        self._rows = []
+
+    def feed(self, block: np.ndarray):
+        """Add a (frames, channels) or mono block of samples."""
+        mono = block.mean(axis=1) if block.ndim == 2 else block
+        self._buffer = np.concatenate([self._buffer, mono.astype(np.float32, copy=False)])
+        self._seen += len(mono)
+        count = 0 if len(self._buffer) < N_FFT else (len(self._buffer) - N_FFT) // HOP_LENGTH + 1
+        if count:
+            self._analyse(self._buffer, count)
+            self._buffer = self._buffer[count * HOP_LENGTH:]
+            self._consumed += count * HOP_LENGTH
+
+    def finish(self) -> np.ndarray:
+        """Flush the last partial frame and return the (frames, ``N_FEATURES``) matrix."""
+        if self._seen > self._framed:
+            self._analyse(np.pad(self._buffer, (0, N_FFT - len(self._buffer))), 1)
+        rows = np.concatenate(self._rows) if self._rows else np.zeros((0, N_FEATURES), dtype=np.float32)
+        self._rows = []
+        return rows
+
+    def _analyse(self, samples: np.ndarray, count: int):
+        frames = sliding_window_view(samples, N_FFT)[::HOP_LENGTH][:count]
+        self._framed = self._consumed + (count - 1) * HOP_LENGTH + N_FFT
+        power = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+        magnitude = np.sqrt(power)
+
+        log_mel = 10 * np.log10(np.maximum(power @ self.mel_basis.T, 1e-10))
+        # Floor 80 dB below each frame's peak so numerical noise does not read as flux
+        log_mel = np.maximum(log_mel, log_mel.max(axis=1, keepdims=True) - 80)
+        mfcc = dct(log_mel, type=2, norm='ortho', axis=1)[:, :N_MFCC]
+        centroid = (magnitude @ self.freqs) / np.maximum(magnitude.sum(axis=1), 1e-10)
+        chroma = power @ self.chroma_basis.T
+        chroma /= np.maximum(chroma.max(axis=1, keepdims=True), 1e-10)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        bands = (power @ self.band_masks.T) / np.maximum(power.sum(axis=1, keepdims=True), 1e-10)
+
+        previous = log_mel[:1] if self._prev_log_mel is None else self._prev_log_mel
+        flux = np.maximum(np.diff(log_mel, axis=0, prepend=previous), 0).mean(axis=1)
+        self._prev_log_mel = log_mel[-1:]
+
+        self._rows.append(np.column_stack([
+            mfcc, centroid, chroma, rms, bands, flux,
+        ]).astype(np.float32))
+
+
+def extract_features(reader, sample_rate: int, block_frames: int = 1 << 16) -> np.ndarray:
+    """Feature matrix of everything a ``read(frames)`` reader yields."""
+    extractor = FeatureExtractor(sample_rate)
+    while True:
+        block = reader.read(block_frames, dtype='float32', always_2d=True)
+        if len(block) == 0:
+            break
+        extractor.feed(block)
+        if len(block) < block_frames:
+            break
+    return extractor.finish()
+
+
+def frame_levels(features: np.ndarray) -> FrameLevels:
+    """
+    Frame RMS of a feature matrix, for ``ChunkedSeparator``'s silence scan.
+
+    The RMS is of the mono downmix, so content cancelling out between
+    channels reads quieter than it is.
+    """
+    return FrameLevels(features[:, COLUMNS['rms']][:, 0], HOP_LENGTH, N_FFT)
+
+
+def window_descriptors(features: np.ndarray, sample_rate: int, window_seconds: float = 1.0) -> Dict[str, np.ndarray]:
+    """Average frame features over fixed windows into the descriptors the scorer uses."""
+    per_window = max(1, int(round(window_seconds * sample_rate / HOP_LENGTH)))
+    count = -(-len(features) // per_window)
+    padded = np.full((count * per_window, features.shape[1]), np.nan, dtype=np.float32)
+    padded[:len(features)] = features
+    means = np.nanmean(padded.reshape(count, per_window, -1), axis=1)
+
+    # Band shares on a 40 dB log scale, so a quiet source next to a loud one still registers
+    bands = np.clip(1.0 + 10 * np.log10(np.maximum(means[:, COLUMNS['bands']], 1e-10)) / 40.0, 0.0, 1.0)
+    return {
+        'loudness_db': 20 * np.log10(np.maximum(means[:, COLUMNS['rms']][:, 0], 1e-10)),
+        'sub': bands[:, 0],
+        'voice': bands[:, 1],
+        'high': bands[:, 2],
+        # 0 for a flat chroma, close to 1 when one pitch class dominates
+        'tonal': 1.0 - means[:, COLUMNS['chroma']].mean(axis=1),
+        # Mean positive log-mel change per frame, scaled so a dense onset train is near 1
+        'flux': np.clip(means[:, COLUMNS['flux']][:, 0] / 6.0, 0.0, 1.0),
+    }
+
+
+def detect_instruments(
+    features: np.ndarray,
+    sample_rate: int,
+    window_seconds: float = 1.0,
+    min_coverage: float = 0.1,
+    weights: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Score each instrument per window and decide which are present.
+
+    Args:
+        features: Matrix from ``FeatureExtractor``
+        sample_rate: Sample rate the features were computed at
+        window_seconds: Length of the scoring windows
+        min_coverage: Share of audible windows an instrument must be heard in
+        weights: ``{instrument: (weights, bias)}``, ``INSTRUMENT_WEIGHTS`` by default
+
+    Returns:
+        ``{instrument: {'present', 'coverage', 'score'}}``
+    """
+    weights = weights or INSTRUMENT_WEIGHTS
+    if len(features) == 0:
+        return {name: {'present': False, 'coverage': 0.0, 'score': 0.0} for name in weights}
+    descriptors = window_descriptors(features, sample_rate, window_seconds)
+    audible = descriptors['loudness_db'] > SILENCE_DB
+    result = {}
+    for name, (coefficients, bias) in weights.items():
+        logits = bias + sum(weight * descriptors[key] for key, weight in coefficients.items())
+        scores = np.where(audible, 1.0 / (1.0 + np.exp(-logits)), 0.0)
+        coverage = float((scores > 0.5).sum() / max(audible.sum(), 1))
+        result[name] = {
+            'present': bool(audible.any() and coverage >= min_coverage),
+            'coverage': round(coverage, 3),
+            'score': round(float(scores[audible].mean()) if audible.any() else 0.0, 3),
+        }
+    return result
+
+
+class FeatureStore:
+    """
+    Feature matrices on disk as float16 ``.npy`` files, keyed by audio hash.
+
+    Files are written to a temporary name and renamed into place. Once the
+    total size exceeds ``max_bytes`` the least recently used files are removed.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, audio_hash: str) -> str:
+        return os.path.join(self.root, f"{audio_hash}.npy")
+
+    def load(self, audio_hash: str) -> Optional[np.ndarray]:
+        """Stored features as float32, or None."""
+        path = self.path(audio_hash)
+        try:
+            features = np.load(path).astype(np.float32)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return features
+
+    def save(self, audio_hash: str, features: np.ndarray):
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, features.astype(np.float16))
+            os.replace(temp_path, self.path(audio_hash))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._evict()
+
+    def get_or_compute(self, audio_hash: str, compute) -> np.ndarray:
+        """Stored features for ``audio_hash``, computing and storing them on a miss."""
+        features = self.load(audio_hash)
+        if features is None:
+            features = compute()
+            self.save(audio_hash, features)
+        return features
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                if not name.endswith(".npy"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    continue
+                total -= size
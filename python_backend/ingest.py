@@ -0,0 +1,394 @@
+import hashlib
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+
+import multipart
+import soundfile as sf
+from multipart.multipart import parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+logger = logging.getLogger(__name__)
+
+# Bytes needed to recognise every supported container
+SNIFF_BYTES = 12
+# Bytes buffered before giving up on reading the duration from headers
+PROBE_BYTES = 1 << 16
+
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+class UploadRejected(Exception):
+    """An upload failed validation; carries the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Container of a file from its first bytes: wav, flac, ogg, mp3, midi or None."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'OggS':
+        return 'ogg'
+    if head[:4] == b'MThd':
+        return 'midi'
+    if head[:3] == b'ID3' or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def probe_duration(head: bytes, container: str) -> Optional[float]:
+    """
+    Duration in seconds read from the headers at the start of a file, if they state it.
+
+    WAV data chunk sizes, the FLAC STREAMINFO sample count and MP3 Xing/Info
+    frame counts are used; anything else (Ogg, CBR MP3, streamed WAV) is
+    measured while decoding instead.
+    """
+    try:
+        if container == 'wav':
+            return _probe_wav(head)
+        if container == 'flac':
+            return _probe_flac(head)
+        if container == 'mp3':
+            return _probe_mp3(head)
+    except (struct.error, IndexError, ZeroDivisionError):
+        return None
+    return None
+
+
+def _probe_wav(head: bytes) -> Optional[float]:
+    offset, byte_rate = 12, None
+    while offset + 8 <= len(head):
+        chunk_id, size = head[offset:offset + 4], struct.unpack_from('<I', head, offset + 4)[0]
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack_from('<I', head, offset + 16)[0]
+        elif chunk_id == b'data':
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF
+            if byte_rate and 0 < size < 0xFFFFFFFF - 64:
+                return size / byte_rate
+            return None
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def _probe_flac(head: bytes) -> Optional[float]:
+    # First metadata block is STREAMINFO; sample rate (20 bits) and total samples (36 bits) are packed
+    info = head[8:8 + 34]
+    packed = int.from_bytes(info[10:18], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+    return total_samples / sample_rate if sample_rate and total_samples else None
+
+
+def _probe_mp3(head: bytes) -> Optional[float]:
+    offset = 0
+    if head[:3] == b'ID3':
+        size = head[6:10]
+        offset = 10 + ((size[0] << 21) | (size[1] << 14) | (size[2] << 7) | size[3])
+    if offset + 4 > len(head) or head[offset] != 0xFF or head[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = (head[offset + 1] >> 3) & 3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    rate_index = (head[offset + 2] >> 2) & 3
+    # Version 1 and rate index 3 are reserved; such a header is not a real frame
+    if version not in MP3_SAMPLE_RATES or rate_index == 3:
+        return None
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    channel_mode = head[offset + 3] >> 6
+    samples_per_frame = 1152 if version == 3 else 576
+    # The Xing/Info header sits after the side information of the first frame
+    side_info = (32 if channel_mode != 3 else 17) if version == 3 else (17 if channel_mode != 3 else 9)
+    xing = offset + 4 + side_info
+    if head[xing:xing + 4] in (b'Xing', b'Info') and struct.unpack_from('>I', head, xing + 4)[0] & 1:
+        frames = struct.unpack_from('>I', head, xing + 8)[0]
+        return frames * samples_per_frame / sample_rate
+    return None
+
+
+class StreamingDecoder:
+    """
+    Decodes an upload while it arrives.
+
+    Encoded bytes go to FFmpeg's stdin; a reader thread takes the float32
+    PCM from stdout, hashes it the way ``result_cache.hash_pcm`` does and
+    spools it to a float WAV file. Decoding stops as soon as the audio runs
+    past ``max_frames``.
+    """
+
+    def __init__(self, ffmpeg_path: str, spool_path: str, sample_rate: int, channels: int, max_frames: int):
+        self.spool_path = spool_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_frames = max_frames
+        self.frames = 0
+        self.too_long = False
+        self._digest = hashlib.sha256()
+        self._error: Optional[BaseException] = None
+        self._stderr: List[bytes] = []
+        self._process = subprocess.Popen(
+            [
+                ffmpeg_path,
+                "-loglevel", "error",
+                "-i", "pipe:0",
+                "-f", "f32le",
+                "-acodec", "pcm_f32le",
+                "-ar", str(sample_rate),
+                "-ac", str(channels),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._reader = threading.Thread(target=self._read_pcm, name="upload-decoder", daemon=True)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._reader.start()
+        self._stderr_thread.start()
+
+    def feed(self, data: bytes):
+        """Pass encoded bytes to FFmpeg; blocks while the decoder catches up."""
+        self._check()
+        try:
+            self._process.stdin.write(data)
+        except (BrokenPipeError, ValueError):
+            # FFmpeg stopped reading: it was killed for length or failed; finish() reports which
+            self._reader.join()
+            self._check()
+
+    def finish(self) -> str:
+        """Wait for the decoder to drain and return the hash of the decoded audio."""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._reader.join()
+        returncode = self._process.wait()
+        self._stderr_thread.join()
+        self._check()
+        if returncode != 0 or self.frames == 0:
+            message = b"".join(self._stderr).decode('utf-8', errors='replace').strip()
+            raise UploadRejected(400, f"Could not decode audio: {message or 'no audio stream'}")
+        return self._digest.hexdigest()
+
+    def abort(self):
+        """Stop decoding and delete the spool."""
+        self._process.kill()
+        try:
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        self._reader.join()
+        self._process.wait()
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+    def _check(self):
+        if self.too_long:
+            raise UploadRejected(400, f"Audio file too long. Maximum duration is {self.max_frames / self.sample_rate / 60:g} minutes.")
+        if self._error is not None:
+            raise self._error
+
+    def _read_pcm(self, block_frames: int = 1 << 14):
+        frame_bytes = 4 * self.channels
+        try:
+            with sf.SoundFile(self.spool_path, 'w', samplerate=self.sample_rate, channels=self.channels, subtype='FLOAT') as spool:
+                while True:
+                    data = self._process.stdout.read(block_frames * frame_bytes)
+                    usable = len(data) - len(data) % frame_bytes
+                    if usable:
+                        self._digest.update(data[:usable])
+                        spool.buffer_write(data[:usable], dtype='float32')
+                        self.frames += usable // frame_bytes
+                        if self.frames > self.max_frames:
+                            self.too_long = True
+                            self._process.kill()
+                            return
+                    if len(data) < block_frames * frame_bytes:
+                        return
+        except Exception as e:
+            self._error = e
+            self._process.kill()
+        finally:
+            self._process.stdout.close()
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line)
+
+
+class IngestedUpload:
+    """Result of ``receive_upload``: form fields plus the spooled file."""
+
+    def __init__(
+        self, fields: Dict[str, str], filename: str, path: str, container: str, audio_hash: Optional[str], size: int,
+    ):
+        self.fields = fields
+        self.filename = filename
+        self.path = path
+        self.container = container
+        # Hash of the decoded PCM for audio; None for MIDI, which is spooled as is
+        self.audio_hash = audio_hash
+        # Bytes of the file as the client sent it; the spool of decoded audio is larger
+        self.size = size
+
+
+async def receive_upload(
+    request: Request,
+    ffmpeg_path: str,
+    sample_rate: int,
+    channels: int,
+    max_bytes: int,
+    max_seconds: float,
+    file_field: str = "file",
+) -> IngestedUpload:
+    """
+    Read a multipart upload from the request body, validating and decoding as it arrives.
+
+    The container is sniffed from the first bytes and the duration probed
+    from its headers, so unsupported or overlong files are refused before
+    the rest is sent. Audio is fed to FFmpeg chunk by chunk and spooled as
+    decoded PCM; size and decoded length are checked all along.
+
+    Raises:
+        UploadRejected: With 413 for oversize uploads, 415 for unknown
+            formats and 400 for malformed, undecodable or overlong audio
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes + PROBE_BYTES:
+        raise UploadRejected(413, f"Upload too large. Maximum size is {max_bytes // (1024 * 1024)} MB.")
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data upload.")
+
+    fields: Dict[str, str] = {}
+    state: Dict[str, Any] = {'headers': [], 'name': b"", 'value': b"", 'field': None, 'filename': None, 'data': b""}
+    pending: List[bytes] = []
+
+    def on_part_begin():
+        state.update(headers=[], field=None, filename=None, data=b"")
+
+    def on_header_field(data, start, end):
+        state['name'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state['value'] += data[start:end]
+
+    def on_header_end():
+        state['headers'].append((state['name'].lower(), state['value']))
+        state.update(name=b"", value=b"")
+
+    def on_headers_finished():
+        disposition = dict(state['headers']).get(b"content-disposition", b"")
+        _, options = parse_options_header(disposition)
+        state['field'] = options.get(b"name", b"").decode('utf-8', errors='replace')
+        if b"filename" in options:
+            state['filename'] = options[b"filename"].decode('utf-8', errors='replace')
+
+    def on_part_data(data, start, end):
+        if state['field'] == file_field and state['filename'] is not None:
+            pending.append(data[start:end])
+        else:
+            state['data'] += data[start:end]
+
+    def on_part_end():
+        if state['filename'] is None:
+            fields[state['field']] = state['data'].decode('utf-8', errors='replace')
+
+    parser = multipart.MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    head = b""  # first PROBE_BYTES of the file
+    unsent: List[bytes] = []  # received before the container was known
+    size = 0
+    filename = None
+    container = None
+    decoder: Optional[StreamingDecoder] = None
+    raw_file = None
+    spool_path = None
+    probed = False
+
+    async def start():
+        nonlocal container, decoder, raw_file, spool_path
+        container = sniff_format(head)
+        if container is None:
+            raise UploadRejected(415, "Unsupported file format. Please provide a WAV, MP3, OGG, FLAC or MIDI file.")
+        if container == 'midi':
+            raw_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mid")
+            spool_path = raw_file.name
+        else:
+            fd, spool_path = tempfile.mkstemp(suffix=".wav")
+            os.close(fd)
+            decoder = await run_in_threadpool(
+                StreamingDecoder, ffmpeg_path, spool_path, sample_rate, channels, int(max_seconds * sample_rate),
+            )
+
+    async def write(data: bytes):
+        if decoder is not None:
+            await run_in_threadpool(decoder.feed, data)
+        else:
+            await run_in_threadpool(raw_file.write, data)
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if not pending:
+                continue
+            data = b"".join(pending)
+            pending.clear()
+            filename = filename or state['filename']
+            size += len(data)
+            if size > max_bytes:
+                raise UploadRejected(413, f"Upload too large. Maximum size is {max_bytes // (1024 * 1024)} MB.")
+            if len(head) < PROBE_BYTES:
+                head += data[:PROBE_BYTES - len(head)]
+            if container is None:
+                unsent.append(data)
+                if len(head) < SNIFF_BYTES:
+                    continue
+                await start()
+                data = b"".join(unsent)
+                unsent.clear()
+            if not probed and decoder is not None:
+                duration = probe_duration(head, container)
+                if duration is not None and duration > max_seconds:
+                    raise UploadRejected(400, f"Audio file too long. Maximum duration is {max_seconds / 60:g} minutes.")
+                probed = duration is not None or len(head) >= PROBE_BYTES
+            await write(data)
+        parser.finalize()
+
+        if container is None:
+            if not head:
+                raise UploadRejected(400, f"Missing '{file_field}' upload.")
+            await start()
+            await write(head)
+        if decoder is not None:
+            audio_hash = await run_in_threadpool(decoder.finish)
+        else:
+            raw_file.close()
+            audio_hash = None
+    except BaseException:
+        if decoder is not None:
+            await run_in_threadpool(decoder.abort)
+        elif raw_file is not None:
+            raw_file.close()
+            os.remove(spool_path)
+        raise
+
+    return IngestedUpload(fields, filename or "upload", spool_path, container, audio_hash, size)
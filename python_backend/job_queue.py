@@ -0,0 +1,123 @@
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while every slot of the queue is taken."""
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Job:
+    def __init__(self, job_id: str):
+        self.id = job_id
+        self.status = 'queued'
+        self.result: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.future: Future = Future()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return a JSON-serialisable view of the job."""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded worker pool for long-running processing jobs.
+
+    At most ``max_workers`` jobs run at the same time and at most
+    ``max_queue_size`` more wait for a free worker; submitting beyond that
+    raises ``QueueFullError`` so callers can apply backpressure.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_size: int = 16, max_finished: int = 1000):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-worker")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs queued or running."""
+        with self._lock:
+            return self._in_flight
+
+    def submit(self, fn: Callable[..., Any], *args, job_id: Optional[str] = None, **kwargs) -> Job:
+        """Schedule ``fn(*args, **kwargs)`` and return its job handle."""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue_size:
+                raise QueueFullError("Job queue is full, please retry later.")
+            self._in_flight += 1
+            job = Job(job_id or new_job_id())
+            self._jobs[job.id] = job
+            self._prune()
+
+        try:
+            # Run under the submitter's context so the job logs with its request's trace id
+            context = contextvars.copy_context()
+            self._executor.submit(context.run, self._run, job, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = 'succeeded'
+            job.future.set_result(job.result)
+        except BaseException as e:
+            job.error = str(getattr(e, 'detail', e))
+            job.status = 'failed'
+            logger.error("Job %s failed: %s", job.id, job.error)
+            job.future.set_exception(e)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._in_flight -= 1
+
+    def _prune(self):
+        # Forget the oldest finished jobs once the history is full
+        excess = len(self._jobs) - self.max_finished
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].finished_at is not None:
+                del self._jobs[job_id]
+                excess -= 1
@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATABASE_NAME = "jobs.db"
+UNFINISHED = ('queued', 'running')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    options TEXT NOT NULL,
+    audio_hash TEXT,
+    upload_bytes INTEGER,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    window_config TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS windows (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+# Columns added since the first schema, for databases created before them
+MIGRATIONS = (
+    ("jobs", "window_config", "TEXT"),
+    ("windows", "skipped", "INTEGER NOT NULL DEFAULT 0"),
+    ("jobs", "upload_bytes", "INTEGER"),
+)
+
+
+class WindowCheckpoint:
+    """
+    Per-window separation results of one job, for ``ChunkedSeparator.separate``.
+
+    Windows are saved as compressed float16 ``.npz`` files renamed into
+    place once complete, then recorded in the store with the number of
+    frames skipped as silence, so a window is either fully checkpointed or
+    not at all. Saved windows only fit together under the window layout
+    they were cut with; ``match`` drops them when the layout has changed.
+    """
+
+    def __init__(self, store: "JobStore", job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.directory = os.path.join(store.job_dir(job_id), "windows")
+        os.makedirs(self.directory, exist_ok=True)
+        self.loaded = 0
+
+    def match(self, config: Dict[str, Any]):
+        """Record the window layout of this run, discarding windows saved under another one."""
+        if self.store._swap_window_config(self.job_id, config):
+            logger.warning("Window layout of job %s changed; separating it from the start", self.job_id)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+
+    def load(self, index: int) -> Optional[Tuple[Dict[str, np.ndarray], int]]:
+        """Stems and skipped frames of a completed window, or None if it still has to be separated."""
+        saved = self.store._window(self.job_id, index)
+        if saved is None:
+            return None
+        path, skipped = saved
+        try:
+            with np.load(path) as data:
+                stems = {stem: data[stem].astype(np.float32) for stem in data.files}
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable checkpoint %s: %s", path, e)
+            return None
+        self.loaded += 1
+        return stems, skipped
+
+    def save(self, index: int, stems: Dict[str, np.ndarray], skipped: int = 0):
+        path = os.path.join(self.directory, f"{index:06d}.npz")
+        partial = path + ".partial"
+        with open(partial, 'wb') as f:
+            # Half precision is well below what the stems are published with
+            np.savez_compressed(f, **{stem: data.astype(np.float16) for stem, data in stems.items()})
+        os.replace(partial, path)
+        self.store._record_window(self.job_id, index, path, skipped)
+
+
+class JobStore:
+    """
+    Jobs and their progress in SQLite, so work survives a restart.
+
+    Each job keeps its input file and window checkpoints in its own
+    directory until it finishes. Jobs still queued or running when the
+    process died are listed by ``unfinished`` and picked up again on
+    startup; completed windows are loaded instead of separated again.
+    Finished jobs keep their result row, the oldest ones beyond
+    ``max_finished`` are deleted.
+    """
+
+    def __init__(self, root: str, max_finished: int = 1000, max_attempts: int = 3):
+        self.root = root
+        self.max_finished = max_finished
+        # A job that keeps killing the process is given up after this many starts
+        self.max_attempts = max_attempts
+        os.makedirs(root, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, DATABASE_NAME), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(SCHEMA)
+            for table, column, definition in MIGRATIONS:
+                columns = [row['name'] for row in self._db.execute(f"PRAGMA table_info({table})")]
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.root, job_id)
+
+    def create(
+        self,
+        job_id: str,
+        input_path: str,
+        filename: str,
+        options: Optional[Dict[str, Any]] = None,
+        audio_hash: Optional[str] = None,
+        upload_bytes: Optional[int] = None,
+    ) -> str:
+        """Record a new job and move its input into the store; returns the new input path."""
+        directory = self.job_dir(job_id)
+        os.makedirs(directory, exist_ok=True)
+        stored_path = os.path.join(directory, "input" + os.path.splitext(input_path)[1])
+        shutil.move(input_path, stored_path)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, filename, input_path, options, audio_hash, upload_bytes, created_at)"
+                " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, stored_path, json.dumps(options or {}), audio_hash, upload_bytes, time.time()),
+            )
+        return stored_path
+
+    def start(self, job_id: str, checkpoint: bool = True) -> Optional[WindowCheckpoint]:
+        """Mark a job running and return its window checkpoint, unless ``checkpoint`` is false."""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1 WHERE id = ?", (job_id,))
+        return WindowCheckpoint(self, job_id) if checkpoint else None
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """Store the outcome of a job and delete its input and checkpoints."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                ('failed' if error is not None else 'succeeded', json.dumps(result) if result is not None else None,
+                 error, time.time(), job_id),
+            )
+            self._db.execute("DELETE FROM windows WHERE job_id = ?", (job_id,))
+            pruned = self._prune()
+        for old_id in [job_id] + pruned:
+            shutil.rmtree(self.job_dir(old_id), ignore_errors=True)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A job as ``Job.to_dict`` reports it, or None if the store does not know it."""
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            windows = self._db.execute("SELECT COUNT(*) FROM windows WHERE job_id = ?", (job_id,)).fetchone()[0]
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'finished_at': row['finished_at'],
+            'windows_done': windows,
+        }
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """
+        Jobs to resume, oldest first.
+
+        Jobs whose input is gone, or that were already started
+        ``max_attempts`` times, are marked failed instead.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", UNFINISHED,
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            if not os.path.exists(row['input_path']):
+                self.finish(row['id'], error="Input file was lost")
+            elif row['attempts'] >= self.max_attempts:
+                self.finish(row['id'], error=f"Gave up after {row['attempts']} attempts")
+            else:
+                jobs.append({
+                    'job_id': row['id'],
+                    'input_path': row['input_path'],
+                    'filename': row['filename'],
+                    'options': json.loads(row['options']),
+                    'audio_hash': row['audio_hash'],
+                    'upload_bytes': row['upload_bytes'],
+                })
+        return jobs
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _record_window(self, job_id: str, index: int, path: str, skipped: int):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO windows (job_id, idx, path, skipped) VALUES (?, ?, ?, ?)",
+                (job_id, index, path, skipped),
+            )
+
+    def _window(self, job_id: str, index: int) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, skipped FROM windows WHERE job_id = ? AND idx = ?", (job_id, index),
+            ).fetchone()
+        if row is None or not os.path.exists(row['path']):
+            return None
+        return row['path'], row['skipped']
+
+    def _swap_window_config(self, job_id: str, config: Dict[str, Any]) -> bool:
+        """Store a job's window layout; True if windows saved under a different one were dropped."""
+        encoded = json.dumps(config, sort_keys=True)
+        with self._lock:
+            row = self._db.execute("SELECT window_config FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            changed = row is not None and row['window_config'] is not None and row['window_config'] != encoded
+            if changed:
+                self._db.execute("DELETE FROM windows WHERE job_id = ?", (job_id,))
+            self._db.execute("UPDATE jobs SET window_config = ? WHERE id = ?", (encoded, job_id))
+        return changed
+
+    def _prune(self) -> List[str]:
+        # Forget the oldest finished jobs once the history is full
+        rows = self._db.execute(
+            "SELECT id FROM jobs WHERE status NOT IN (?, ?) ORDER BY finished_at DESC LIMIT -1 OFFSET ?",
+            UNFINISHED + (self.max_finished,),
+        ).fetchall()
+        old_ids = [row['id'] for row in rows]
+        self._db.executemany("DELETE FROM jobs WHERE id = ?", [(old_id,) for old_id in old_ids])
+        return old_ids
@@ -0,0 +1,310 @@
+"""
+Load test for the separation service.
+
+Uploads a weighted mix of generated audio fixtures to ``/process-audio`` (or
+to ``/jobs``, polling each job until it finishes) from a number of
+concurrent clients, and reports latency percentiles, throughput and error
+rates overall and per fixture.
+
+Start the server with the fake separator to load test without the model;
+``FAKE_SEPARATOR_COST`` sets the seconds of work per second of audio:
+
+    SEPARATOR=fake FAKE_SEPARATOR_COST=0.05 uvicorn main:app --port 8000
+    python loadtest.py --url http://localhost:8000 --concurrency 8 --requests 200 \\
+        --mix mp3:30:3,wav:10:1,flac:180:1 --output loadtest.json
+
+The service caches results by audio content, so every repeat of a fixture
+after the first is a cache hit; ``--variants`` generates distinct takes of
+each fixture to keep more of the requests on the separation path.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+from benchmark import encode_fixture, write_audio_fixture
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('wav', 'mp3', 'flac', 'ogg')
+CONTENT_TYPES = {'wav': 'audio/wav', 'mp3': 'audio/mpeg', 'flac': 'audio/flac', 'ogg': 'audio/ogg'}
+ENDPOINTS = ('process-audio', 'jobs')
+FINISHED = ('succeeded', 'failed')
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(spec: str) -> List[Dict[str, Any]]:
+    """
+    Parse ``format:seconds[:weight]`` entries, comma-separated, e.g. ``mp3:30:3,wav:10``.
+
+    Weights default to 1 and set how often a fixture is sent relative to the others.
+    """
+    mix = []
+    for entry in spec.split(','):
+        if not entry.strip():
+            continue
+        parts = entry.strip().split(':')
+        if len(parts) not in (2, 3) or parts[0].lower() not in FORMATS:
+            raise ValueError(f"Invalid mix entry {entry!r}; expected format:seconds[:weight] with a format in {FORMATS}")
+        seconds = float(parts[1])
+        weight = float(parts[2]) if len(parts) == 3 else 1.0
+        if seconds <= 0 or weight <= 0:
+            raise ValueError(f"Invalid mix entry {entry!r}; seconds and weight must be positive")
+        mix.append({'format': parts[0].lower(), 'seconds': seconds, 'weight': weight})
+    if not mix:
+        raise ValueError("The mix is empty")
+    return mix
+
+
+def build_fixtures(
+    mix: Sequence[Dict[str, Any]],
+    directory: str,
+    ffmpeg_path: str,
+    channels: int = 2,
+    variants: int = 1,
+) -> List[Dict[str, Any]]:
+    """Write ``variants`` distinct files per mix entry and load them for sending."""
+    fixtures = []
+    for entry in mix:
+        name = f"{entry['format']}_{entry['seconds']:g}s"
+        for variant in range(variants):
+            wav_path = os.path.join(directory, f"{name}_{variant}.wav")
+            write_audio_fixture(wav_path, entry['seconds'], channels, seed=variant)
+            path = wav_path
+            if entry['format'] != 'wav':
+                path = os.path.join(directory, f"{name}_{variant}.{entry['format']}")
+                encode_fixture(ffmpeg_path, wav_path, path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            fixtures.append({
+                'name': name,
+                'filename': os.path.basename(path),
+                'content_type': CONTENT_TYPES[entry['format']],
+                'seconds': entry['seconds'],
+                'weight': entry['weight'] / variants,
+                'data': data,
+            })
+    return fixtures
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """The ``q``-th percentile of ``values``, interpolating between the nearest ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: Sequence[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """
+    Latency percentiles, throughput and error rate of a set of requests.
+
+    Latencies are over successful requests only, so fast failures such
+    as 429s do not flatter them; failures are counted by status instead.
+    """
+    latencies = [sample['latency'] for sample in samples if sample['ok']]
+    errors = len(samples) - len(latencies)
+    summary: Dict[str, Any] = {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else None,
+        'statuses': dict(Counter(str(sample['status']) for sample in samples)),
+        'throughput_rps': round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        'audio_seconds_per_second': (
+            round(sum(sample['audio_seconds'] for sample in samples if sample['ok']) / wall_seconds, 3)
+            if wall_seconds else None
+        ),
+        'latency_mean': round(statistics.mean(latencies), 4) if latencies else None,
+        'latency_max': round(max(latencies), 4) if latencies else None,
+    }
+    for q in PERCENTILES:
+        value = percentile(latencies, q)
+        summary[f'latency_p{q}'] = round(value, 4) if value is not None else None
+    return summary
+
+
+async def send(
+    client: httpx.AsyncClient,
+    endpoint: str,
+    fixture: Dict[str, Any],
+    fields: Dict[str, str],
+    poll_interval: float = 0.25,
+) -> Dict[str, Any]:
+    """
+    Upload one fixture and wait for its result.
+
+    With ``jobs`` the latency runs until ``/jobs/{id}`` reports the job
+    finished; the time to the 202 is kept as ``accepted_latency``.
+    """
+    sample: Dict[str, Any] = {'fixture': fixture['name'], 'audio_seconds': fixture['seconds'], 'ok': False}
+    files = {'file': (fixture['filename'], fixture['data'], fixture['content_type'])}
+    started = time.perf_counter()
+    try:
+        response = await client.post(f"/{endpoint}", files=files, data=fields)
+        sample['status'] = response.status_code
+        if endpoint == 'jobs' and response.status_code == 202:
+            sample['accepted_latency'] = time.perf_counter() - started
+            job_id = response.json()['job_id']
+            while True:
+                await asyncio.sleep(poll_interval)
+                response = await client.get(f"/jobs/{job_id}")
+                if response.status_code != 200 or response.json()['status'] in FINISHED:
+                    break
+            if response.status_code == 200:
+                sample['status'] = response.json()['status']
+            else:
+                sample['status'] = response.status_code
+            sample['ok'] = sample['status'] == 'succeeded'
+        else:
+            sample['ok'] = response.status_code < 400
+    except httpx.HTTPError as e:
+        sample['status'] = type(e).__name__
+    sample['latency'] = time.perf_counter() - started
+    return sample
+
+
+async def run_load(
+    url: str,
+    fixtures: Sequence[Dict[str, Any]],
+    endpoint: str = 'process-audio',
+    concurrency: int = 4,
+    requests: Optional[int] = 100,
+    duration: Optional[float] = None,
+    fields: Optional[Dict[str, str]] = None,
+    timeout: float = 600.0,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """
+    Send requests from ``concurrency`` clients until ``requests`` were sent or ``duration`` is over.
+
+    Each client picks fixtures at random by weight and sends the next
+    request as soon as its previous one finished (a closed loop), so
+    ``concurrency`` is the number of requests in flight.
+    """
+    rng = random.Random(seed)
+    weights = [fixture['weight'] for fixture in fixtures]
+    samples: List[Dict[str, Any]] = []
+    sent = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_fixture() -> Optional[Dict[str, Any]]:
+        if requests is not None and sent[0] >= requests:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        sent[0] += 1
+        return rng.choices(fixtures, weights)[0]
+
+    async def client_loop(client: httpx.AsyncClient):
+        fixture = next_fixture()
+        while fixture is not None:
+            samples.append(await send(client, endpoint, fixture, fields or {}))
+            fixture = next_fixture()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    by_fixture = {}
+    for name in sorted({sample['fixture'] for sample in samples}):
+        by_fixture[name] = summarize([sample for sample in samples if sample['fixture'] == name], wall)
+    return {
+        'wall_seconds': round(wall, 3),
+        'overall': summarize(samples, wall),
+        'fixtures': by_fixture,
+    }
+
+
+def log_report(report: Dict[str, Any]):
+    header = f"{'fixture':<16}{'requests':>9}{'errors':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    logger.info(header)
+    rows = list(report['fixtures'].items()) + [('overall', report['overall'])]
+    for name, summary in rows:
+        cells = [summary[f'latency_p{q}'] for q in PERCENTILES]
+        latencies = ''.join(f"{cell:>9.3f}" if cell is not None else f"{'-':>9}" for cell in cells)
+        rps = summary['throughput_rps']
+        logger.info(f"{name:<16}{summary['requests']:>9}{summary['errors']:>8}{rps if rps is not None else '-':>9}{latencies}")
+    statuses = ', '.join(f"{status}: {count}" for status, count in sorted(report['overall']['statuses'].items()))
+    logger.info(f"statuses {statuses}; {report['wall_seconds']}s wall")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--endpoint', default='process-audio', choices=ENDPOINTS)
+    parser.add_argument('--concurrency', type=int, default=4, help="requests in flight at once")
+    parser.add_argument('--requests', type=int, default=100, help="requests to send in total")
+    parser.add_argument('--duration', type=float, help="seconds to keep sending; overrides --requests")
+    parser.add_argument('--mix', default='mp3:30', help="fixtures as format:seconds[:weight], comma-separated")
+    parser.add_argument('--variants', type=int, default=1, help="distinct takes of each fixture")
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--stems', help="stems form field, e.g. vocals,accompaniment")
+    parser.add_argument('--format', help="output format form field")
+    parser.add_argument('--timeout', type=float, default=600.0, help="seconds per HTTP request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-error-rate', type=float, default=0.0, help="exit 1 above this error rate")
+    parser.add_argument('--ffmpeg', default=os.environ.get('FFMPEG_BINARY') or shutil.which('ffmpeg') or 'ffmpeg')
+    parser.add_argument('--output', help="also write the report as JSON")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    fields = {name: value for name, value in (('stems', args.stems), ('format', args.format)) if value}
+
+    with tempfile.TemporaryDirectory(prefix="loadtest_") as directory:
+        fixtures = build_fixtures(mix, directory, args.ffmpeg, args.channels, max(1, args.variants))
+        logger.info(
+            "Sending %s to %s/%s from %d clients",
+            f"for {args.duration:g}s" if args.duration else f"{args.requests} requests",
+            args.url.rstrip('/'), args.endpoint, args.concurrency,
+        )
+        report = asyncio.run(run_load(
+            args.url, fixtures,
+            endpoint=args.endpoint,
+            concurrency=args.concurrency,
+            requests=None if args.duration else args.requests,
+            duration=args.duration,
+            fields=fields,
+            timeout=args.timeout,
+            seed=args.seed,
+        ))
+
+    report['config'] = {
+        'url': args.url,
+        'endpoint': args.endpoint,
+        'concurrency': args.concurrency,
+        'mix': mix,
+        'variants': args.variants,
+        'fields': fields,
+        'date': datetime.now(timezone.utc).isoformat(),
+    }
+    log_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info("Wrote report to %s", args.output)
+    error_rate = report['overall']['error_rate']
+    return 1 if error_rate is not None and error_rate > args.max_error_rate else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
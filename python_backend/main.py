@@ -1,9 +1,10 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import librosa
 import numpy as np
-from spleeter.separator import Separator
 import os
 import tempfile
 import soundfile as sf
@@ -11,107 +12,69 @@ import logging
 import warnings
 import shutil
 import subprocess
-import urllib.request
 import zipfile
-import tarfile
 import sys
+import asyncio
+import re
+import json
+import queue
+import time
 from midi_processor import MidiProcessor
-from typing import Dict, Any
+from job_queue import JobQueue, QueueFullError, new_job_id
+from job_store import JobStore, WindowCheckpoint
+from coalescing import KeyedLocks, SingleFlight
+from midi_analysis import MidiAnalyzer
+from separation import CHANNELS, SAMPLE_RATE, ChunkedSeparator, StemFileWriter
+from separation_workers import process_factory
+from stem_stream import StreamRegistry, StemStream, streaming_wav_header
+from batch import BatchSeparator, iter_batches
+from model_registry import (
+    OUTPUT_STEMS, STEM_MAPPINGS, ModelRegistry, fake_factory, model_name, select_model, spleeter_factory,
+)
+from audio_io import OUTPUT_FORMATS, FFmpegReader, read_all
+from filters import FilterChain, FilteredReader, parse_filter_specs
+from features import FeatureStore, detect_instruments, extract_features, frame_levels
+from result_cache import ResultCache, hash_pcm, make_cache_key
+from ingest import IngestedUpload, UploadRejected, receive_upload
+from storage import LocalStorage, S3Storage
+from stem_container import CONTAINER_FILE, StemContainer, StemContainerWriter
+from metrics import (
+    CONTENT_TYPE, JOB_QUEUE_DEPTH, PROCESSED_AUDIO_SECONDS, PROCESSED_BYTES, PROCESSED_FILES, STAGE_SECONDS,
+    MetricsMiddleware, StageClock, TimedReader, TraceIdFilter, render_metrics,
+)
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging; each line carries the trace id of the request it belongs to
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+for handler in logging.getLogger().handlers:
+    handler.addFilter(TraceIdFilter())
 logger = logging.getLogger(__name__)
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
 
-# Create pretrained_models directory if it doesn't exist
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODELS_DIR = os.path.join(BASE_DIR, "pretrained_models")
-CHECKPOINT_DIR = os.path.join(MODELS_DIR, "5stems")
-os.makedirs(MODELS_DIR, exist_ok=True)
-
-def download_file(url, filename):
-    """Download a file with progress indication"""
-    logger.info(f"Downloading {url} to {filename}")
-    try:
-        urllib.request.urlretrieve(url, filename)
-        return True
-    except Exception as e:
-        logger.error(f"Error downloading file: {str(e)}")
-        return False
-
-# Check if model exists, if not download it
-def ensure_model():
-    checkpoint_path = os.path.join(CHECKPOINT_DIR, "model.data-00000-of-00001")
-    if not os.path.exists(checkpoint_path):
-        logger.info("Downloading Spleeter 5stems model...")
-        model_url = "https://github.com/deezer/spleeter/releases/download/v1.4.0/5stems.tar.gz"
-        temp_file = os.path.join(tempfile.gettempdir(), "5stems.tar.gz")
-        
-        try:
-            # Download the model
-            if not download_file(model_url, temp_file):
-                raise Exception("Failed to download model file")
-            
-            logger.info("Model downloaded, extracting...")
-            
-            # Extract using tarfile module
-            with tarfile.open(temp_file, 'r:gz') as tar:
-                # Create the target directory if it doesn't exist
-                os.makedirs(CHECKPOINT_DIR, exist_ok=True)
-                
-                # Extract all files to the checkpoint directory
-                tar.extractall(path=CHECKPOINT_DIR)
-            
-            logger.info("Model extracted successfully")
-            
-            # Verify the model files exist
-            required_files = [
-                "model.data-00000-of-00001",
-                "model.index",
-                "model.meta"
-            ]
-            
-            missing_files = [
-                f for f in required_files
-                if not os.path.exists(os.path.join(CHECKPOINT_DIR, f))
-            ]
-            
-            if missing_files:
-                raise Exception(f"Missing model files: {missing_files}")
-            
-            logger.info("Model files verified successfully")
-            
-        except Exception as e:
-            logger.error(f"Error setting up model: {str(e)}")
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-            raise
-        finally:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-                logger.info("Cleaned up temporary file")
-
-# Call ensure_model before initializing separator
-ensure_model()
-
-# Get FFmpeg path
-FFMPEG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "ffmpeg", "ffmpeg-7.1-essentials_build", "bin", "ffmpeg.exe"))
+# Get FFmpeg path, preferring the bundled build and falling back to the one on PATH
+BUNDLED_FFMPEG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "ffmpeg", "ffmpeg-7.1-essentials_build", "bin", "ffmpeg.exe"))
+FFMPEG_PATH = BUNDLED_FFMPEG_PATH if os.path.exists(BUNDLED_FFMPEG_PATH) else (shutil.which("ffmpeg") or BUNDLED_FFMPEG_PATH)
 logger.info(f"Looking for FFmpeg at: {FFMPEG_PATH}")
 
 if not os.path.exists(FFMPEG_PATH):
     raise RuntimeError(f"FFmpeg not found at {FFMPEG_PATH}")
 
-# Test FFmpeg
-try:
-    result = subprocess.run([FFMPEG_PATH, "-version"], capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError("FFmpeg test failed")
-    logger.info("FFmpeg test successful")
-except Exception as e:
-    logger.error(f"FFmpeg test failed: {str(e)}")
-    raise
+# Outcome of the FFmpeg self-test, which runs in the background after startup
+ffmpeg_status = {'state': 'unchecked', 'error': None}
+
+def check_ffmpeg():
+    """Test FFmpeg"""
+    try:
+        result = subprocess.run([FFMPEG_PATH, "-version"], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError("FFmpeg test failed")
+        ffmpeg_status['state'] = 'ready'
+        logger.info("FFmpeg test successful")
+    except Exception as e:
+        ffmpeg_status.update(state='failed', error=str(e))
+        logger.error(f"FFmpeg test failed: {str(e)}")
 
 # Set FFmpeg path in environment
 os.environ["PATH"] = os.path.dirname(FFMPEG_PATH) + os.pathsep + os.environ["PATH"]
@@ -127,191 +90,1073 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Trace ids and request metrics; added last so it wraps everything else
+app.add_middleware(MetricsMiddleware)
 
-# Initialize Spleeter separator with five stems (vocals, drums, bass, piano, other)
-separator = Separator('spleeter:5stems', multiprocess=False)
+# Spleeter separators are loaded lazily, one warm instance per separation worker.
+# The five stem model gives vocals, drums, bass, piano and other.
+STEMS = 5
+SEPARATION_WORKERS = int(os.environ.get("SEPARATION_WORKERS", "1"))
+WARM_UP_MODELS = [int(n) for n in os.environ.get("WARM_UP_MODELS", str(STEMS)).split(",") if n]
+# "thread" keeps separators in this process; "process" runs each in its own
+# worker pinned to a slice of the CPUs, which is what scales on many cores
+SEPARATION_MODE = os.environ.get("SEPARATION_MODE", "thread").lower()
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0")) or None
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "1"))
+# "fake" swaps Spleeter for FakeSeparator, which costs FAKE_SEPARATOR_COST seconds per
+# second of audio (sleeping, or spinning with FAKE_SEPARATOR_MODE=cpu); for load tests
+SEPARATOR = os.environ.get("SEPARATOR", "spleeter").lower()
+FAKE_SEPARATOR_COST = float(os.environ.get("FAKE_SEPARATOR_COST", "0.05"))
+FAKE_SEPARATOR_MODE = os.environ.get("FAKE_SEPARATOR_MODE", "sleep").lower()
+if SEPARATOR == "fake":
+    separator_factory = fake_factory(FAKE_SEPARATOR_COST, busy=FAKE_SEPARATOR_MODE == "cpu")
+    logger.warning("Using FakeSeparator (%.3fs per audio second, %s); stems are not real", FAKE_SEPARATOR_COST, FAKE_SEPARATOR_MODE)
+else:
+    separator_factory = spleeter_factory
+if SEPARATION_MODE == "process":
+    separator_factory = process_factory(separator_factory, SEPARATION_WORKERS, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS)
+model_registry = ModelRegistry(pool_size=SEPARATION_WORKERS, factory=separator_factory)
+
+# Long files are separated in overlapping windows so memory stays bounded
+CHUNK_SECONDS = float(os.environ.get("CHUNK_SECONDS", "30"))
+CHUNK_OVERLAP_SECONDS = float(os.environ.get("CHUNK_OVERLAP_SECONDS", "1"))
+# Windows quieter than this (RMS, dBFS) are not separated; empty disables the scan
+SILENCE_THRESHOLD_DB = os.environ.get("SILENCE_THRESHOLD_DB", "-60")
+SILENCE_THRESHOLD_DB = float(SILENCE_THRESHOLD_DB) if SILENCE_THRESHOLD_DB else None
+MAX_DURATION_SECONDS = float(os.environ.get("MAX_DURATION_SECONDS", "3600"))
+
+# Single-file uploads are validated and decoded while they arrive; see ingest.receive_upload
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(1024 ** 3)))
+
+# Batch requests pack short files together into one separation call; the
+# limit is on the packed length, where each file fills whole model segments
+BATCH_MAX_SECONDS = float(os.environ.get("BATCH_MAX_SECONDS", "300"))
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "500"))
 
 # Create and mount static file directory
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "processed")
 os.makedirs(STATIC_DIR, exist_ok=True)
 app.mount("/processed", StaticFiles(directory=STATIC_DIR), name="processed")
+# Address clients reach this server at, for the URLs it hands out
+BASE_URL = os.environ.get("PUBLIC_BASE_URL", "http://localhost:8000").rstrip('/')
+
+# Live stem spools of running jobs, for playback before separation finishes
+STREAM_DIR = os.path.join(os.path.dirname(__file__), "streams")
+stem_streams = StreamRegistry(STREAM_DIR)
+# How often stream listeners check for new audio; waiting happens on the event loop, not in a thread
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", "0.25"))
+
+# Separation results keyed by a hash of the decoded audio, model and settings
+CACHE_DIR = os.path.join(STATIC_DIR, "cache")
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+
+# Where results are served from: the local cache under /processed, or an
+# S3-compatible bucket shared by all replicas, with the local cache as a hot tier
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").lower()
+if STORAGE_BACKEND == "s3":
+    storage = S3Storage(
+        os.environ.get("S3_BUCKET", "audiofilter"),
+        endpoint_url=os.environ.get("S3_ENDPOINT_URL") or None,
+        public_endpoint_url=os.environ.get("S3_PUBLIC_ENDPOINT_URL") or None,
+        prefix=os.environ.get("S3_PREFIX", "results/"),
+        url_expiry=int(os.environ.get("S3_URL_EXPIRY", "3600")),
+    )
+else:
+    storage = LocalStorage(f"{BASE_URL}/processed/cache")
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES, storage=storage)
+# Besides the encoded stems, keep all stems of a result in one memory-mapped
+# container, served by time and byte range from /results/<key>/<stem>
+STEM_CONTAINER = os.environ.get("STEM_CONTAINER", "1") == "1"
+
+# Frame features (float16) keyed by the same audio hash; detection computes them,
+# separation reuses their frame RMS for its silence scan when they are there
+FEATURE_DIR = os.path.join(os.path.dirname(__file__), "feature_cache")
+FEATURE_CACHE_MAX_BYTES = int(os.environ.get("FEATURE_CACHE_MAX_BYTES", str(1024 ** 3)))
+feature_store = FeatureStore(FEATURE_DIR, FEATURE_CACHE_MAX_BYTES)
+
+# Stems that hold whatever is left over; they are never skipped as absent
+RESIDUAL_STEMS = {'accompaniment', 'other'}
+
+# Bounded worker pool so separation never runs on the event loop
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "2"))
+MAX_QUEUE_SIZE = int(os.environ.get("MAX_QUEUE_SIZE", "16"))
+job_queue = JobQueue(max_workers=MAX_WORKERS, max_queue_size=MAX_QUEUE_SIZE)
+# Identical work already running is joined rather than repeated; output
+# directories shared by name are written by one job at a time
+in_flight = SingleFlight()
+output_locks = KeyedLocks()
+# Uploaded inputs and finished separation windows of single-file jobs, so
+# jobs interrupted by a restart resume from their last completed window
+JOB_STORE_DIR = os.environ.get("JOB_STORE_DIR", os.path.join(os.path.dirname(__file__), "job_store"))
+job_store = JobStore(JOB_STORE_DIR)
+# Windows are only checkpointed for files at least this long; shorter ones
+# are cheaper to separate again than to write out window by window
+CHECKPOINT_MIN_SECONDS = float(os.environ.get("CHECKPOINT_MIN_SECONDS", "600"))
+JOB_QUEUE_DEPTH.set_function(lambda: job_queue.depth)
+
+# Stems published when a request does not ask for specific ones
+DEFAULT_STEMS = list(STEM_MAPPINGS[STEMS].values())
+SUPPORTED_AUDIO_EXTENSIONS = ['.wav', '.mp3', '.ogg']
 
 class AudioProcessor:
-    def __init__(self):
-        self.separator = separator
+    def __init__(
+        self,
+        stems: Optional[List[str]] = None,
+        output_format: str = 'wav',
+        bitrate: Optional[str] = None,
+        filters: Optional[List[Dict[str, Any]]] = None,
+        skip_absent: bool = False,
+    ):
+        # Only the requested stems are written, using the cheapest model that provides them
+        self.stems = sorted(stems or DEFAULT_STEMS)
+        self.model_stems = select_model(self.stems)
+        self.stem_mapping = {
+            original_stem: mapped_stem
+            for original_stem, mapped_stem in STEM_MAPPINGS[self.model_stems].items()
+            if mapped_stem in self.stems
+        }
+        self.separator = ChunkedSeparator(
+            model_registry.pool(self.model_stems),
+            chunk_seconds=CHUNK_SECONDS,
+            overlap_seconds=CHUNK_OVERLAP_SECONDS,
+            stems=self.stem_mapping,
+            silence_threshold_db=SILENCE_THRESHOLD_DB,
+        )
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.filters = filters or []
+        # Detect instruments first and do not separate stems that are not in the mix
+        self.skip_absent = skip_absent
         self.midi_processor = MidiProcessor()
         
-    async def process_file(self, file_path: str, output_dir: str) -> Dict[str, Any]:
-        """Process an audio or MIDI file."""
+    def cache_config(self) -> Dict[str, Any]:
+        """Settings besides the model that change the separated output."""
+        return {
+            'chunk_frames': self.separator.chunk_frames,
+            'overlap_frames': self.separator.overlap_frames,
+            'silence_threshold_db': self.separator.silence_threshold_db,
+            'sample_rate': self.separator.sample_rate,
+            'format': self.output_format,
+            'bitrate': self.bitrate,
+            'filters': self.filters,
+            'stems': self.stems,
+            'container': STEM_CONTAINER,
+        }
+    
+    def validate_audio(self, file_path: str) -> float:
+        """Check format and duration of an audio file and return its duration."""
+        # Get lowercase file extension
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext not in SUPPORTED_AUDIO_EXTENSIONS:
+            raise ValueError('Unsupported file format. Please provide a WAV, MP3, OGG, or MIDI file.')
+        
+        # Check audio duration
+        duration = librosa.get_duration(filename=file_path)
+        if duration > MAX_DURATION_SECONDS:
+            raise ValueError(f'Audio file too long. Maximum duration is {MAX_DURATION_SECONDS / 60:g} minutes.')
+        return duration
+    
+    def audio_hash(self, file_path: str) -> str:
+        """Hash of the decoded audio, which keys both separation results and features."""
+        with FFmpegReader(FFMPEG_PATH, file_path) as reader:
+            return hash_pcm(reader)
+    
+    def cache_key(self, audio_hash: str) -> str:
+        """Identical audio with the same model and settings maps to the same cache entry."""
+        return make_cache_key(audio_hash, model_name(self.model_stems), self.cache_config())
+    
+    def detect_instruments(self, file_path: str, audio_hash: str) -> Dict[str, Dict[str, Any]]:
+        """Instrument presence per ``features.detect_instruments``, reusing cached features."""
+        def compute():
+            with FFmpegReader(FFMPEG_PATH, file_path) as reader:
+                return extract_features(reader, SAMPLE_RATE)
+        return detect_instruments(feature_store.get_or_compute(audio_hash, compute), SAMPLE_RATE)
+    
+    def frame_levels(self, audio_hash: str):
+        """
+        Frame RMS from features already cached for this audio, for the silence scan.
+        
+        None when silence skipping is off, nothing is cached, or filters
+        change the audio the features were computed from.
+        """
+        if self.separator.silence_power is None or self.filters:
+            return None
+        features = feature_store.load(audio_hash)
+        return frame_levels(features) if features is not None else None
+    
+    def without_absent(self, instruments: Dict[str, Dict[str, Any]]) -> Optional['AudioProcessor']:
+        """
+        Processor for the requested stems whose instrument was detected.
+        
+        Returns ``self`` when nothing is dropped and None when no stem is left.
+        """
+        absent = {
+            STEM_MAPPINGS[5][instrument]
+            for instrument, info in instruments.items()
+            if not info['present'] and instrument in STEM_MAPPINGS[5]
+        } - RESIDUAL_STEMS
+        stems = [stem for stem in self.stems if stem not in absent]
+        if stems == self.stems:
+            return self
+        if not stems:
+            return None
+        logger.info("Skipping absent stems %s", sorted(set(self.stems) - set(stems)))
+        return AudioProcessor(stems, self.output_format, self.bitrate, self.filters)
+    
+    def open_reader(self, file_path: str):
+        """Decode a file through FFmpeg, applying the requested filters block by block."""
+        reader = FFmpegReader(FFMPEG_PATH, file_path)
+        if not self.filters:
+            return reader
+        return FilteredReader(reader, FilterChain(self.filters, SAMPLE_RATE, CHANNELS))
+    
+    def open_stem_writer(self, stem_paths: Dict[str, str]) -> StemFileWriter:
+        """Writer encoding each stem in the requested output format, and into the stem container."""
+        container = None
+        if STEM_CONTAINER and stem_paths:
+            # The container goes next to the stem files, in the same staging directory
+            container_path = os.path.join(os.path.dirname(next(iter(stem_paths.values()))), CONTAINER_FILE)
+            container = StemContainerWriter(container_path, self.stem_mapping, SAMPLE_RATE, CHANNELS)
+        return StemFileWriter(
+            stem_paths,
+            output_format=self.output_format,
+            bitrate=self.bitrate,
+            ffmpeg_path=FFMPEG_PATH,
+            container=container,
+        )
+    
+    def store_stems(self, cache_key: str, write: Callable[[Dict[str, str]], int]) -> Dict[str, Dict[str, Any]]:
+        """
+        Have ``write`` fill per-stem paths in a staging directory, then publish them to the cache.
+        
+        ``write`` returns the number of frames written per stem, which gives
+        the duration reported alongside each file's format and size.
+        """
+        staging_dir = result_cache.create_staging()
+        try:
+            extension = OUTPUT_FORMATS[self.output_format]['extension']
+            stem_paths = {
+                original_stem: os.path.join(staging_dir, f"{mapped_stem}.{extension}")
+                for original_stem, mapped_stem in self.stem_mapping.items()
+            }
+            frames = write(stem_paths)
+            separated_files = {
+                self.stem_mapping[stem]: {
+                    'file': os.path.basename(path),
+                    'format': self.output_format,
+                    'size': os.path.getsize(path),
+                    'duration': round(frames / SAMPLE_RATE, 3),
+                }
+                for stem, path in stem_paths.items()
+                if os.path.exists(path)
+            }
+            container_path = os.path.join(staging_dir, CONTAINER_FILE)
+            if os.path.exists(container_path):
+                separated_files['container'] = {
+                    'file': CONTAINER_FILE,
+                    'format': 'afs',
+                    'size': os.path.getsize(container_path),
+                    'duration': round(frames / SAMPLE_RATE, 3),
+                }
+            return result_cache.publish(cache_key, staging_dir, separated_files)
+        except Exception:
+            result_cache.discard(staging_dir)
+            raise
+    
+    def process_midi(self, file_path: str, output_dir: str) -> Dict[str, Any]:
+        # Identical files rendering to the same directory share one run; different
+        # files with the same name take turns so neither sees the other's partial output
+        output_dir = os.path.abspath(output_dir)
+        
+        def render():
+            with output_locks.hold(output_dir):
+                return self.midi_processor.process_midi(file_path, output_dir)
+        
+        result = in_flight.run(('midi', MidiAnalyzer.file_hash(file_path), output_dir), render)
+        # Convert numpy.int32 to native Python int
+        if isinstance(result, np.int32):
+            result = int(result)
+        return {
+            'status': 'success',
+            'type': 'midi',
+            'analysis': result
+        }
+        
+    def process_file(
+        self,
+        file_path: str,
+        output_dir: str,
+        stream: Optional[StemStream] = None,
+        audio_hash: Optional[str] = None,
+        checkpoint: Optional[WindowCheckpoint] = None,
+        upload_bytes: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Process an audio or MIDI file. Blocking, meant to run on a job worker.
+        
+        When ``stream`` is given, stems are also spooled to it in time order
+        as each window is stitched, so clients can play them before the job ends.
+        ``audio_hash`` saves decoding the file again when ingestion already hashed it.
+        With a ``checkpoint``, separated windows are saved as they finish and
+        windows saved by an earlier, interrupted run are not separated again.
+        ``upload_bytes`` is the size of the upload as sent, counted instead of
+        the size of ``file_path`` when that is a spool of the decoded audio.
+        """
         try:
-            # Get lowercase file extension
-            file_ext = os.path.splitext(file_path)[1].lower()
-            
             # Check if it's a MIDI file using MidiProcessor's validation
             if self.midi_processor.is_midi_file(file_path):
-                result = self.midi_processor.process_midi(file_path, output_dir)
-                # Convert numpy.int32 to native Python int
-                if isinstance(result, np.int32):
-                    result = int(result)
-                return {
-                    'status': 'success',
-                    'type': 'midi',
-                    'analysis': result
-                }
-            
-            # If not MIDI, check if it's a supported audio format
-            if file_ext not in ['.wav', '.mp3', '.ogg']:
-                raise ValueError('Unsupported file format. Please provide a WAV, MP3, OGG, or MIDI file.')
-            
-            # Check audio duration
-            duration = librosa.get_duration(filename=file_path)
-            if duration > 600:  # 10 minutes
-                raise ValueError('Audio file too long. Maximum duration is 10 minutes.')
-            
-            # Create output directory
-            output_base_dir = os.path.join(os.path.dirname(__file__), "processed")
-            os.makedirs(output_base_dir, exist_ok=True)
+                return self.process_midi(file_path, output_dir)
+        except Exception as e:
+            logger.error("Error processing file: %s", str(e))
+            raise HTTPException(status_code=500, detail=str(e))
+        
+        try:
+            # If not MIDI, check if it's a supported audio file
+            duration = self.validate_audio(file_path)
+            if audio_hash is None:
+                with STAGE_SECONDS.labels(stage='hash').time():
+                    audio_hash = self.audio_hash(file_path)
             
-            # Create a unique subdirectory for this processing
-            output_dir = os.path.join(output_base_dir, output_dir)
-            os.makedirs(output_dir, exist_ok=True)
+            if not self.skip_absent:
+                result = self.separate_file(file_path, audio_hash, stream, checkpoint)
+            else:
+                with STAGE_SECONDS.labels(stage='detect').time():
+                    instruments = self.detect_instruments(file_path, audio_hash)
+                processor = self.without_absent(instruments)
+                if processor is None:
+                    result = {"status": "success", "type": "audio", "files": {}, "cached": False}
+                else:
+                    result = processor.separate_file(file_path, audio_hash, stream, checkpoint)
+                result = {**result, "instruments": instruments}
             
-            # Create a temporary directory for processing
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Convert input to WAV using FFmpeg
-                try:
-                    wav_path = os.path.join(temp_dir, "input.wav")
-                    result = subprocess.run([
-                        FFMPEG_PATH,
-                        "-i", file_path,
-                        "-ar", "44100",  # Set sample rate
-                        "-ac", "2",      # Set channels
-                        "-y",            # Overwrite output
-                        wav_path
-                    ], capture_output=True, text=True, encoding='utf-8')
-                    
-                    if result.returncode != 0:
-                        raise RuntimeError(f"FFmpeg conversion failed: {result.stderr}")
-                    logger.info("Successfully converted audio to WAV")
-                    
-                except Exception as e:
-                    logger.error("Error converting audio: %s", str(e))
-                    raise HTTPException(status_code=500, detail=str(e))
-                
-                try:
-                    # Verify model exists before processing
-                    ensure_model()
-                    
-                    # Create output directory for Spleeter
-                    temp_output_dir = os.path.join(temp_dir, "output")
-                    os.makedirs(temp_output_dir, exist_ok=True)
-                    
-                    # Process audio in chunks if necessary
-                    if duration > 300:  # 5 minutes
-                        logger.info("Processing audio in chunks...")
-                        # Split audio into 5-minute chunks
-                        chunk_duration = 300
-                        num_chunks = int(duration // chunk_duration) + 1
-                        
-                        for i in range(num_chunks):
-                            start_time = i * chunk_duration
-                            end_time = min((i + 1) * chunk_duration, duration)
-                            
-                            # Create chunk path
-                            chunk_path = os.path.join(temp_dir, f"chunk_{i}.wav")
-                            
-                            # Extract chunk using FFmpeg
-                            subprocess.run([
-                                FFMPEG_PATH,
-                                "-i", wav_path,
-                                "-ss", str(start_time),
-                                "-t", str(end_time - start_time),
-                                "-y",
-                                chunk_path
-                            ], check=True)
-                            
-                            # Process chunk
-                            self.separator.separate_to_file(chunk_path, temp_output_dir)
-                            
-                            # Clean up chunk file
-                            os.remove(chunk_path)
-                    else:
-                        # Process entire file
-                        self.separator.separate_to_file(wav_path, temp_output_dir)
-                    
-                    logger.info("Successfully separated audio")
-                    
-                    # Process results and return paths
-                    separated_files = {}
-                    # Map piano to guitar in the output
-                    stem_mapping = {'vocals': 'vocals', 'drums': 'drums', 'bass': 'bass', 'piano': 'guitar', 'other': 'other'}
-                    
-                    for original_stem, mapped_stem in stem_mapping.items():
-                        stem_path = os.path.join(temp_output_dir, "input", f"{original_stem}.wav")
-                        if os.path.exists(stem_path):
-                            # Copy the file to the permanent output directory with the mapped name
-                            target_path = os.path.join(output_dir, f"{mapped_stem}.wav")
-                            shutil.copy2(stem_path, target_path)
-                            separated_files[mapped_stem] = target_path
-                    
-                    return {
-                        "status": "success", 
-                        "type": "audio",
-                        "files": separated_files
-                    }
-                    
-                except Exception as e:
-                    logger.error("Error in separation: %s", str(e))
-                    raise HTTPException(status_code=500, detail=str(e))
+            if upload_bytes is None:
+                upload_bytes = os.path.getsize(file_path)
+            PROCESSED_BYTES.labels(type='audio').inc(upload_bytes)
+            PROCESSED_AUDIO_SECONDS.labels(type='audio').inc(duration)
+            PROCESSED_FILES.labels(type='audio', outcome='cached' if result['cached'] else 'success').inc()
+            return result
                     
         except Exception as e:
+            PROCESSED_FILES.labels(type='audio', outcome='error').inc()
             logger.error("Error processing file: %s", str(e))
             raise HTTPException(status_code=500, detail=str(e))
+    
+    def separate_file(
+        self,
+        file_path: str,
+        audio_hash: str,
+        stream: Optional[StemStream] = None,
+        checkpoint: Optional[WindowCheckpoint] = None,
+    ) -> Dict[str, Any]:
+        """
+        Serve the stems from the cache or separate them into it.
+        
+        Concurrent requests for the same cache key share one separation;
+        only the request that started it feeds its ``stream`` and ``checkpoint``.
+        """
+        cache_key = self.cache_key(audio_hash)
+        cached_files = result_cache.get(cache_key)
+        if cached_files is not None:
+            logger.info("Serving cached separation %s", cache_key)
+            return {
+                "status": "success",
+                "type": "audio",
+                "files": cached_files,
+                "cached": True
+            }
+        
+        def separate(stem_paths):
+            # FFmpeg decodes into memory and stems are encoded straight into the cache entry
+            levels = self.frame_levels(audio_hash)
+            clock = StageClock()
+            started = time.perf_counter()
+            with self.open_reader(file_path) as reader, self.open_stem_writer(stem_paths) as writer:
+                def sink(blocks):
+                    writer(blocks)
+                    if stream is not None:
+                        stream.write({
+                            self.stem_mapping[stem]: block
+                            for stem, block in blocks.items()
+                            if stem in self.stem_mapping
+                        })
+                self.separator.separate(TimedReader(reader, clock), clock.wrap('export', sink), checkpoint, levels)
+                # Whatever reading and writing did not take was spent waiting on the model
+                clock.totals['separate'] = time.perf_counter() - started - clock.totals['decode'] - clock.totals['export']
+            # Closing flushes the encoders
+            clock.totals['export'] += time.perf_counter() - started - sum(clock.totals.values())
+            clock.observe()
+            return writer.frames
+        
+        def separate_once():
+            files = self.store_stems(cache_key, separate)
+            skipped_seconds = round(self.separator.skipped_frames / SAMPLE_RATE, 3)
+            logger.info("Successfully separated audio, skipped %.1fs of silence", skipped_seconds)
+            return {
+                "status": "success", 
+                "type": "audio",
+                "files": files,
+                "cached": False,
+                "silence_skipped_seconds": skipped_seconds
+            }
+        
+        try:
+            return in_flight.run(('audio', cache_key), separate_once)
+        except Exception as e:
+            logger.error("Error in separation: %s", str(e))
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    def process_batch(self, files: List[Tuple[str, str]], emit: Callable[[Dict[str, Any]], None]):
+        """
+        Process many files, emitting each result as soon as it is known.
+        
+        Cache hits and MIDI files are answered right away. Short audio files
+        are decoded and separated together in batches packing into at most
+        ``BATCH_MAX_SECONDS``; longer ones go through the chunked path.
+        
+        Args:
+            files: ``(file_path, original_filename)`` pairs
+            emit: Called once per file with its result or error
+        """
+        batcher = BatchSeparator(self.separator.pool, stems=self.stem_mapping)
+        max_frames = int(BATCH_MAX_SECONDS * SAMPLE_RATE)
+        
+        def pending():
+            # Yield decoded audio that still needs separating; everything else is emitted directly
+            for index, (file_path, filename) in enumerate(files):
+                entry = {'index': index, 'filename': filename}
+                try:
+                    if self.midi_processor.is_midi_file(file_path):
+                        output_dir = os.path.join("Results", os.path.splitext(filename)[0])
+                        emit({**entry, **self.process_midi(file_path, output_dir)})
+                        continue
+                    duration = self.validate_audio(file_path)
+                    # With skip_absent the stems can differ per file, so those cannot share a batch
+                    if duration > BATCH_MAX_SECONDS or self.skip_absent:
+                        emit({**entry, **self.process_file(file_path, "")})
+                        continue
+                    with STAGE_SECONDS.labels(stage='hash').time():
+                        cache_key = self.cache_key(self.audio_hash(file_path))
+                    PROCESSED_BYTES.labels(type='audio').inc(os.path.getsize(file_path))
+                    PROCESSED_AUDIO_SECONDS.labels(type='audio').inc(duration)
+                    cached_files = result_cache.get(cache_key)
+                    if cached_files is not None:
+                        PROCESSED_FILES.labels(type='audio', outcome='cached').inc()
+                        emit({**entry, 'status': 'success', 'type': 'audio', 'files': cached_files, 'cached': True})
+                        continue
+                    with STAGE_SECONDS.labels(stage='decode').time(), self.open_reader(file_path) as reader:
+                        waveform = read_all(reader)
+                    yield (entry, cache_key), waveform
+                except Exception as e:
+                    emit({**entry, 'status': 'error', 'detail': str(getattr(e, 'detail', e))})
+        
+        for batch in iter_batches(pending(), max_frames, batcher.segment_frames, batcher.guard_frames):
+            try:
+                # Observed once per batch; several files share the inference
+                with STAGE_SECONDS.labels(stage='separate').time():
+                    separated = batcher.separate([waveform for _, waveform in batch])
+            except Exception as e:
+                logger.error("Error in batch separation: %s", str(e))
+                PROCESSED_FILES.labels(type='audio', outcome='error').inc(len(batch))
+                for (entry, _), _ in batch:
+                    emit({**entry, 'status': 'error', 'detail': str(e)})
+                continue
+            for ((entry, cache_key), _), stems in zip(batch, separated):
+                def write(stem_paths, stems=stems):
+                    with self.open_stem_writer(stem_paths) as writer:
+                        writer(stems)
+                    return writer.frames
+                try:
+                    with STAGE_SECONDS.labels(stage='export').time():
+                        files = self.store_stems(cache_key, write)
+                    PROCESSED_FILES.labels(type='audio', outcome='success').inc()
+                    emit({**entry, 'status': 'success', 'type': 'audio', 'files': files, 'cached': False})
+                except Exception as e:
+                    PROCESSED_FILES.labels(type='audio', outcome='error').inc()
+                    emit({**entry, 'status': 'error', 'detail': str(e)})
 
-@app.post("/process-audio")
-async def process_audio(file: UploadFile = File(...)):
+def to_urls(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert stem file paths in a result to download URLs from the storage backend.
+    
+    When the result has a stem container, each stem also gets a ``range_url``
+    that supports seeking and partial downloads.
+    """
+    if result.get('type') == 'audio' and result.get('files'):
+        container = result['files'].pop('container', None)
+        # Cache entry the stems belong to, for remixing them with /mix
+        result['cache_key'] = next(iter(result['files'].values()), container or {}).get('key')
+        for stem, info in result['files'].items():
+            result['files'][stem] = {
+                'url': storage.url(info['key'], info['file']),
+                'format': info['format'],
+                'size': info['size'],
+                'duration': info['duration'],
+            }
+            if container is not None:
+                result['files'][stem]['range_url'] = f"{BASE_URL}/results/{info['key']}/{stem}"
+    return result
+
+def audio_seconds(path: str) -> float:
+    """Duration of a spooled upload from its header; 0 if it cannot be read."""
     try:
-        # Save uploaded file to temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_file_path = temp_file.name
+        return sf.info(path).duration
+    except RuntimeError:
+        return 0.0
 
-        logger.info(f"Received audio file: {file.filename}")
-        
+def run_processing_job(
+    temp_file_path: str,
+    original_filename: str,
+    stream_id: Optional[str] = None,
+    options: Optional[Dict[str, Any]] = None,
+    audio_hash: Optional[str] = None,
+    stored_job_id: Optional[str] = None,
+    upload_bytes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Process an uploaded file on a job worker and return the result with stem URLs.
+    
+    ``stored_job_id`` names the job in ``job_store``; its outcome is
+    recorded there, and its windows checkpointed if the file is at least
+    ``CHECKPOINT_MIN_SECONDS`` long.
+    """
+    error = None
+    result = None
+    try:
         # Initialize processor
-        processor = AudioProcessor()
+        processor = AudioProcessor(**(options or {}))
         
-        # Create output directory using filename without extension
-        filename = os.path.splitext(os.path.basename(file.filename))[0]
+        # MIDI output goes under the filename without extension; audio stems live in the result cache
+        filename = os.path.splitext(os.path.basename(original_filename))[0]
         output_dir = os.path.join("Results", filename)
-        os.makedirs(output_dir, exist_ok=True)
         
         # Process audio file
-        result = await processor.process_file(temp_file_path, output_dir)
-        
-        # Clean up temporary file
-        os.remove(temp_file_path)
+        stream = stem_streams.get(stream_id) if stream_id else None
+        checkpoint = None
+        if stored_job_id:
+            checkpoint = job_store.start(stored_job_id, audio_seconds(temp_file_path) >= CHECKPOINT_MIN_SECONDS)
+        result = processor.process_file(
+            temp_file_path, output_dir, stream=stream, audio_hash=audio_hash, checkpoint=checkpoint,
+            upload_bytes=upload_bytes,
+        )
+        if checkpoint is not None and checkpoint.loaded:
+            logger.info("Resumed job %s from %d saved windows", stored_job_id, checkpoint.loaded)
         
         # Convert file paths to URLs
-        if result.get('type') == 'audio' and result.get('files'):
-            base_url = "http://localhost:8000/processed"
-            for stem, path in result['files'].items():
-                relative_path = os.path.relpath(path, STATIC_DIR)
-                result['files'][stem] = f"{base_url}/{relative_path.replace(os.sep, '/')}"
-        
+        result = to_urls(result)
         return result
     except Exception as e:
-        logger.error(f"Error processing file: {str(e)}")
+        error = str(getattr(e, 'detail', e))
+        raise
+    finally:
+        if stream_id:
+            stem_streams.release(stream_id, error)
+        if stored_job_id:
+            job_store.finish(stored_job_id, result, error)
+        # Clean up temporary file
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
+
+def save_upload(file: UploadFile) -> str:
+    """Spool an uploaded file to a temporary location and return its path."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
+        shutil.copyfileobj(file.file, temp_file)
+        return temp_file.name
+
+def parse_options(
+    stems: Optional[str] = None,
+    output_format: Optional[str] = None,
+    bitrate: Optional[str] = None,
+    filter_spec: Optional[str] = None,
+    skip_absent: bool = False,
+) -> Dict[str, Any]:
+    """
+    Validate processing form fields and turn them into ``AudioProcessor`` arguments.
+    
+    Args:
+        stems: Comma-separated stems wanted, e.g. ``vocals,accompaniment``
+        output_format: One of ``OUTPUT_FORMATS``, WAV by default
+        bitrate: Bitrate for lossy formats, e.g. ``192k``
+        filter_spec: JSON filter or list of filters applied before separation,
+            e.g. ``{"type": "highpass", "cutoff": 80}``; see ``filters.design_filter``
+        skip_absent: Detect instruments first and skip stems that are not present
+    """
+    options: Dict[str, Any] = {}
+    if stems:
+        requested = sorted({stem.strip().lower() for stem in stems.split(',') if stem.strip()})
+        try:
+            select_model(requested)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        options['stems'] = requested or None
+    if output_format:
+        output_format = output_format.lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported output format; expected one of {sorted(OUTPUT_FORMATS)}")
+        options['output_format'] = output_format
+    if bitrate:
+        if not re.fullmatch(r"\d{2,3}k", bitrate) or 'codec' not in OUTPUT_FORMATS[options.get('output_format', 'wav')]:
+            raise HTTPException(status_code=400, detail="Bitrate must look like 192k and needs a lossy output format")
+        options['bitrate'] = bitrate
+    if filter_spec:
+        try:
+            filters = parse_filter_specs(json.loads(filter_spec))
+            FilterChain(filters, SAMPLE_RATE, CHANNELS)
+        except (ValueError, TypeError, KeyError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
+        options['filters'] = filters
+    if skip_absent:
+        options['skip_absent'] = True
+    return options
+
+async def receive(request: Request) -> IngestedUpload:
+    """Stream a single-file upload to disk, decoding audio as it arrives."""
+    try:
+        return await receive_upload(
+            request,
+            FFMPEG_PATH,
+            SAMPLE_RATE,
+            CHANNELS,
+            max_bytes=MAX_UPLOAD_BYTES,
+            max_seconds=MAX_DURATION_SECONDS,
+        )
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def upload_options(upload: IngestedUpload) -> Dict[str, Any]:
+    """``parse_options`` over the form fields of a streamed upload; removes the spool if they are invalid."""
+    fields = upload.fields
+    try:
+        return parse_options(
+            fields.get('stems'),
+            fields.get('format'),
+            fields.get('bitrate'),
+            fields.get('filter'),
+            fields.get('skip_absent', '').lower() in ('1', 'true', 'on', 'yes'),
+        )
+    except HTTPException:
+        os.remove(upload.path)
+        raise
+
+async def submit_upload(upload: IngestedUpload, streaming: bool = False, options: Optional[Dict[str, Any]] = None):
+    """Queue a received upload for processing."""
+    logger.info(f"Received audio file: {upload.filename} ({upload.container})")
+    job_id = new_job_id()
+    stream_id = None
+    if streaming:
+        stem_streams.open(job_id, SAMPLE_RATE, CHANNELS)
+        stream_id = job_id
+    # Recorded before queueing, so a restart while it waits still runs it
+    input_path = job_store.create(job_id, upload.path, upload.filename, options, upload.audio_hash, upload.size)
+    try:
+        return job_queue.submit(
+            run_processing_job, input_path, upload.filename, stream_id, options, upload.audio_hash, job_id,
+            upload.size, job_id=job_id,
+        )
+    except QueueFullError as e:
+        job_store.finish(job_id, error=str(e))
+        stem_streams.release(job_id, str(e))
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+
+@app.post("/process-audio")
+async def process_audio(request: Request):
+    """
+    Process a file and wait for the result. Work runs on the job queue, not the event loop.
+    
+    Takes a multipart form with the ``file`` and optional ``stems``,
+    ``format``, ``bitrate``, ``filter`` and ``skip_absent`` fields; see
+    ``parse_options``. The upload is checked and decoded while it arrives,
+    so unsupported (415), oversize (413) and overlong (400) files are
+    refused before the whole body has been sent.
+    """
+    upload = await receive(request)
+    job = await submit_upload(upload, options=upload_options(upload))
+    try:
+        return await asyncio.wrap_future(job.future)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing file: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request):
+    """
+    Queue a file for processing and return its job id and live stem stream URLs immediately.
+    
+    Takes the same form as ``/process-audio``.
+    """
+    upload = await receive(request)
+    options = upload_options(upload)
+    job = await submit_upload(upload, streaming=True, options=options)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "streams": {
+            stem: f"{BASE_URL}/jobs/{job.id}/stream/{stem}"
+            for stem in options.get('stems') or DEFAULT_STEMS
+        }
+    }
+
+@app.get("/jobs/{job_id}/stream/{stem}")
+async def stream_stem(job_id: str, stem: str, request: Request):
+    """
+    Stream one stem as WAV while the job is still separating.
+    
+    Audio arrives in time order as each window is stitched. Once the job
+    has finished, the request is redirected to the stored stem instead.
+    Listeners wait on the event loop, so idle ones hold no worker thread.
+    """
+    job = job_queue.get(job_id)
+    stream = stem_streams.get(job_id)
+    if job is None or stem not in OUTPUT_STEMS:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    
+    while stream is not None and not stream.wait_for_data(stem, 0) and not stream.closed:
+        if await request.is_disconnected():
+            return Response(status_code=204)
+        await asyncio.sleep(STREAM_POLL_SECONDS)
+    has_data = stream is not None and stream.wait_for_data(stem, 0)
+    if not has_data:
+        # Nothing was streamed (cache hit, MIDI or failure); fall back to the finished result
+        try:
+            result = await asyncio.wrap_future(job.future)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(getattr(e, 'detail', e)))
+        info = (result.get('files') or {}).get(stem)
+        if info is None:
+            raise HTTPException(status_code=404, detail="Stem not available")
+        return RedirectResponse(info['url'])
+    
+    async def body():
+        yield streaming_wav_header(stream.sample_rate, stream.channels)
+        # Each step only reads what is already spooled; gaps are waited out here
+        chunks = stream.iter_pcm(stem, timeout=0)
+        while True:
+            chunk = await run_in_threadpool(next, chunks, None)
+            if chunk is None:
+                return
+            if chunk:
+                yield chunk
+            else:
+                await asyncio.sleep(STREAM_POLL_SECONDS)
+    
+    return StreamingResponse(body(), media_type="audio/wav", headers={"Cache-Control": "no-store"})
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First and last byte requested by a ``Range`` header, or None for the whole body.
+    
+    Only single ``bytes=`` ranges are honoured; anything else is ignored as
+    the HTTP spec allows. Ranges starting past the end are rejected with 416.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return first, last
+
+def parse_gains(spec: str, stems: List[str]) -> Dict[str, float]:
+    """Parse ``stem=gain`` pairs, e.g. ``vocals=1,drums=0.5``; a bare stem name means gain 1."""
+    gains = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        name = name.strip().lower()
+        if name not in stems:
+            raise HTTPException(status_code=400, detail=f"Unknown stem {name!r}; expected some of {stems}")
+        try:
+            gains[name] = float(value) if value.strip() else 1.0
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid gain for {name}: {value!r}")
+    return gains
+
+def serve_container(
+    container: StemContainer,
+    selection: Any,
+    request: Request,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    extra_headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """
+    Stream a stem or a ``{stem: gain}`` mix of a stem container as WAV, honouring ``Range``.
+    
+    Frames are read from the memory-mapped container chunk by chunk as
+    the response is sent, so memory use does not grow with the length.
+    The container is closed once the response is done.
+    """
+    first_frame = max(0, int(start * container.sample_rate))
+    last_frame = int(end * container.sample_rate) if end is not None else None
+    size = container.wav_size(first_frame, last_frame)
+    byte_range = parse_byte_range(request.headers.get('range'), size)
+    first, last = byte_range or (0, size - 1)
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(last - first + 1), **(extra_headers or {})}
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    
+    def body():
+        try:
+            yield from container.iter_wav(selection, first_frame, last_frame, first, last)
+        finally:
+            container.close()
+    
+    return StreamingResponse(
+        body(),
+        status_code=206 if byte_range is not None else 200,
+        media_type="audio/wav",
+        headers=headers,
+    )
+
+@app.get("/results/{key}/{stem}")
+def serve_stem_range(
+    key: str,
+    stem: str,
+    request: Request,
+    start: float = 0.0,
+    end: Optional[float] = None,
+    gains: Optional[str] = None,
+):
+    """
+    Serve a stem, or a mix of stems, of a cached result as WAV straight from its stem container.
+    
+    ``start`` and ``end`` (seconds) cut a time range; ``Range`` requests
+    are answered with 206 so players can seek without downloading the
+    whole file. With ``stem=mix``, ``gains`` (``vocals=1,drums=0.5``)
+    selects the stems summed on the server.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", key):
+        raise HTTPException(status_code=404, detail="Result not found")
+    info = (result_cache.get(key) or {}).get('container')
+    if info is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    container = StemContainer(info['path'])
+    if stem == 'mix':
+        selection = parse_gains(gains or ','.join(container.stems), container.stems)
+    elif stem in container.stems:
+        selection = stem
+    else:
+        container.close()
+        raise HTTPException(status_code=404, detail="Stem not available")
+    return serve_container(container, selection, request, start, end)
+
+@app.get("/mix")
+def mix_stems(
+    job_id: str,
+    request: Request,
+    gains: Optional[str] = None,
+    mute: Optional[str] = None,
+    start: float = 0.0,
+    end: Optional[float] = None,
+):
+    """
+    Stream the stems of a finished job mixed on the server, as WAV.
+    
+    ``gains`` sets linear gains per stem (``vocals=1,drums=0.5``) and
+    ``mute`` lists stems to leave out; other stems play at unity gain.
+    The mix is summed block by block from the job's stem container, like
+    ``/results/<key>/mix``, so toggling an instrument costs one pass over
+    pages that are usually still in the page cache. Jobs finished before
+    a restart are looked up in the job store.
+    """
+    job = job_queue.get(job_id)
+    if job is not None:
+        status, result = job.status, job.result
+    else:
+        stored = job_store.get(job_id)
+        if stored is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        status, result = stored['status'], stored['result']
+    if status != 'succeeded':
+        raise HTTPException(status_code=409, detail=f"Job is {status}")
+    key = (result or {}).get('cache_key')
+    info = ((result_cache.get(key) if key else None) or {}).get('container')
+    if info is None:
+        raise HTTPException(status_code=404, detail="No stems to mix for this job")
+    container = StemContainer(info['path'])
+    try:
+        levels = {stem: 1.0 for stem in container.stems}
+        levels.update(parse_gains(gains or '', container.stems))
+        for stem in parse_gains(mute or '', container.stems):
+            levels[stem] = 0.0
+    except HTTPException:
+        container.close()
+        raise
+    return serve_container(container, levels, request, start, end, {"Cache-Control": "no-store"})
+
+def run_batch_job(
+    uploads: List[Tuple[str, str]],
+    results: "queue.Queue[Optional[Dict[str, Any]]]",
+    options: Optional[Dict[str, Any]] = None,
+):
+    """Process a batch on a job worker, pushing per-file results to ``results``."""
+    try:
+        processor = AudioProcessor(**(options or {}))
+        processor.process_batch(uploads, lambda result: results.put(to_urls(result)))
+    finally:
+        results.put(None)
+        for temp_file_path, _ in uploads:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+
+def expand_uploads(files: List[UploadFile]) -> List[Tuple[str, str]]:
+    """Spool uploads to disk, unpacking zip archives into their supported members."""
+    uploads = []
+    for file in files:
+        if os.path.splitext(file.filename)[1].lower() != '.zip':
+            uploads.append((save_upload(file), file.filename))
+            continue
+        with zipfile.ZipFile(file.file) as archive:
+            for member in archive.infolist():
+                member_ext = os.path.splitext(member.filename)[1].lower()
+                if member.is_dir() or member_ext not in SUPPORTED_AUDIO_EXTENSIONS + ['.mid', '.midi']:
+                    continue
+                if len(uploads) >= BATCH_MAX_FILES:
+                    break
+                # Never trust archive paths; extract to fresh temporary files
+                with archive.open(member) as source, tempfile.NamedTemporaryFile(delete=False, suffix=member_ext) as temp_file:
+                    shutil.copyfileobj(source, temp_file)
+                uploads.append((temp_file.name, member.filename))
+    return uploads[:BATCH_MAX_FILES]
+
+@app.post("/process-batch")
+async def process_batch(
+    files: List[UploadFile] = File(...),
+    stems: Optional[str] = Form(None),
+    output_format: Optional[str] = Form(None, alias="format"),
+    bitrate: Optional[str] = Form(None),
+    filter_spec: Optional[str] = Form(None, alias="filter"),
+    skip_absent: bool = Form(False),
+):
+    """
+    Process many files (or zip archives of files) in one request.
+    
+    Streams one JSON line per file as each result becomes available.
+    """
+    options = parse_options(stems, output_format, bitrate, filter_spec, skip_absent)
+    uploads = await run_in_threadpool(expand_uploads, files)
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No supported files in the batch.")
+    logger.info(f"Received batch of {len(uploads)} files")
+    
+    results: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+    try:
+        job_queue.submit(run_batch_job, uploads, results, options)
+    except QueueFullError as e:
+        for temp_file_path, _ in uploads:
+            os.remove(temp_file_path)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+    
+    def stream():
+        # Plain generator; Starlette iterates it on a worker thread, off the event loop
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/analyze-midi")
+async def analyze_midi(file: UploadFile = File(...)):
+    """
+    Track info and statistics of a MIDI file, without synthesizing audio.
+    
+    Parsing is cheap and memoized per file hash, so this runs off the event
+    loop but not on the job queue.
+    """
+    processor = MidiProcessor()
+    if not processor.is_midi_file(file.filename):
+        raise HTTPException(status_code=400, detail="Please provide a MIDI file (.mid or .midi)")
+    temp_file_path = await run_in_threadpool(save_upload, file)
+    try:
+        analysis = await run_in_threadpool(processor.analyze_midi, temp_file_path)
+    except Exception as e:
+        logger.error(f"Error analyzing MIDI file: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Invalid MIDI file: {e}")
+    finally:
+        os.remove(temp_file_path)
+    return {'status': 'success', 'type': 'midi', 'analysis': analysis}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report the status of a job and, once finished, its stem URLs."""
+    job = job_queue.get(job_id)
+    if job is not None:
+        return job.to_dict()
+    # Finished before the last restart, or not resumed yet
+    stored = job_store.get(job_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return stored
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss counters and size, and how many requests joined work already running"""
+    return {**result_cache.stats(), "coalesced": in_flight.coalesced}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage timings, processed totals, queue depth and model load times"""
+    return Response(render_metrics(), headers={"Content-Type": CONTENT_TYPE})
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint: FFmpeg checked and default models loaded"""
+    ready = ffmpeg_status['state'] == 'ready' and all(model_registry.is_ready(stems) for stems in WARM_UP_MODELS)
+    content = {
+        "status": "ready" if ready else "starting",
+        "ffmpeg": ffmpeg_status,
+        "models": model_registry.status(),
+        "storage": storage.status()
+    }
+    return JSONResponse(content, status_code=200 if ready else 503)
+
+@app.on_event("startup")
+def prepare_storage():
+    if storage.remote:
+        try:
+            storage.ensure_bucket()
+        except Exception as e:
+            # Uploads will fail until the bucket is reachable; keep serving local work
+            logger.error(f"Storage not available: {str(e)}")
+
+@app.on_event("startup")
+def start_warm_up():
+    # Load models after the server is accepting connections so startup stays fast
+    model_registry.warm_up_in_background(WARM_UP_MODELS, before=check_ffmpeg)
+
+@app.on_event("startup")
+def resume_jobs():
+    # Jobs interrupted by the last shutdown or crash continue from their saved windows
+    for job in job_store.unfinished():
+        try:
+            job_queue.submit(
+                run_processing_job, job['input_path'], job['filename'], None, job['options'], job['audio_hash'],
+                job['job_id'], job['upload_bytes'], job_id=job['job_id'],
+            )
+        except QueueFullError:
+            logger.warning("Queue full; remaining unfinished jobs resume on the next start")
+            break
+        logger.info("Resuming job %s (%s)", job['job_id'], job['filename'])
+
+@app.on_event("shutdown")
+def stop_separators():
+    model_registry.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
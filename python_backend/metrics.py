@@ -0,0 +1,176 @@
+import contextvars
+import logging
+import os
+import re
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+# Seconds; spans a fast cache hit up to a long separation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TRACE_HEADER = "x-request-id"
+
+# Id of the request being handled; job workers inherit it from the request that queued them
+trace_id_var: contextvars.ContextVar = contextvars.ContextVar("trace_id", default="-")
+
+# Pipeline metrics; stages are decode, hash, detect, separate and export for
+# audio, parse, synthesis and mix for MIDI
+STAGE_SECONDS = Histogram(
+    "audiofilter_stage_seconds", "Wall time per file spent in each pipeline stage.", ["stage"],
+    buckets=DEFAULT_BUCKETS,
+)
+SEPARATION_WINDOW_SECONDS = Histogram(
+    "audiofilter_separation_window_seconds", "Model inference time per separation window.", ["model"],
+    buckets=DEFAULT_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "audiofilter_model_load_seconds", "Time to load one separator instance.", ["model"],
+    buckets=DEFAULT_BUCKETS,
+)
+SILENCE_SKIPPED_SECONDS = Counter(
+    "audiofilter_silence_skipped_seconds_total", "Seconds of silent audio not sent to the model.",
+)
+PROCESSED_BYTES = Counter(
+    "audiofilter_processed_bytes_total", "Bytes of input files processed.", ["type"],
+)
+PROCESSED_AUDIO_SECONDS = Counter(
+    "audiofilter_processed_audio_seconds_total", "Seconds of audio processed.", ["type"],
+)
+PROCESSED_FILES = Counter(
+    "audiofilter_processed_files_total", "Files processed, by type and outcome.", ["type", "outcome"],
+)
+JOB_QUEUE_DEPTH = Gauge("audiofilter_job_queue_depth", "Jobs queued or running.")
+HTTP_REQUESTS = Counter(
+    "audiofilter_http_requests_total", "HTTP requests handled.", ["method", "route", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "audiofilter_http_request_seconds", "Time to the end of each HTTP response.", ["method", "route"],
+    buckets=DEFAULT_BUCKETS,
+)
+
+
+def render_metrics() -> bytes:
+    """
+    Every metric in the Prometheus text format.
+
+    With ``PROMETHEUS_MULTIPROC_DIR`` set (several uvicorn workers), the
+    values all worker processes wrote there are aggregated instead; gauges
+    read from a callback, like the queue depth, are not exported then.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class StageClock:
+    """
+    Splits one file's wall time between stages that interleave on one thread.
+
+    Decoding, separation and stem export run in turns as windows stream
+    through ``ChunkedSeparator``; wrapping the reader and the sink books
+    each call to its stage, and whatever is left is the separation itself.
+    """
+
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - started
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return function(*args, **kwargs)
+        return timed
+
+    def observe(self, histogram: Histogram = STAGE_SECONDS):
+        for name, seconds in self.totals.items():
+            histogram.labels(stage=name).observe(seconds)
+
+
+class TimedReader:
+    """Wraps a ``read(frames)`` reader and books the time spent reading to a ``StageClock`` stage."""
+
+    def __init__(self, reader, clock: StageClock, stage: str = "decode"):
+        self.reader = reader
+        self.read = clock.wrap(stage, reader.read)
+
+    @property
+    def channels(self) -> int:
+        return self.reader.channels
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the current ``trace_id`` to every log record, for formats that include ``%(trace_id)s``."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware giving every request a trace id and recording request metrics.
+
+    The trace id comes from an incoming ``X-Request-ID`` header or is
+    generated, lives in ``trace_id_var`` while the request is handled and is
+    echoed in the response. Requests are counted per route template rather
+    than raw path, so job ids do not explode the label set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = dict(scope.get("headers") or []).get(TRACE_HEADER.encode(), b"").decode("latin-1")
+        trace_id = incoming if re.fullmatch(r"[\w\-]{1,64}", incoming) else new_trace_id()
+        token = trace_id_var.set(trace_id)
+        status = [500]
+        started = time.perf_counter()
+
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(TRACE_HEADER.encode(), trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            route = self._route(scope)
+            HTTP_REQUESTS.labels(method=scope["method"], route=route, status=str(status[0])).inc()
+            HTTP_REQUEST_SECONDS.labels(method=scope["method"], route=route).observe(time.perf_counter() - started)
+            trace_id_var.reset(token)
+
+    def _route(self, scope) -> str:
+        from starlette.routing import Match
+
+        app = scope.get("app")
+        for route in getattr(app, "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+        return "unmatched"
@@ -0,0 +1,238 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional
+
+import mido
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# One row per note; times in seconds after applying the tempo map
+NOTE_DTYPE = np.dtype([
+    ('pitch', 'u1'),
+    ('velocity', 'u1'),
+    ('start', 'f8'),
+    ('end', 'f8'),
+    ('track', 'u2'),
+    ('channel', 'u1'),
+    ('program', 'u1'),
+])
+DEFAULT_TEMPO = 500000  # microseconds per beat (120 BPM)
+DRUM_CHANNEL = 9
+
+
+def ticks_to_seconds(ticks: np.ndarray, tempo_ticks: np.ndarray, tempos: np.ndarray, ticks_per_beat: int) -> np.ndarray:
+    """Convert absolute ticks to seconds through a tempo map starting at tick 0."""
+    scale = 1e-6 / ticks_per_beat
+    segment_seconds = np.concatenate([[0.0], np.cumsum(np.diff(tempo_ticks) * tempos[:-1] * scale)])
+    index = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+    return segment_seconds[index] + (ticks - tempo_ticks[index]) * tempos[index] * scale
+
+
+class MidiAnalysis:
+    """
+    Notes of a MIDI file as a structured array, plus its tempo map and tracks.
+
+    Built from a single parse; every statistic is derived from the arrays
+    with vectorized NumPy and computed once.
+    """
+
+    def __init__(
+        self,
+        notes: np.ndarray,
+        tracks: List[Dict[str, Any]],
+        tempo_map: List[Dict[str, float]],
+        time_signatures: List[Dict[str, Any]],
+        duration: float,
+        ticks_per_beat: int,
+    ):
+        self.notes = notes
+        self.tracks = tracks
+        self.tempo_map = tempo_map
+        self.time_signatures = time_signatures
+        self.duration = duration
+        self.ticks_per_beat = ticks_per_beat
+        self._statistics: Optional[Dict[str, Any]] = None
+
+    def track_name(self, index: int) -> str:
+        return self.tracks[index]['name'] or f"Track_{index}"
+
+    def track_info(self) -> Dict[str, Dict[str, Any]]:
+        """Message count, note count, pitch range and mean velocity per track, keyed by name."""
+        notes = self.notes
+        count = len(self.tracks)
+        note_counts = np.bincount(notes['track'], minlength=count)
+        velocity_sums = np.bincount(notes['track'], weights=notes['velocity'], minlength=count)
+        low = np.full(count, 127)
+        high = np.zeros(count, dtype=int)
+        np.minimum.at(low, notes['track'], notes['pitch'])
+        np.maximum.at(high, notes['track'], notes['pitch'])
+        info = {}
+        for index, track in enumerate(self.tracks):
+            has_notes = note_counts[index] > 0
+            info[self.track_name(index)] = {
+                'length': track['length'],
+                'note_count': int(note_counts[index]),
+                'pitch_range': [int(low[index]), int(high[index])] if has_notes else [0, 0],
+                'mean_velocity': round(float(velocity_sums[index] / note_counts[index]), 2) if has_notes else 0.0,
+                'channels': sorted({int(c) for c in np.unique(notes['channel'][notes['track'] == index])}),
+            }
+        return info
+
+    def statistics(self, bin_seconds: float = 1.0) -> Dict[str, Any]:
+        """
+        File-level statistics.
+
+        Returns:
+            Duration, note count, pitch and pitch-class histograms, velocity
+            summary, note density per ``bin_seconds``, polyphony (maximum and
+            time-weighted mean), tempo map and time signatures
+        """
+        if self._statistics is not None and self._statistics['bin_seconds'] == bin_seconds:
+            return self._statistics
+        notes = self.notes
+        bins = max(1, int(np.ceil(self.duration / bin_seconds)))
+        density = np.bincount(
+            np.minimum((notes['start'] // bin_seconds).astype(np.int64), bins - 1), minlength=bins,
+        )
+
+        # Sweep note starts and ends; at equal times ends come first so touching notes do not overlap
+        times = np.concatenate([notes['start'], notes['end']])
+        steps = np.concatenate([np.ones(len(notes)), -np.ones(len(notes))])
+        order = np.lexsort((steps, times))
+        level = np.cumsum(steps[order])
+        spans = np.diff(times[order])
+        max_polyphony = int(level.max()) if len(level) else 0
+        mean_polyphony = float((level[:-1] * spans).sum() / self.duration) if self.duration > 0 and len(spans) else 0.0
+
+        self._statistics = {
+            'bin_seconds': bin_seconds,
+            'duration': round(self.duration, 3),
+            'note_count': int(len(notes)),
+            'pitch_histogram': np.bincount(notes['pitch'], minlength=128).tolist(),
+            'pitch_class_histogram': np.bincount(notes['pitch'] % 12, minlength=12).tolist(),
+            'velocity': {
+                'mean': round(float(notes['velocity'].mean()), 2) if len(notes) else 0.0,
+                'std': round(float(notes['velocity'].std()), 2) if len(notes) else 0.0,
+            },
+            'note_density': density.tolist(),
+            'polyphony': {'max': max_polyphony, 'mean': round(mean_polyphony, 3)},
+            'tempo_map': self.tempo_map,
+            'time_signatures': self.time_signatures,
+        }
+        return self._statistics
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'track_info': self.track_info(), 'statistics': self.statistics()}
+
+
+def parse_midi(path: str) -> MidiAnalysis:
+    """Parse a MIDI file once into a ``MidiAnalysis``."""
+    midi = mido.MidiFile(path)
+    rows: List[tuple] = []  # (pitch, velocity, start tick, end tick, track, channel)
+    tempo_events: List[tuple] = [(0, DEFAULT_TEMPO)]
+    signature_events: List[tuple] = []
+    program_events: List[tuple] = []
+    tracks = []
+    end_tick = 0
+
+    for track_index, track in enumerate(midi.tracks):
+        tick = 0
+        name = ''
+        sounding = defaultdict(list)
+        for message in track:
+            tick += message.time
+            kind = message.type
+            if kind == 'note_on' and message.velocity > 0:
+                sounding[(message.channel, message.note)].append((tick, message.velocity))
+            elif kind == 'note_off' or kind == 'note_on':
+                started = sounding.get((message.channel, message.note))
+                if started:
+                    start, velocity = started.pop(0)
+                    rows.append((message.note, velocity, start, tick, track_index, message.channel))
+            elif kind == 'set_tempo':
+                tempo_events.append((tick, message.tempo))
+            elif kind == 'time_signature':
+                signature_events.append((tick, message.numerator, message.denominator))
+            elif kind == 'program_change':
+                program_events.append((tick, message.channel, message.program))
+            elif kind == 'track_name' and not name:
+                name = message.name
+        # Notes still held at the end of the track end there
+        for (channel, pitch), started in sounding.items():
+            rows.extend((pitch, velocity, start, tick, track_index, channel) for start, velocity in started)
+        tracks.append({'name': name, 'length': len(track)})
+        end_tick = max(end_tick, tick)
+
+    tempo_array = np.array(sorted(tempo_events, key=lambda event: event[0]), dtype=np.int64)
+    # Several tempo events on one tick: the last one wins
+    keep = np.append(tempo_array[1:, 0] != tempo_array[:-1, 0], True)
+    tempo_ticks, tempos = tempo_array[keep, 0], tempo_array[keep, 1]
+
+    def seconds(ticks):
+        return ticks_to_seconds(np.asarray(ticks, dtype=np.int64), tempo_ticks, tempos, midi.ticks_per_beat)
+
+    raw = np.array(rows, dtype=np.int64).reshape(-1, 6)
+    notes = np.zeros(len(raw), dtype=NOTE_DTYPE)
+    notes['pitch'], notes['velocity'] = raw[:, 0], raw[:, 1]
+    notes['start'], notes['end'] = seconds(raw[:, 2]), seconds(raw[:, 3])
+    notes['track'], notes['channel'] = raw[:, 4], raw[:, 5]
+
+    # Program in effect on each note's channel when the note starts
+    if program_events:
+        programs = np.array(sorted(program_events, key=lambda event: event[0]), dtype=np.int64)
+        for channel in np.unique(notes['channel']):
+            events = programs[programs[:, 1] == channel]
+            if not len(events):
+                continue
+            mask = notes['channel'] == channel
+            index = np.searchsorted(events[:, 0], raw[mask, 2], side='right') - 1
+            notes['program'][mask] = np.where(index >= 0, events[np.maximum(index, 0), 2], 0)
+
+    notes = notes[np.argsort(notes['start'], kind='stable')]
+    return MidiAnalysis(
+        notes=notes,
+        tracks=tracks,
+        tempo_map=[
+            {'time': round(float(t), 6), 'bpm': round(float(60e6 / tempo), 3)}
+            for t, tempo in zip(seconds(tempo_ticks), tempos)
+        ],
+        time_signatures=[
+            {'time': round(float(seconds([tick])[0]), 6), 'numerator': numerator, 'denominator': denominator}
+            for tick, numerator, denominator in sorted(signature_events)
+        ],
+        duration=float(seconds([end_tick])[0]),
+        ticks_per_beat=midi.ticks_per_beat,
+    )
+
+
+class MidiAnalyzer:
+    """Memoizes ``parse_midi`` per file content hash, keeping the most recent ``max_entries``."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, MidiAnalysis]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def analyze(self, path: str) -> MidiAnalysis:
+        key = self.file_hash(path)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        analysis = parse_midi(path)
+        with self._lock:
+            self._entries[key] = analysis
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analysis
@@ -1,83 +1,216 @@
 import os
-import mido
-from typing import Dict, List, Optional
+import re
+import json
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack
+from typing import Any, Dict, Iterator, List, Optional
 import logging
-import pretty_midi
 import soundfile as sf
 import numpy as np
+from metrics import PROCESSED_AUDIO_SECONDS, PROCESSED_BYTES, PROCESSED_FILES, STAGE_SECONDS
+from midi_analysis import DRUM_CHANNEL, MidiAnalysis, MidiAnalyzer
+from soundfont import render_track
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SOUNDFONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "soundfont.sf2")
+SAMPLE_RATE = 44100
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+# Parsed MIDI files shared by all processors, keyed by file hash
+midi_analyzer = MidiAnalyzer()
+
+def render_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """Process pool shared by all MIDI renders; each worker keeps its soundfont samples loaded."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Spawn rather than fork: the server process runs threads and TensorFlow
+            _render_pool = ProcessPoolExecutor(
+                max_workers=max_workers or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _render_pool
+
+def discard_render_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next render starts fresh workers."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
 class MidiProcessor:
-    def __init__(self):
+    def __init__(self, soundfont_path: str = DEFAULT_SOUNDFONT, sample_rate: int = SAMPLE_RATE, max_workers: Optional[int] = None):
         self.supported_extensions = ['.mid', '.midi']
+        self.soundfont_path = soundfont_path
+        self.sample_rate = sample_rate
+        self.max_workers = max_workers
+        self.analyzer = midi_analyzer
 
     def is_midi_file(self, file_path: str) -> bool:
         """Check if the file is a MIDI file based on extension."""
         return any(file_path.lower().endswith(ext) for ext in self.supported_extensions)
 
-    def process_midi(self, input_path: str, output_dir: str) -> Dict[str, str]:
+    def analyze_midi(self, input_path: str) -> Dict[str, Any]:
+        """Track info and statistics of a MIDI file without synthesizing it; memoized per file hash."""
+        return self.analyzer.analyze(input_path).to_dict()
+
+    def process_midi(self, input_path: str, output_dir: str) -> Dict[str, Any]:
         """
-        Process a MIDI file and extract information about tracks.
+        Process a MIDI file, extract information about tracks and render them.
+        
+        The file is parsed once (see ``midi_analysis``); the analysis is
+        written to ``analysis.json``. Each instrument is rendered with the
+        soundfont on the process pool and written as its own stem (32-bit
+        float WAV at render level); the stems are then summed into a
+        normalized 16-bit mix.
         
         Args:
             input_path: Path to the input MIDI file
             output_dir: Directory to save processed data
             
         Returns:
-            Dictionary containing processed track information and paths
+            Dictionary containing track information and statistics, the
+            analysis path, the mix path and the stem path per instrument
         """
         try:
-            # Load MIDI file
-            midi_data = pretty_midi.PrettyMIDI(input_path)
+            with STAGE_SECONDS.labels(stage='parse').time():
+                analysis = self.analyzer.analyze(input_path)
             
             # Create output directory if it doesn't exist
             os.makedirs(output_dir, exist_ok=True)
             
-            # Process each instrument
-            track_info = {}
-            for i, instrument in enumerate(midi_data.instruments):
-                track_name = instrument.name if instrument.name else f"Track_{i}"
-                
-                # Get note pitches, ensuring they're converted to native Python types
-                notes = instrument.notes
-                pitches = [int(note.pitch) for note in notes] if notes else [0]
-                
-                # Count notes and other events
-                track_info[track_name] = {
-                    'program': int(instrument.program),
-                    'is_drum': bool(instrument.is_drum),
-                    'note_count': len(instrument.notes),
+            analysis_path = os.path.join(output_dir, "analysis.json")
+            with open(analysis_path, 'w') as f:
+                json.dump(analysis.to_dict(), f)
+            
+            instruments = self.instruments(analysis)
+            tracks = {
+                instrument['name']: {
+                    'program': instrument['program'],
+                    'is_drum': instrument['is_drum'],
+                    'note_count': len(instrument['notes']),
                     'pitch_range': [
-                        int(min(pitches)),
-                        int(max(pitches))
+                        int(instrument['notes']['pitch'].min()),
+                        int(instrument['notes']['pitch'].max())
                     ]
                 }
+                for instrument in instruments
+            }
             
-            # Synthesize audio
-            audio_data = midi_data.synthesize(fs=44100)
+            # Render instruments in parallel, longest first so one big track does not finish last
+            with STAGE_SECONDS.labels(stage='synthesis').time():
+                stems = self.render_tracks(instruments, output_dir)
             
-            # Save as WAV file
+            # Mix the stems into one WAV file
             output_wav = os.path.join(output_dir, "output.wav")
-            sf.write(output_wav, audio_data, 44100)
+            with STAGE_SECONDS.labels(stage='mix').time():
+                self.mix_stems(list(stems.values()), output_wav)
+            
+            PROCESSED_BYTES.labels(type='midi').inc(os.path.getsize(input_path))
+            PROCESSED_AUDIO_SECONDS.labels(type='midi').inc(analysis.duration)
+            PROCESSED_FILES.labels(type='midi', outcome='success').inc()
             
             result = {
-                'tracks': track_info,
-                'audio_file': output_wav
+                'track_info': analysis.track_info(),
+                'statistics': analysis.statistics(),
+                'analysis_path': analysis_path,
+                'tracks': tracks,
+                'audio_file': output_wav,
+                'stems': stems
             }
             
             return result
             
         except Exception as e:
+            PROCESSED_FILES.labels(type='midi', outcome='error').inc()
             logger.error(f"Error synthesizing audio: {str(e)}")
             raise
 
+    @staticmethod
+    def instruments(analysis: MidiAnalysis) -> List[Dict[str, Any]]:
+        """Notes grouped into instruments per track, channel and program, like General MIDI players do."""
+        notes = analysis.notes
+        keys = np.stack([notes['track'], notes['channel'], notes['program']], axis=1).astype(np.int64)
+        if not len(keys):
+            return []
+        groups, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+        order = np.argsort(inverse.ravel(), kind='stable')
+        per_track = np.bincount(groups[:, 0])
+        result = []
+        for (track, channel, program), group_notes in zip(groups, np.split(notes[order], np.cumsum(counts)[:-1])):
+            name = analysis.track_name(track)
+            if per_track[track] > 1:
+                name = f"{name} ({channel + 1}:{program})"
+            result.append({
+                'name': name,
+                'track': int(track),
+                'program': int(program),
+                'is_drum': bool(channel == DRUM_CHANNEL),
+                'notes': group_notes,
+            })
+        return result
+
+    def render_tracks(self, instruments: List[Dict[str, Any]], output_dir: str) -> Dict[str, str]:
+        """Render every instrument to its own stem file; returns the path per instrument name."""
+        pool = render_pool(self.max_workers)
+        futures = []
+        for index, instrument in sorted(enumerate(instruments), key=lambda item: -len(item[1]['notes'])):
+            notes = instrument['notes']
+            safe_name = re.sub(r'[^\w\-]+', '_', instrument['name']).strip('_') or "track"
+            path = os.path.join(output_dir, f"{index:02d}_{safe_name}.wav")
+            rows = np.column_stack([notes['start'], notes['end'], notes['pitch'], notes['velocity']])
+            futures.append((instrument['name'], path, pool.submit(
+                render_track, self.soundfont_path, rows, instrument['program'], instrument['is_drum'],
+                self.sample_rate, path
+            )))
+        stems = {}
+        try:
+            for name, path, future in futures:
+                future.result()
+                stems[name] = path
+        except BrokenProcessPool:
+            discard_render_pool(pool)
+            raise
+        return stems
+
+    def mix_stems(self, stem_paths: List[str], output_path: str, block_frames: int = 1 << 16):
+        """
+        Sum stem files block by block and write the mix normalized to just below full scale.
+
+        The stems are summed twice, once to find the peak and once to write
+        the scaled mix, so only one block per stem is ever in memory.
+        """
+        def mixed_blocks() -> Iterator[np.ndarray]:
+            with ExitStack() as stack:
+                stems = [stack.enter_context(sf.SoundFile(path)) for path in stem_paths]
+                while True:
+                    blocks = [stem.read(block_frames, dtype='float32', always_2d=True) for stem in stems]
+                    length = max((len(block) for block in blocks), default=0)
+                    if length == 0:
+                        return
+                    mix = np.zeros((length, 2), dtype=np.float32)
+                    for block in blocks:
+                        mix[:len(block)] += block
+                    yield mix
+
+        peak = max((float(np.abs(mix).max()) for mix in mixed_blocks()), default=0.0)
+        gain = 0.99 / peak if peak > 0 else 1.0
+        with sf.SoundFile(output_path, 'w', samplerate=self.sample_rate, channels=2) as output:
+            for mix in mixed_blocks():
+                output.write(mix * gain)
+
     def get_track_names(self, midi_path: str) -> List[str]:
         """Get a list of track names from a MIDI file."""
         try:
-            midi_data = pretty_midi.PrettyMIDI(midi_path)
-            return [instr.name if instr.name else f"Track_{i}" 
-                   for i, instr in enumerate(midi_data.instruments)]
+            analysis = self.analyzer.analyze(midi_path)
+            return [instrument['name'] for instrument in self.instruments(analysis)]
         except Exception as e:
             logger.error(f"Error getting track names: {str(e)}")
             return []
@@ -0,0 +1,236 @@
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import ExitStack
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import numpy as np
+
+from separation import SAMPLE_RATE, CHANNELS, SeparatorPool
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, "pretrained_models")
+MODEL_URL = "https://github.com/deezer/spleeter/releases/download/v1.4.0/{stems}stems.tar.gz"
+SUPPORTED_STEMS = (2, 4, 5)
+
+# Published stem names per model; the 5-stem piano stem is published as guitar
+STEM_MAPPINGS = {
+    2: {'vocals': 'vocals', 'accompaniment': 'accompaniment'},
+    4: {'vocals': 'vocals', 'drums': 'drums', 'bass': 'bass', 'other': 'other'},
+    5: {'vocals': 'vocals', 'drums': 'drums', 'bass': 'bass', 'piano': 'guitar', 'other': 'other'},
+}
+OUTPUT_STEMS = sorted({name for mapping in STEM_MAPPINGS.values() for name in mapping.values()})
+
+# Spleeter resolves "spleeter:<n>stems" against MODEL_PATH; point it at the models we manage
+os.environ.setdefault("MODEL_PATH", MODELS_DIR)
+
+
+def model_name(stems: int) -> str:
+    return f"spleeter:{stems}stems"
+
+
+def select_model(requested: Iterable[str]) -> int:
+    """Stem count of the cheapest model whose outputs cover every requested stem."""
+    requested = set(requested)
+    unknown = requested - set(OUTPUT_STEMS)
+    if unknown:
+        raise ValueError(f"Unknown stems: {sorted(unknown)}; expected some of {OUTPUT_STEMS}")
+    for stems in SUPPORTED_STEMS:
+        if requested <= set(STEM_MAPPINGS[stems].values()):
+            return stems
+    raise ValueError(f"No single model provides all of {sorted(requested)}")
+
+
+def download_file(url, filename):
+    """Download a file with progress indication"""
+    logger.info(f"Downloading {url} to {filename}")
+    try:
+        urllib.request.urlretrieve(url, filename)
+        return True
+    except Exception as e:
+        logger.error(f"Error downloading file: {str(e)}")
+        return False
+
+# Check if model exists, if not download it
+def ensure_model(stems: int = 5):
+    checkpoint_dir = os.path.join(MODELS_DIR, f"{stems}stems")
+    checkpoint_path = os.path.join(checkpoint_dir, "model.data-00000-of-00001")
+    if not os.path.exists(checkpoint_path):
+        logger.info(f"Downloading Spleeter {stems}stems model...")
+        model_url = MODEL_URL.format(stems=stems)
+        temp_file = os.path.join(tempfile.gettempdir(), f"{stems}stems.tar.gz")
+
+        try:
+            # Download the model
+            if not download_file(model_url, temp_file):
+                raise Exception("Failed to download model file")
+
+            logger.info("Model downloaded, extracting...")
+
+            # Extract using tarfile module
+            with tarfile.open(temp_file, 'r:gz') as tar:
+                # Create the target directory if it doesn't exist
+                os.makedirs(checkpoint_dir, exist_ok=True)
+
+                # Extract all files to the checkpoint directory
+                tar.extractall(path=checkpoint_dir)
+
+            logger.info("Model extracted successfully")
+
+            # Verify the model files exist
+            required_files = [
+                "model.data-00000-of-00001",
+                "model.index",
+                "model.meta"
+            ]
+
+            missing_files = [
+                f for f in required_files
+                if not os.path.exists(os.path.join(checkpoint_dir, f))
+            ]
+
+            if missing_files:
+                raise Exception(f"Missing model files: {missing_files}")
+
+            logger.info("Model files verified successfully")
+
+        except Exception as e:
+            logger.error(f"Error setting up model: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+                logger.info("Cleaned up temporary file")
+
+
+def spleeter_factory(stems: int) -> Callable[[], Any]:
+    """Return a factory building a Spleeter separator, importing TensorFlow only when called."""
+    def create():
+        ensure_model(stems)
+        from spleeter.separator import Separator
+        return Separator(model_name(stems), multiprocess=False)
+    return create
+
+
+class FakeSeparator:
+    """
+    Stand-in for Spleeter with a tunable synthetic cost, for load tests without the model.
+
+    Splits the input evenly across the model's stems after spending
+    ``overhead + cost * audio_seconds`` seconds on it: sleeping, which
+    releases the GIL like TensorFlow does, or spinning in Python, which
+    holds it and shows contention between threads.
+
+    Args:
+        stems: Model whose stem names are returned (2, 4 or 5)
+        cost: Seconds spent per second of audio
+        overhead: Seconds spent per call, whatever its length
+        busy: Spin on the CPU instead of sleeping
+    """
+
+    def __init__(self, stems: int, cost: float = 0.05, overhead: float = 0.0, busy: bool = False):
+        self.stems = list(STEM_MAPPINGS[stems])
+        self.cost = cost
+        self.overhead = overhead
+        self.busy = busy
+
+    def separate(self, waveform: np.ndarray) -> Dict[str, np.ndarray]:
+        delay = self.overhead + self.cost * len(waveform) / SAMPLE_RATE
+        if self.busy:
+            deadline = time.perf_counter() + delay
+            while time.perf_counter() < deadline:
+                pass
+        elif delay > 0:
+            time.sleep(delay)
+        share = np.asarray(waveform, dtype=np.float32) / len(self.stems)
+        return {stem: share for stem in self.stems}
+
+
+def fake_factory(cost: float = 0.05, overhead: float = 0.0, busy: bool = False) -> Callable[[int], Callable[[], Any]]:
+    """``ModelRegistry`` factory building ``FakeSeparator`` instances; picklable, so worker processes can use it."""
+    return partial(_fake_separator, cost=cost, overhead=overhead, busy=busy)
+
+
+def _fake_separator(stems: int, cost: float, overhead: float, busy: bool) -> Callable[[], FakeSeparator]:
+    return partial(FakeSeparator, stems, cost, overhead, busy)
+
+
+class ModelRegistry:
+    """
+    Lazily loaded separator pools keyed by stem count (2, 4 or 5).
+
+    Nothing is built at import time. A pool is created on first use, and
+    ``warm_up`` loads models in the background with a dummy inference so
+    the TensorFlow graph is built before the first real request.
+    """
+
+    def __init__(self, pool_size: int = 1, factory: Callable[[int], Callable[[], Any]] = spleeter_factory):
+        self.pool_size = pool_size
+        self.factory = factory
+        self._pools: Dict[int, SeparatorPool] = {}
+        self._status: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, stems: int) -> SeparatorPool:
+        """Separator pool for a stem count, created on first use."""
+        if stems not in SUPPORTED_STEMS:
+            raise ValueError(f"Unsupported stem count {stems}; expected one of {SUPPORTED_STEMS}")
+        with self._lock:
+            if stems not in self._pools:
+                self._pools[stems] = SeparatorPool(self.factory(stems), size=self.pool_size, name=model_name(stems))
+                self._status[stems] = {'state': 'unloaded', 'load_seconds': None, 'error': None}
+            return self._pools[stems]
+
+    def warm_up(self, stems: int):
+        """Load every instance of a pool and run one dummy inference on each."""
+        pool = self.pool(stems)
+        status = self._status[stems]
+        status['state'] = 'loading'
+        started = time.perf_counter()
+        try:
+            silence = np.zeros((SAMPLE_RATE, CHANNELS), dtype=np.float32)
+            with ExitStack() as stack:
+                separators = [stack.enter_context(pool.acquire()) for _ in range(pool.size)]
+                for separator in separators:
+                    separator.separate(silence)
+        except Exception as e:
+            status.update(state='failed', error=str(e))
+            logger.error("Failed to warm up %s: %s", model_name(stems), str(e))
+            return
+        status.update(state='ready', load_seconds=round(time.perf_counter() - started, 3))
+        logger.info("Warmed up %s in %.1fs", model_name(stems), status['load_seconds'])
+
+    def warm_up_in_background(self, stems_list: Iterable[int], before: Optional[Callable[[], None]] = None) -> threading.Thread:
+        """Run ``before`` and then warm up each model on a daemon thread."""
+        def run():
+            if before is not None:
+                before()
+            for stems in stems_list:
+                self.warm_up(stems)
+        thread = threading.Thread(target=run, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self, stems: int) -> bool:
+        return self._status.get(stems, {}).get('state') == 'ready'
+
+    def close(self):
+        """Release every loaded separator, stopping worker processes if there are any."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Load state and timing per model, for the readiness endpoint."""
+        with self._lock:
+            return {model_name(stems): dict(status) for stems, status in self._status.items()}
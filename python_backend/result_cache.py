@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+STAGING_PREFIX = ".staging-"
+
+
+def make_cache_key(audio_hash: str, model: str, config: Dict[str, Any]) -> str:
+    """Combine the decoded-audio hash with everything else that shapes the output."""
+    payload = json.dumps({'audio': audio_hash, 'model': model, 'config': config}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def hash_pcm(reader, block_frames: int = 1 << 16) -> str:
+    """SHA-256 of every sample a reader yields, read in bounded blocks."""
+    digest = hashlib.sha256()
+    while True:
+        block = reader.read(block_frames, dtype='float32', always_2d=True)
+        if len(block) == 0:
+            break
+        digest.update(block.tobytes())
+        if len(block) < block_frames:
+            break
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed store for separation results on local disk.
+
+    Each entry is a directory named after its key holding the output files
+    and a manifest. Entries are built in a staging directory and renamed into
+    place, so readers never see a half-written result. Once the total size
+    exceeds ``max_bytes`` the least recently used entries are evicted.
+
+    With a remote ``storage`` (see ``storage.S3Storage``) the local directory
+    is a hot tier in front of it: published entries are uploaded before they
+    appear locally, and local misses are filled from the remote copy.
+    """
+
+    def __init__(self, root: str, max_bytes: int, storage=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.storage = storage
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def get(self, key: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Return ``{name: info}`` for a cached entry, or None on a miss."""
+        with self._lock:
+            found = key in self._entries
+            if found:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        if found:
+            entry_dir = os.path.join(self.root, key)
+            try:
+                os.utime(entry_dir)
+                return self._read_manifest(entry_dir)
+            except OSError:
+                # Evicted between the lookup and the read
+                pass
+        files = self._fetch_remote(key)
+        with self._lock:
+            if files is None:
+                self.misses += 1
+            else:
+                self.remote_hits += 1
+        return files
+
+    def create_staging(self) -> str:
+        """Create an empty directory to build a new entry in."""
+        return tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=self.root)
+
+    def publish(
+        self,
+        key: str,
+        staging_dir: str,
+        files: Dict[str, Dict[str, Any]],
+        upload: bool = True,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Move a staging directory into the cache under ``key``.
+
+        Args:
+            key: Cache key from ``make_cache_key``
+            staging_dir: Directory returned by ``create_staging``
+            files: Mapping of output names to their info; ``info['file']`` is
+                the file name inside ``staging_dir``, other keys are kept as is
+            upload: Copy the entry to the remote storage first, if there is one
+
+        Returns:
+            The same info per output name, with the final ``path`` and the ``key`` added
+        """
+        with open(os.path.join(staging_dir, MANIFEST_NAME), 'w') as f:
+            json.dump(files, f)
+        if upload and self.storage is not None and self.storage.remote:
+            self.storage.upload_entry(key, staging_dir, files)
+        size = self._dir_size(staging_dir)
+        entry_dir = os.path.join(self.root, key)
+
+        with self._lock:
+            try:
+                os.rename(staging_dir, entry_dir)
+            except OSError:
+                # Another worker published the same result first; keep theirs
+                shutil.rmtree(staging_dir, ignore_errors=True)
+            else:
+                self._entries[key] = size
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            evicted = self._evict()
+
+        for old_key in evicted:
+            shutil.rmtree(os.path.join(self.root, old_key), ignore_errors=True)
+            logger.info("Evicted cached result %s", old_key)
+        return self._read_manifest(entry_dir)
+
+    def discard(self, staging_dir: str):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'remote_hits': self.remote_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': sum(self._entries.values()),
+                'max_bytes': self.max_bytes,
+            }
+
+    def _fetch_remote(self, key: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        # Copy a remote entry into the hot tier so later reads stay local
+        if self.storage is None or not self.storage.remote:
+            return None
+        files = self.storage.fetch_manifest(key)
+        if files is None:
+            return None
+        staging_dir = self.create_staging()
+        try:
+            self.storage.download_entry(key, staging_dir, files)
+        except Exception as e:
+            logger.warning("Could not fetch cached result %s: %s", key, e)
+            self.discard(staging_dir)
+            return None
+        return self.publish(key, staging_dir, files, upload=False)
+
+    def _evict(self):
+        evicted = []
+        total = sum(self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            total -= size
+            evicted.append(key)
+        return evicted
+
+    def _load(self):
+        # Rebuild the LRU order from directory modification times
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith(STAGING_PREFIX) or not os.path.exists(os.path.join(path, MANIFEST_NAME)):
+                # Left over from an interrupted run
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            found.append((os.path.getmtime(path), name, self._dir_size(path)))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+
+    def _read_manifest(self, entry_dir: str) -> Dict[str, Dict[str, Any]]:
+        with open(os.path.join(entry_dir, MANIFEST_NAME)) as f:
+            files = json.load(f)
+        key = os.path.basename(entry_dir)
+        return {
+            name: {**info, 'key': key, 'path': os.path.join(entry_dir, info['file'])}
+            for name, info in files.items()
+        }
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(dirpath, filename))
+            for dirpath, _, filenames in os.walk(path)
+            for filename in filenames
+        )
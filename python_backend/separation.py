@@ -0,0 +1,411 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from audio_io import open_writer
+from metrics import MODEL_LOAD_SECONDS, SEPARATION_WINDOW_SECONDS, SILENCE_SKIPPED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+# Frames per block of the silence scan, about 46 ms at 44.1 kHz
+SILENCE_BLOCK_FRAMES = 2048
+
+
+class FrameLevels(NamedTuple):
+    """RMS per analysis frame of a whole input, e.g. the ``rms`` column of ``features``."""
+
+    rms: np.ndarray
+    # Samples between frame starts, and samples each frame covers
+    hop: int
+    frame_length: int
+
+
+class SeparatorPool:
+    """
+    Hands out separators to concurrent callers.
+
+    Spleeter separators keep per-instance prediction state, so a single
+    instance must never serve two windows at once. The pool creates up to
+    ``size`` instances on demand and lends each to one caller at a time.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 1, name: str = "separator"):
+        self.factory = factory
+        self.size = max(1, size)
+        # Model label for metrics
+        self.name = name
+        self._idle: "queue.Queue[Any]" = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Any]:
+        """Borrow a separator for the duration of the ``with`` block."""
+        separator = None
+        try:
+            separator = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    started = time.perf_counter()
+                    separator = self.factory()
+                    MODEL_LOAD_SECONDS.labels(model=self.name).observe(time.perf_counter() - started)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                separator = self._idle.get()
+        try:
+            yield separator
+        finally:
+            self._idle.put(separator)
+
+    def close(self):
+        """Close idle separators that hold resources, such as worker processes."""
+        while True:
+            try:
+                separator = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            if hasattr(separator, 'close'):
+                separator.close()
+
+
+class ChunkedSeparator:
+    """
+    Separates arbitrarily long audio in overlapping windows.
+
+    Windows of ``chunk_seconds`` overlap by ``overlap_seconds``; they are
+    separated in parallel on the separator pool and stitched back in order,
+    with a linear crossfade over each overlap. Only a bounded number of
+    windows is held in memory at any time, so peak memory does not depend
+    on the track length.
+
+    With a ``silence_threshold_db``, each window is scanned for blocks
+    whose RMS is below the threshold first. Silent windows are not sent to
+    the model at all, and windows that start or end in silence only have
+    their active span separated; the skipped frames come out as exact zeros.
+    """
+
+    def __init__(
+        self,
+        pool: SeparatorPool,
+        chunk_seconds: float = 30.0,
+        overlap_seconds: float = 1.0,
+        max_workers: Optional[int] = None,
+        sample_rate: int = SAMPLE_RATE,
+        stems: Optional[Iterable[str]] = None,
+        silence_threshold_db: Optional[float] = None,
+        silence_margin_seconds: float = 0.5,
+    ):
+        self.pool = pool
+        # Stems to keep; the others are dropped right after separation
+        self.stems = set(stems) if stems is not None else None
+        # Mean square below which a block counts as silent; None separates everything
+        self.silence_threshold_db = silence_threshold_db
+        self.silence_power = 10.0 ** (silence_threshold_db / 10.0) if silence_threshold_db is not None else None
+        # Audio kept around active content so decays and model context are not cut off
+        self.silence_margin_frames = int(silence_margin_seconds * sample_rate)
+        # Frames of the last ``separate`` call that were not sent to the model
+        self.skipped_frames = 0
+        self._stem_names: Optional[Tuple[str, ...]] = tuple(sorted(self.stems)) if self.stems is not None else None
+        self.sample_rate = sample_rate
+        self.chunk_frames = int(chunk_seconds * sample_rate)
+        self.overlap_frames = int(overlap_seconds * sample_rate)
+        if self.chunk_frames <= 0:
+            raise ValueError("chunk_seconds must be positive")
+        if not 0 <= 2 * self.overlap_frames <= self.chunk_frames:
+            raise ValueError("overlap_seconds must be between 0 and half of chunk_seconds")
+        self.max_workers = max_workers or pool.size
+
+    def separate(
+        self,
+        reader,
+        sink: Callable[[Dict[str, np.ndarray]], None],
+        checkpoint=None,
+        levels: Optional[FrameLevels] = None,
+    ) -> int:
+        """
+        Separate everything ``reader`` yields and feed stitched stems to ``sink``.
+
+        Args:
+            reader: Object with a ``read(frames)`` method returning a float32
+                array of shape (frames, channels); shorter at end of stream
+            sink: Called with consecutive ``{stem: block}`` dictionaries that
+                together make up the full-length stems
+            checkpoint: Optional store of finished windows with ``match(config)``,
+                ``load(index)`` and ``save(index, stems, skipped)`` (see
+                ``job_store.WindowCheckpoint``); windows it has are loaded
+                instead of separated again
+            levels: Frame RMS of the same input, already computed; the silence
+                scan reads it instead of the samples where it covers a window
+
+        Returns:
+            Number of frames written to the sink per stem
+        """
+        written = 0
+        self.skipped_frames = 0
+        if checkpoint is not None:
+            checkpoint.match(self.window_config())
+        tail: Optional[Dict[str, np.ndarray]] = None
+        pending: deque = deque()
+        max_in_flight = self.max_workers + 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="separation") as executor:
+            def drain_one():
+                nonlocal tail, written
+                index, is_last, future = pending.popleft()
+                stems, skipped = future.result()
+                self.skipped_frames += skipped
+                blocks, tail = self._stitch(stems, tail, index, is_last)
+                if blocks:
+                    sink(blocks)
+                    written += len(next(iter(blocks.values())))
+
+            for index, waveform, is_last in self._windows(reader):
+                if len(pending) >= max_in_flight:
+                    drain_one()
+                # Windows log under the trace id of the request they belong to
+                context = contextvars.copy_context()
+                pending.append((index, is_last, executor.submit(
+                    context.run, self._separate_checkpointed, checkpoint, index, waveform, levels,
+                )))
+            while pending:
+                drain_one()
+
+        if self.skipped_frames:
+            SILENCE_SKIPPED_SECONDS.inc(self.skipped_frames / self.sample_rate)
+        return written
+
+    def active_span(
+        self,
+        waveform: np.ndarray,
+        levels: Optional[FrameLevels] = None,
+        offset: int = 0,
+    ) -> Optional[Tuple[int, int]]:
+        """
+        ``(start, end)`` of the window that needs separating, or None if it is all silence.
+
+        Blocks of ``SILENCE_BLOCK_FRAMES`` are compared by mean square power
+        across channels; the span runs from the first to the last loud
+        block, widened by the silence margin. With ``levels`` covering the
+        window, which starts ``offset`` frames into the input, their frames
+        stand in for the blocks and the samples are not scanned.
+        """
+        length = len(waveform)
+        if self.silence_power is None or length == 0:
+            return (0, length)
+        if levels is not None and len(levels.rms) * levels.hop + levels.frame_length >= offset + length:
+            # Frames overlapping the window
+            first = max(0, (offset - levels.frame_length) // levels.hop + 1)
+            last = -(-(offset + length) // levels.hop)
+            rms = levels.rms[first:last].astype(np.float64)
+            loud = np.flatnonzero(rms * rms > self.silence_power)
+            if len(loud) == 0:
+                return None
+            start = (first + int(loud[0])) * levels.hop - offset
+            end = (first + int(loud[-1])) * levels.hop + levels.frame_length - offset
+        else:
+            power = np.einsum('ij,ij->i', waveform, waveform) / waveform.shape[1]
+            starts = np.arange(0, length, SILENCE_BLOCK_FRAMES)
+            block_power = np.add.reduceat(power, starts) / np.diff(np.append(starts, length))
+            loud = np.flatnonzero(block_power > self.silence_power)
+            if len(loud) == 0:
+                return None
+            start = int(starts[loud[0]])
+            end = int(starts[loud[-1]]) + SILENCE_BLOCK_FRAMES
+        return (max(0, start - self.silence_margin_frames), min(length, end + self.silence_margin_frames))
+
+    def window_config(self) -> Dict[str, Any]:
+        """Settings that decide how a file is cut into windows and what each window holds."""
+        return {
+            'sample_rate': self.sample_rate,
+            'chunk_frames': self.chunk_frames,
+            'overlap_frames': self.overlap_frames,
+            'silence_threshold_db': self.silence_threshold_db,
+            'silence_margin_frames': self.silence_margin_frames,
+            'stems': sorted(self.stems) if self.stems is not None else None,
+        }
+
+    def _separate_checkpointed(
+        self,
+        checkpoint,
+        index: int,
+        waveform: np.ndarray,
+        levels: Optional[FrameLevels] = None,
+    ) -> Tuple[Dict[str, np.ndarray], int]:
+        if checkpoint is not None:
+            saved = checkpoint.load(index)
+            if saved is not None:
+                return saved
+        span = self.active_span(waveform, levels, index * (self.chunk_frames - self.overlap_frames))
+        stems, skipped = self._separate_window(waveform, self.overlap_frames if index else 0, span)
+        if checkpoint is not None:
+            checkpoint.save(index, stems, skipped)
+        return stems, skipped
+
+    def _separate_window(
+        self,
+        waveform: np.ndarray,
+        shared: int,
+        span: Optional[Tuple[int, int]],
+    ) -> Tuple[Dict[str, np.ndarray], int]:
+        """
+        Separate the ``span`` of one window (see ``active_span``), its silent edges skipped.
+
+        Returns the stems and how many frames were skipped, not counting the
+        first ``shared`` frames that overlap the previous window.
+        """
+        length = len(waveform)
+        if span is None and self._stem_names is not None:
+            return {stem: np.zeros_like(waveform) for stem in self._stem_names}, length - shared
+        # A silent window before any stem names are known still goes through one block to learn them
+        start, end = span if span is not None else (0, min(length, SILENCE_BLOCK_FRAMES))
+        skipped = max(0, start - shared) + (length - max(end, shared))
+
+        with self.pool.acquire() as separator:
+            with SEPARATION_WINDOW_SECONDS.labels(model=self.pool.name).time():
+                stems = separator.separate(waveform[start:end] if end - start < length else waveform)
+        result = {}
+        for stem, data in stems.items():
+            if self.stems is not None and stem not in self.stems:
+                continue
+            data = np.asarray(data, dtype=np.float32)
+            # Spleeter pads to its segment size; keep stems aligned with the input window
+            if len(data) > end - start:
+                data = data[:end - start]
+            if start > 0 or len(data) < length:
+                data = np.pad(data, ((start, length - start - len(data)), (0, 0)))
+            result[stem] = data
+        if self._stem_names is None:
+            self._stem_names = tuple(sorted(result))
+        return result, skipped
+
+    def _windows(self, reader) -> Iterator[Tuple[int, np.ndarray, bool]]:
+        """Yield ``(index, waveform, is_last)`` for each overlapping window."""
+        hop = self.chunk_frames - self.overlap_frames
+        window = self._read(reader, self.chunk_frames)
+        if len(window) == 0:
+            return
+        index = 0
+        while True:
+            fresh = self._read(reader, hop) if len(window) == self.chunk_frames else window[:0]
+            is_last = len(fresh) == 0
+            yield index, window, is_last
+            if is_last:
+                return
+            window = np.concatenate([window[len(window) - self.overlap_frames:], fresh])
+            index += 1
+
+    @staticmethod
+    def _read(reader, frames: int) -> np.ndarray:
+        data = reader.read(frames, dtype='float32', always_2d=True)
+        if data.shape[1] == 1:
+            data = np.repeat(data, CHANNELS, axis=1)
+        return data
+
+    def _stitch(
+        self,
+        stems: Dict[str, np.ndarray],
+        tail: Optional[Dict[str, np.ndarray]],
+        index: int,
+        is_last: bool,
+    ) -> Tuple[Dict[str, np.ndarray], Optional[Dict[str, np.ndarray]]]:
+        """Crossfade a separated window into the previous tail and split off the next tail."""
+        overlap = self.overlap_frames
+        head = overlap if index > 0 else 0
+        keep = 0 if is_last else overlap
+        fade_in = ((np.arange(head, dtype=np.float32) + 0.5) / max(head, 1))[:, None]
+
+        blocks, new_tail = {}, {}
+        for stem, data in stems.items():
+            parts = []
+            if head:
+                parts.append(tail[stem] * (1.0 - fade_in) + data[:head] * fade_in)
+            parts.append(data[head:len(data) - keep])
+            blocks[stem] = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            if keep:
+                new_tail[stem] = data[len(data) - keep:]
+        return blocks, (new_tail or None)
+
+
+class StemFileWriter:
+    """
+    Sink for ``ChunkedSeparator`` that appends each stem to its own audio file.
+
+    Blocks of different stems are encoded in parallel on a thread pool;
+    libsndfile and the FFmpeg pipes both release the GIL while they work.
+    With a ``container`` (a ``StemContainerWriter``), every block is also
+    written to it while the encoders run.
+    """
+
+    def __init__(
+        self,
+        paths: Dict[str, str],
+        sample_rate: int = SAMPLE_RATE,
+        output_format: str = 'wav',
+        bitrate: Optional[str] = None,
+        ffmpeg_path: str = "ffmpeg",
+        container=None,
+    ):
+        self.paths = paths
+        self.container = container
+        self.sample_rate = sample_rate
+        self.output_format = output_format
+        self.bitrate = bitrate
+        self.ffmpeg_path = ffmpeg_path
+        self.frames = 0
+        self._files: Dict[str, Any] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(paths)), thread_name_prefix="stem-encoder")
+
+    def __call__(self, blocks: Dict[str, np.ndarray]):
+        blocks = {stem: block for stem, block in blocks.items() if stem in self.paths}
+        for stem, block in blocks.items():
+            if stem not in self._files:
+                self._files[stem] = open_writer(
+                    self.paths[stem], self.output_format,
+                    sample_rate=self.sample_rate,
+                    channels=block.shape[1],
+                    ffmpeg_path=self.ffmpeg_path,
+                    bitrate=self.bitrate,
+                )
+        writes = self._executor.map(lambda item: self._files[item[0]].write(item[1]), blocks.items())
+        if self.container is not None and blocks:
+            self.container(blocks)
+        # Wait for every stem so blocks stay in order and errors surface here
+        list(writes)
+        if blocks:
+            self.frames += len(next(iter(blocks.values())))
+
+    def close(self):
+        try:
+            closes = self._executor.map(lambda f: f.close(), list(self._files.values()))
+            if self.container is not None:
+                self.container.close()
+            list(closes)
+        finally:
+            self._files.clear()
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
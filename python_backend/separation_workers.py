@@ -0,0 +1,305 @@
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from separation import CHANNELS, SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+# Windows up to this length fit the buffers allocated with each worker; longer ones grow them
+DEFAULT_MAX_FRAMES = 31 * SAMPLE_RATE
+# Seconds a worker gets to load its model before the pool gives up on it
+START_TIMEOUT = 600
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on, honouring cgroup and taskset limits."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_slices(workers: int, cpus: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """
+    Split the available CPUs into ``workers`` disjoint, contiguous sets.
+
+    Neighbouring CPU ids usually share a core or a cache, so keeping each
+    worker on a contiguous range keeps its threads close together. With more
+    workers than CPUs, workers are spread over the CPUs one each, round-robin.
+    """
+    cpus = list(cpus if cpus is not None else available_cpus())
+    workers = max(1, workers)
+    if workers >= len(cpus):
+        return [[cpus[index % len(cpus)]] for index in range(workers)]
+    size, extra = divmod(len(cpus), workers)
+    slices, start = [], 0
+    for index in range(workers):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cpus[start:end])
+        start = end
+    return slices
+
+
+def configure_threads(intra_op_threads: int, inter_op_threads: int, cpus: Optional[Sequence[int]] = None):
+    """
+    Pin the current process to ``cpus`` and size TensorFlow's thread pools.
+
+    Must run before TensorFlow is imported: the environment variables are
+    what TF1-style sessions (which Spleeter uses) read their pool sizes from.
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+    # oneDNN and Eigen kernels size their own OpenMP pools
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "2")
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def _worker_main(connection, build: Callable[..., Any], args: Tuple, intra_op_threads: int, inter_op_threads: int, cpus: List[int]):
+    """Load a separator, then separate windows from shared memory until told to stop."""
+    try:
+        configure_threads(intra_op_threads, inter_op_threads, cpus)
+        separator = build(*args)
+    except Exception as e:
+        connection.send(('error', f"{type(e).__name__}: {e}"))
+        return
+    connection.send(('ready', os.getpid()))
+
+    buffers: Dict[str, shared_memory.SharedMemory] = {}
+
+    def attach(name: str) -> shared_memory.SharedMemory:
+        if name not in buffers:
+            buffers[name] = shared_memory.SharedMemory(name=name)
+        return buffers[name]
+
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                return
+            frames, channels, input_name, output_name, capacity = message
+            # Buffers the parent has replaced since the last window
+            for name in [name for name in buffers if name not in (input_name, output_name)]:
+                buffers.pop(name).close()
+            try:
+                waveform = np.ndarray((frames, channels), dtype=np.float32, buffer=attach(input_name).buf)
+                stems = separator.separate(waveform)
+                if len(stems) > capacity:
+                    raise ValueError(f"Separator returned {len(stems)} stems, expected at most {capacity}")
+                output = np.ndarray((capacity, frames, channels), dtype=np.float32, buffer=attach(output_name).buf)
+                for index, data in enumerate(stems.values()):
+                    data = np.asarray(data, dtype=np.float32)[:frames]
+                    output[index, :len(data)] = data
+                    output[index, len(data):] = 0.0
+                connection.send(('ok', list(stems)))
+            except Exception as e:
+                connection.send(('error', f"{type(e).__name__}: {e}"))
+    except (EOFError, KeyboardInterrupt):
+        return
+    finally:
+        for buffer in buffers.values():
+            buffer.close()
+
+
+class ProcessSeparator:
+    """
+    Separator running in its own worker process, pinned to a set of CPUs.
+
+    Drop-in for an in-process separator in a ``SeparatorPool``: ``separate``
+    copies the window into a shared-memory buffer, the worker writes the
+    stems into a second one, and only window sizes and stem names travel
+    through the pipe. Several of these in one pool give real parallelism,
+    where threads in one process contend for the GIL and one TensorFlow
+    runtime.
+
+    Args:
+        build: Picklable callable returning the separator inside the worker,
+            e.g. a module-level function; called with ``args``
+        args: Arguments for ``build``
+        stems: Maximum number of stems the separator returns
+        intra_op_threads: TensorFlow threads per operation
+        inter_op_threads: TensorFlow operations run at once
+        cpus: CPUs the worker is pinned to; unpinned when empty
+        max_frames: Window length the buffers are sized for up front
+        channels: Channels of the windows the buffers are sized for
+    """
+
+    def __init__(
+        self,
+        build: Callable[..., Any],
+        args: Tuple = (),
+        stems: int = 5,
+        intra_op_threads: int = 1,
+        inter_op_threads: int = 1,
+        cpus: Optional[Sequence[int]] = None,
+        max_frames: int = DEFAULT_MAX_FRAMES,
+        channels: int = CHANNELS,
+    ):
+        self.build = build
+        self.args = args
+        self.stems = stems
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.cpus = list(cpus or [])
+        self._context = multiprocessing.get_context("spawn")
+        self._input: Optional[shared_memory.SharedMemory] = None
+        self._output: Optional[shared_memory.SharedMemory] = None
+        self._capacity = 0
+        self._process = None
+        self._connection = None
+        self._lock = threading.Lock()
+        self._allocate(max_frames * channels)
+        try:
+            self._start()
+        except Exception:
+            self._release()
+            raise
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self._process.pid if self._process is not None else None
+
+    def separate(self, waveform: np.ndarray) -> Dict[str, np.ndarray]:
+        waveform = np.asarray(waveform, dtype=np.float32)
+        frames, channels = waveform.shape
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                logger.warning("Separation worker %s is gone, starting a new one", self.pid)
+                self._start()
+            if frames * channels > self._capacity:
+                self._allocate(frames * channels)
+            np.ndarray((frames, channels), dtype=np.float32, buffer=self._input.buf)[:] = waveform
+            try:
+                self._connection.send((frames, channels, self._input.name, self._output.name, self.stems))
+                status, payload = self._connection.recv()
+            except (EOFError, OSError) as e:
+                self._stop()
+                raise RuntimeError(f"Separation worker exited while separating: {e}") from e
+            if status != 'ok':
+                raise RuntimeError(f"Separation worker failed: {payload}")
+            output = np.ndarray((self.stems, frames, channels), dtype=np.float32, buffer=self._output.buf)
+            # Copy out: the buffer is overwritten by the next window
+            return {stem: output[index].copy() for index, stem in enumerate(payload)}
+
+    def close(self):
+        with self._lock:
+            self._stop()
+            self._release()
+
+    def _start(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child, self.build, self.args, self.intra_op_threads, self.inter_op_threads, self.cpus),
+            name="separation-worker",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        try:
+            if not parent.poll(START_TIMEOUT):
+                raise RuntimeError(f"Separation worker did not start within {START_TIMEOUT}s")
+            status, payload = parent.recv()
+        except EOFError:
+            status, payload = 'error', f"exited with code {process.exitcode}"
+        except Exception:
+            process.kill()
+            process.join()
+            raise
+        if status != 'ready':
+            process.join(timeout=5)
+            raise RuntimeError(f"Separation worker failed to start: {payload}")
+        self._process, self._connection = process, parent
+        logger.info("Started separation worker %s on CPUs %s", process.pid, self.cpus or "all")
+
+    def _stop(self):
+        if self._process is None:
+            return
+        try:
+            self._connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._connection.close()
+        self._process = self._connection = None
+
+    def _allocate(self, samples: int):
+        """(Re)create the shared buffers for windows of up to ``samples`` values."""
+        self._release()
+        window_bytes = samples * np.dtype(np.float32).itemsize
+        self._input = shared_memory.SharedMemory(create=True, size=window_bytes)
+        self._output = shared_memory.SharedMemory(create=True, size=window_bytes * self.stems)
+        self._capacity = samples
+
+    def _release(self):
+        for buffer in (self._input, self._output):
+            if buffer is not None:
+                buffer.close()
+                buffer.unlink()
+        self._input = self._output = None
+        self._capacity = 0
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _create_separator(factory: Callable[[int], Callable[[], Any]], stems: int) -> Any:
+    return factory(stems)()
+
+
+def process_factory(
+    factory: Callable[[int], Callable[[], Any]],
+    workers: int,
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: int = 1,
+) -> Callable[[int], Callable[[], ProcessSeparator]]:
+    """
+    Factory for ``ModelRegistry`` that runs each separator in a pinned worker process.
+
+    The available CPUs are split into ``workers`` slices; the n-th worker
+    of every model gets the n-th slice, and ``intra_op_threads`` defaults
+    to the slice size so workers never compete for the same cores.
+
+    Args:
+        factory: Picklable ``ModelRegistry`` factory, e.g. ``spleeter_factory``;
+            called inside each worker to build its separator
+        workers: Worker processes per model, usually the pool size
+        intra_op_threads: TensorFlow threads per operation in each worker
+        inter_op_threads: TensorFlow operations run at once in each worker
+    """
+    slices = cpu_slices(workers)
+
+    def process_separators(stems: int) -> Callable[[], ProcessSeparator]:
+        started = [0]
+        lock = threading.Lock()
+
+        def create() -> ProcessSeparator:
+            with lock:
+                cpus = slices[started[0] % len(slices)]
+                started[0] += 1
+            return ProcessSeparator(
+                _create_separator, (factory, stems), stems=stems,
+                intra_op_threads=intra_op_threads or len(cpus),
+                inter_op_threads=inter_op_threads,
+                cpus=cpus,
+            )
+        return create
+    return process_separators
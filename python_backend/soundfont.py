@@ -0,0 +1,303 @@
+import logging
+import struct
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SoundFont 2 generator operators used by the renderer
+START_OFFSET, END_OFFSET, LOOP_START_OFFSET, LOOP_END_OFFSET = 0, 1, 2, 3
+START_COARSE, END_COARSE, LOOP_START_COARSE, LOOP_END_COARSE = 4, 12, 45, 50
+PAN = 17
+DELAY_VOL_ENV, ATTACK_VOL_ENV, HOLD_VOL_ENV, DECAY_VOL_ENV, SUSTAIN_VOL_ENV, RELEASE_VOL_ENV = 33, 34, 35, 36, 37, 38
+INSTRUMENT = 41
+KEY_RANGE, VEL_RANGE = 43, 44
+INITIAL_ATTENUATION = 48
+COARSE_TUNE, FINE_TUNE = 51, 52
+SAMPLE_ID = 53
+SAMPLE_MODES = 54
+SCALE_TUNING = 56
+OVERRIDING_ROOT_KEY = 58
+
+RANGE_GENERATORS = (KEY_RANGE, VEL_RANGE)
+# Generators whose preset-level value is added to the instrument-level one
+ADDITIVE_GENERATORS = (
+    PAN, DELAY_VOL_ENV, ATTACK_VOL_ENV, HOLD_VOL_ENV, DECAY_VOL_ENV, SUSTAIN_VOL_ENV,
+    RELEASE_VOL_ENV, INITIAL_ATTENUATION, COARSE_TUNE, FINE_TUNE,
+)
+DEFAULTS = {
+    DELAY_VOL_ENV: -12000, ATTACK_VOL_ENV: -12000, HOLD_VOL_ENV: -12000,
+    DECAY_VOL_ENV: -12000, RELEASE_VOL_ENV: -12000, SCALE_TUNING: 100, OVERRIDING_ROOT_KEY: -1,
+}
+DRUM_BANK = 128
+# Frames between volume envelope control points
+ENVELOPE_STEP = 32
+# Level below which a releasing note is cut off
+RELEASE_FLOOR_DB = -60.0
+
+
+def _records(data: bytes, fmt: str) -> List[tuple]:
+    size = struct.calcsize(fmt)
+    return [struct.unpack_from(fmt, data, offset) for offset in range(0, len(data) - size + 1, size)]
+
+
+def _name(raw: bytes) -> str:
+    return raw.split(b'\0', 1)[0].decode('latin-1').strip()
+
+
+def _timecents(value: int) -> float:
+    return 2.0 ** (value / 1200.0)
+
+
+class SoundFont:
+    """
+    Parsed SoundFont 2 file: 16-bit sample pool, presets, instruments and zones.
+
+    Only what sample playback needs is kept: key/velocity ranges, tuning,
+    loop points, attenuation, pan and the volume envelope. Modulators and
+    filters are ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        chunks = self._read_chunks(path)
+        self.samples = np.frombuffer(chunks[b'smpl'], dtype='<i2').astype(np.float32) / 32768.0
+        self.sample_headers = [
+            {
+                'name': _name(name), 'start': start, 'end': end, 'loop_start': loop_start,
+                'loop_end': loop_end, 'sample_rate': rate, 'root_key': root, 'correction': correction,
+            }
+            for name, start, end, loop_start, loop_end, rate, root, correction, _, _
+            in _records(chunks[b'shdr'], '<20s5IBbHH')
+        ]
+        instruments = self._zones(
+            [bag for _, bag in _records(chunks[b'inst'], '<20sH')], chunks[b'ibag'], chunks[b'igen'],
+        )
+        headers = _records(chunks[b'phdr'], '<20sHHH3I')
+        preset_zones = self._zones([bag for _, _, _, bag, *_ in headers], chunks[b'pbag'], chunks[b'pgen'])
+        self.presets: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        for (name, program, bank, *_), zones in zip(headers, preset_zones):
+            self.presets[(bank, program)] = {'name': _name(name), 'regions': self._regions(zones, instruments)}
+
+    @staticmethod
+    def _read_chunks(path: str) -> Dict[bytes, bytes]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != b'RIFF' or data[8:12] != b'sfbk':
+            raise ValueError(f"{path} is not a SoundFont 2 file")
+        chunks, offset = {}, 12
+        while offset + 8 <= len(data):
+            chunk_id, size = data[offset:offset + 4], struct.unpack_from('<I', data, offset + 4)[0]
+            body = data[offset + 8:offset + 8 + size]
+            if chunk_id == b'LIST':
+                inner = 4
+                while inner + 8 <= len(body):
+                    sub_id, sub_size = body[inner:inner + 4], struct.unpack_from('<I', body, inner + 4)[0]
+                    chunks[sub_id] = body[inner + 8:inner + 8 + sub_size]
+                    inner += 8 + sub_size + (sub_size & 1)
+            offset += 8 + size + (size & 1)
+        missing = {b'smpl', b'phdr', b'pbag', b'pgen', b'inst', b'ibag', b'igen', b'shdr'} - set(chunks)
+        if missing:
+            raise ValueError(f"{path} is missing chunks {sorted(m.decode() for m in missing)}")
+        return chunks
+
+    @staticmethod
+    def _zones(header_bags: List[int], bags: bytes, generators: bytes) -> List[List[Dict[int, Any]]]:
+        """Generator dictionaries per zone for each preset or instrument header."""
+        bag_generators = [gen for gen, _ in _records(bags, '<HH')]
+        gens = _records(generators, '<HBB')  # operator and the two amount bytes
+        result = []
+        for first_bag, next_bag in zip(header_bags, header_bags[1:]):
+            zones = []
+            for bag in range(first_bag, next_bag):
+                zone = {}
+                for operator, low, high in gens[bag_generators[bag]:bag_generators[bag + 1]]:
+                    if operator in RANGE_GENERATORS:
+                        zone[operator] = (low, high)
+                    elif operator in (INSTRUMENT, SAMPLE_ID, SAMPLE_MODES):
+                        zone[operator] = low | (high << 8)
+                    else:
+                        zone[operator] = struct.unpack('<h', bytes((low, high)))[0]
+                zones.append(zone)
+            result.append(zones)
+        return result
+
+    def _regions(self, preset_zones: List[Dict[int, Any]], instruments: List[List[Dict[int, Any]]]) -> List[Dict[int, Any]]:
+        """Flatten preset and instrument zones into playable regions with merged generators."""
+        preset_global = preset_zones[0] if preset_zones and INSTRUMENT not in preset_zones[0] else {}
+        regions = []
+        for preset_zone in preset_zones:
+            if INSTRUMENT not in preset_zone:
+                continue
+            preset_zone = {**preset_global, **preset_zone}
+            zones = instruments[preset_zone[INSTRUMENT]]
+            instrument_global = zones[0] if zones and SAMPLE_ID not in zones[0] else {}
+            for zone in zones:
+                if SAMPLE_ID not in zone:
+                    continue
+                region = {**DEFAULTS, **instrument_global, **zone}
+                for generator in RANGE_GENERATORS:
+                    low, high = region.get(generator, (0, 127))
+                    preset_low, preset_high = preset_zone.get(generator, (0, 127))
+                    region[generator] = (max(low, preset_low), min(high, preset_high))
+                for generator in ADDITIVE_GENERATORS:
+                    if generator in preset_zone:
+                        region[generator] = region.get(generator, 0) + preset_zone[generator]
+                if region[KEY_RANGE][0] <= region[KEY_RANGE][1] and region[VEL_RANGE][0] <= region[VEL_RANGE][1]:
+                    regions.append(region)
+        return regions
+
+    def preset(self, program: int, is_drum: bool = False) -> Dict[str, Any]:
+        """Preset for a General MIDI program, falling back to bank 0 and then the first preset."""
+        bank = DRUM_BANK if is_drum else 0
+        for key in ((bank, program), (bank, 0), (0, program), (0, 0)):
+            if key in self.presets:
+                return self.presets[key]
+        return next(iter(self.presets.values()))
+
+    def regions_for(self, preset: Dict[str, Any], key: int, velocity: int) -> List[Dict[int, Any]]:
+        return [
+            region for region in preset['regions']
+            if region[KEY_RANGE][0] <= key <= region[KEY_RANGE][1]
+            and region[VEL_RANGE][0] <= velocity <= region[VEL_RANGE][1]
+        ]
+
+    def render_note(self, region: Dict[int, Any], key: int, velocity: int, duration: float, sample_rate: int) -> np.ndarray:
+        """
+        Play one region for ``duration`` seconds plus its release; returns (frames, 2).
+
+        The sample is resampled by linear interpolation and looped according
+        to its sample mode; the DAHDSR volume envelope is applied in decibels.
+        """
+        header = self.sample_headers[region[SAMPLE_ID]]
+        start = header['start'] + region.get(START_OFFSET, 0) + 32768 * region.get(START_COARSE, 0)
+        end = header['end'] + region.get(END_OFFSET, 0) + 32768 * region.get(END_COARSE, 0)
+        loop_start = header['loop_start'] + region.get(LOOP_START_OFFSET, 0) + 32768 * region.get(LOOP_START_COARSE, 0)
+        loop_end = header['loop_end'] + region.get(LOOP_END_OFFSET, 0) + 32768 * region.get(LOOP_END_COARSE, 0)
+        looped = region.get(SAMPLE_MODES, 0) & 1 and start <= loop_start < loop_end <= end
+
+        root_key = region[OVERRIDING_ROOT_KEY]
+        if root_key < 0:
+            root_key = header['root_key'] if header['root_key'] <= 127 else 60
+        semitones = (
+            (key - root_key) * region[SCALE_TUNING] / 100.0
+            + region.get(COARSE_TUNE, 0) + (region.get(FINE_TUNE, 0) + header['correction']) / 100.0
+        )
+        step = 2.0 ** (semitones / 12.0) * header['sample_rate'] / sample_rate
+
+        # The release falls 96 dB over its time constant; stop once it is inaudible
+        release = min(_timecents(region[RELEASE_VOL_ENV]), 5.0) * RELEASE_FLOOR_DB / -96.0
+        frames = int((duration + release) * sample_rate)
+        positions = np.arange(frames, dtype=np.float64) * step
+        if looped:
+            loop_length = loop_end - loop_start
+            offset = loop_start - start
+            beyond = positions >= loop_end - start
+            positions[beyond] = offset + np.mod(positions[beyond] - offset, loop_length)
+        else:
+            frames = min(frames, int((end - start - 1) / step))
+            positions = positions[:max(frames, 0)]
+        if len(positions) == 0:
+            return np.zeros((0, 2), dtype=np.float32)
+        index = positions.astype(np.int64)
+        fraction = (positions - index).astype(np.float32)
+        data = self.samples[start:end]
+        nxt = np.minimum(index + 1, len(data) - 1)
+        tone = data[index] * (1.0 - fraction) + data[nxt] * fraction
+
+        envelope = self._envelope(region, len(tone), duration, sample_rate)
+        gain = 10.0 ** (-region.get(INITIAL_ATTENUATION, 0) / 200.0) * (velocity / 127.0) ** 2
+        pan = np.clip(region.get(PAN, 0) / 1000.0 + 0.5, 0.0, 1.0)
+        mono = tone * envelope
+        stereo = np.empty((len(mono), 2), dtype=np.float32)
+        np.multiply(mono, np.float32(gain * np.cos(pan * np.pi / 2)), out=stereo[:, 0])
+        np.multiply(mono, np.float32(gain * np.sin(pan * np.pi / 2)), out=stereo[:, 1])
+        return stereo
+
+    @staticmethod
+    def _envelope(region: Dict[int, Any], frames: int, duration: float, sample_rate: int) -> np.ndarray:
+        """
+        Volume envelope in linear gain: delay, linear attack, hold, decay to sustain in dB, release.
+
+        Evaluated every ``ENVELOPE_STEP`` frames and linearly interpolated in between.
+        """
+        control = np.arange(0, frames + ENVELOPE_STEP, ENVELOPE_STEP)
+        t = control / sample_rate
+        delay = _timecents(region[DELAY_VOL_ENV])
+        attack = _timecents(region[ATTACK_VOL_ENV])
+        hold = _timecents(region[HOLD_VOL_ENV])
+        decay = _timecents(region[DECAY_VOL_ENV])
+        sustain_db = -min(max(region.get(SUSTAIN_VOL_ENV, 0), 0), 1440) / 10.0
+        release = _timecents(region[RELEASE_VOL_ENV])
+
+        # Level in dB after the attack: 0 through hold, then falling towards sustain
+        decay_start = delay + attack + hold
+        level_db = np.where(t < decay_start, 0.0, np.maximum(-96.0 * (t - decay_start) / decay, sustain_db))
+        gain = 10.0 ** (level_db / 20.0)
+        gain = np.where(t < delay, 0.0, gain)
+        gain = np.where((t >= delay) & (t < delay + attack), (t - delay) / attack, gain)
+
+        # Release from whatever level was reached at note off, falling 96 dB over the release time
+        off = int(np.searchsorted(t, duration))
+        if off < len(t):
+            level_at_off = gain[off - 1] if off > 0 else 0.0
+            tail = t[off:] - duration
+            gain[off:] = level_at_off * 10.0 ** (-96.0 * tail / release / 20.0)
+        ramp = np.arange(ENVELOPE_STEP, dtype=np.float32) / ENVELOPE_STEP
+        gain = gain.astype(np.float32)
+        return (gain[:-1, None] + np.diff(gain)[:, None] * ramp).ravel()[:frames]
+
+
+@lru_cache(maxsize=4)
+def load_soundfont(path: str) -> SoundFont:
+    """Parse a soundfont once per process and keep its decoded sample pool."""
+    logger.info("Loading soundfont %s", path)
+    return SoundFont(path)
+
+
+def render_track(
+    soundfont_path: str,
+    notes: np.ndarray,
+    program: int,
+    is_drum: bool,
+    sample_rate: int,
+    output_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Render one track's notes with a soundfont; meant to run in a worker process.
+
+    Args:
+        soundfont_path: SoundFont 2 file, loaded once per process
+        notes: Array of (start seconds, end seconds, pitch, velocity) rows
+        program: General MIDI program number
+        is_drum: Whether the track plays on the drum channel
+        sample_rate: Output sample rate
+        output_path: Where to write the stem as 32-bit float WAV
+
+    Returns:
+        Dictionary with the frame count and peak level, plus the audio when
+        ``output_path`` is None
+    """
+    import soundfile as sf
+
+    soundfont = load_soundfont(soundfont_path)
+    preset = soundfont.preset(program, is_drum)
+    rendered = []
+    for start, end, pitch, velocity in notes:
+        for region in soundfont.regions_for(preset, int(pitch), int(velocity)):
+            audio = soundfont.render_note(region, int(pitch), int(velocity), max(end - start, 0.0), sample_rate)
+            if len(audio):
+                rendered.append((int(round(start * sample_rate)), audio))
+
+    frames = max((offset + len(audio) for offset, audio in rendered), default=0)
+    track = np.zeros((frames, 2), dtype=np.float32)
+    for offset, audio in rendered:
+        track[offset:offset + len(audio)] += audio
+    result = {'frames': frames, 'peak': float(np.abs(track).max()) if frames else 0.0}
+    if output_path is None:
+        result['audio'] = track
+    else:
+        sf.write(output_path, track, sample_rate, subtype='FLOAT')
+    return result
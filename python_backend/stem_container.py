@@ -0,0 +1,256 @@
+import json
+import logging
+import struct
+from typing import Dict, Iterator, Mapping, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_FILE = "stems.afs"
+MAGIC = b"AFSTEMS1"
+# The header is padded so sample data starts page-aligned
+HEADER_SIZE = 4096
+# Frames per stem in one block, about 93 ms at 44.1 kHz
+BLOCK_FRAMES = 4096
+# Frames rendered per chunk when serving, bounding memory per response
+SERVE_CHUNK_FRAMES = 1 << 16
+
+
+def to_int16(block: np.ndarray) -> np.ndarray:
+    return np.rint(np.clip(block, -1.0, 1.0) * 32767).astype('<i2')
+
+
+def wav_header(sample_rate: int, channels: int, frames: int, bits: int = 16) -> bytes:
+    """RIFF/WAVE header for ``frames`` frames of 16-bit PCM."""
+    block_align = channels * bits // 8
+    data_size = frames * block_align
+    return (
+        b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+class StemContainerWriter:
+    """
+    Sink for ``ChunkedSeparator`` writing every stem of a result into one file.
+
+    Samples are 16-bit PCM in blocks of ``block_frames`` frames; each block
+    holds that stretch of time for all stems in turn, so any time range of
+    any stem, or of a mix, is a handful of contiguous reads. The JSON index
+    in the header is written on ``close``, once the length is known.
+
+    Args:
+        path: Container file to create
+        stems: Mapping of the sink's block keys to the stem names stored
+        sample_rate: Sample rate of the blocks
+        channels: Channels of the blocks
+        block_frames: Frames per stem per block
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stems: Mapping[str, str],
+        sample_rate: int,
+        channels: int,
+        block_frames: int = BLOCK_FRAMES,
+    ):
+        self.path = path
+        self.stems = dict(stems)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.frames = 0
+        self._pending = np.zeros((len(self.stems), block_frames, channels), dtype='<i2')
+        self._filled = 0
+        self._file = open(path, 'wb')
+        self._file.write(b"\0" * HEADER_SIZE)
+
+    def __call__(self, blocks: Dict[str, np.ndarray]):
+        length = max((len(block) for block in blocks.values()), default=0)
+        offset = 0
+        while offset < length:
+            take = min(self.block_frames - self._filled, length - offset)
+            for index, key in enumerate(self.stems):
+                block = blocks.get(key)
+                target = self._pending[index, self._filled:self._filled + take]
+                if block is None:
+                    # Stems skipped as absent are stored as silence
+                    target[:] = 0
+                else:
+                    target[:] = to_int16(block[offset:offset + take])
+            self._filled += take
+            offset += take
+            if self._filled == self.block_frames:
+                self._file.write(self._pending.tobytes())
+                self._filled = 0
+        self.frames += length
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            if self._filled:
+                self._pending[:, self._filled:] = 0
+                self._file.write(self._pending.tobytes())
+                self._filled = 0
+            index = json.dumps({
+                'sample_rate': self.sample_rate,
+                'channels': self.channels,
+                'frames': self.frames,
+                'block_frames': self.block_frames,
+                'stems': list(self.stems.values()),
+            }).encode('utf-8')
+            header = MAGIC + struct.pack("<I", len(index)) + index
+            if len(header) > HEADER_SIZE:
+                raise ValueError("Stem container index does not fit in the header")
+            self._file.seek(0)
+            self._file.write(header)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class StemContainer:
+    """
+    Read-only, memory-mapped view of a container written by ``StemContainerWriter``.
+
+    Nothing is loaded up front; reading a stem or mixing several only
+    touches the pages of the blocks in the requested range, and the page
+    cache is shared by every request on the same result.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a stem container")
+        (index_size,) = struct.unpack_from("<I", header, len(MAGIC))
+        start = len(MAGIC) + 4
+        index = json.loads(header[start:start + index_size])
+        self.sample_rate: int = index['sample_rate']
+        self.channels: int = index['channels']
+        self.frames: int = index['frames']
+        self.block_frames: int = index['block_frames']
+        self.stems = list(index['stems'])
+        blocks = -(-self.frames // self.block_frames)
+        self._blocks = np.memmap(
+            path, dtype='<i2', mode='r', offset=HEADER_SIZE,
+            shape=(blocks, len(self.stems), self.block_frames, self.channels),
+        ) if blocks else np.zeros((0, len(self.stems), self.block_frames, self.channels), dtype='<i2')
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
+    def read(self, stem: str, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Frames ``start`` to ``end`` of one stem as 16-bit PCM of shape (frames, channels)."""
+        index = self.stems.index(stem)
+        view, offset, length = self._range(start, end)
+        return view[:, index].reshape(-1, self.channels)[offset:offset + length]
+
+    def mix(self, gains: Mapping[str, float], start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """
+        Frames ``start`` to ``end`` of the stems summed with linear ``gains``, as 16-bit PCM.
+
+        Stems without a gain are left out. Each stem is read straight from
+        the mapping and accumulated in place, then clipped to 16 bits.
+        """
+        unknown = set(gains) - set(self.stems)
+        if unknown:
+            raise ValueError(f"Unknown stems: {sorted(unknown)}; expected some of {self.stems}")
+        weights = np.array([gains.get(stem, 0.0) for stem in self.stems], dtype=np.float32) / 32767
+        view, offset, length = self._range(start, end)
+        used = np.flatnonzero(weights)
+        mixed = np.zeros(view.shape[:1] + view.shape[2:], dtype=np.float32)
+        for index in used:
+            # Accumulate stem by stem so only one float block exists at a time
+            mixed += view[:, index] * weights[index]
+        return to_int16(mixed.reshape(-1, self.channels)[offset:offset + length])
+
+    def wav_size(self, start: int = 0, end: Optional[int] = None) -> int:
+        """Size in bytes of the WAV file ``iter_wav`` serves for a frame range."""
+        start, end = self._clamp(start, end)
+        return len(wav_header(self.sample_rate, self.channels, 0)) + (end - start) * self.channels * 2
+
+    def iter_wav(
+        self,
+        selection: Union[str, Mapping[str, float]],
+        start: int = 0,
+        end: Optional[int] = None,
+        first_byte: int = 0,
+        last_byte: Optional[int] = None,
+        chunk_frames: int = SERVE_CHUNK_FRAMES,
+    ) -> Iterator[bytes]:
+        """
+        Bytes ``first_byte`` to ``last_byte`` (inclusive) of a WAV file of a stem or a mix.
+
+        The file is virtual: a header for the frame range followed by PCM
+        rendered chunk by chunk, so byte ranges can be served without
+        producing the rest of the file.
+
+        Args:
+            selection: Stem name, or ``{stem: gain}`` for a mix
+            start: First frame of the range
+            end: Frame after the range; the end of the stems by default
+            first_byte: First byte to yield
+            last_byte: Last byte to yield; the end of the file by default
+            chunk_frames: Frames rendered at a time
+        """
+        start, end = self._clamp(start, end)
+        header = wav_header(self.sample_rate, self.channels, end - start)
+        size = len(header) + (end - start) * self.channels * 2
+        last_byte = size - 1 if last_byte is None else min(last_byte, size - 1)
+        if first_byte < len(header):
+            yield header[first_byte:last_byte + 1]
+        frame_bytes = self.channels * 2
+        data_first = max(first_byte - len(header), 0)
+        data_last = last_byte - len(header)
+        if data_last < data_first:
+            return
+        frame = start + data_first // frame_bytes
+        stop = start + data_last // frame_bytes + 1
+        skip = data_first % frame_bytes
+        remaining = data_last - data_first + 1
+        while frame < stop:
+            chunk_end = min(stop, frame + chunk_frames)
+            if isinstance(selection, str):
+                pcm = self.read(selection, frame, chunk_end)
+            else:
+                pcm = self.mix(selection, frame, chunk_end)
+            data = pcm.tobytes()[skip:skip + remaining]
+            skip = 0
+            remaining -= len(data)
+            yield data
+            frame = chunk_end
+
+    def close(self):
+        # The mapping goes away with the last array referring to it
+        self._blocks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _clamp(self, start: int, end: Optional[int]):
+        end = self.frames if end is None else min(end, self.frames)
+        start = min(max(start, 0), end)
+        return start, end
+
+    def _range(self, start: int, end: Optional[int]):
+        """Blocks covering a frame range, the offset of ``start`` in them and the range length."""
+        start, end = self._clamp(start, end)
+        first = start // self.block_frames
+        last = -(-end // self.block_frames)
+        return self._blocks[first:last], start - first * self.block_frames, end - start
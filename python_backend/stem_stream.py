@@ -0,0 +1,145 @@
+import logging
+import os
+import shutil
+import struct
+import threading
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def streaming_wav_header(sample_rate: int, channels: int, bits: int = 16) -> bytes:
+    """RIFF/WAVE header for a 16-bit PCM stream of unknown length."""
+    block_align = channels * bits // 8
+    data_size = 0xFFFFFFFF - 36
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+class StemStream:
+    """
+    Spools stitched stem blocks of one job as 16-bit PCM while separation runs.
+
+    The separator sink appends each block to a per-stem file; readers tail
+    those files in time order, waiting for new data until the stream is
+    closed. Data lives on disk, so a slow reader costs no memory.
+    """
+
+    def __init__(self, directory: str, sample_rate: int, channels: int):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.closed = False
+        self.error: Optional[str] = None
+        self._written: Dict[str, int] = {}
+        self._files = {}
+        self._cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stem: str) -> str:
+        return os.path.join(self.directory, f"{stem}.pcm")
+
+    def write(self, blocks: Dict[str, np.ndarray]):
+        """Append one stitched block per stem."""
+        sizes = {}
+        for stem, block in blocks.items():
+            pcm = (np.clip(block, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+            if stem not in self._files:
+                self._files[stem] = open(self.path(stem), 'ab')
+            self._files[stem].write(pcm)
+            self._files[stem].flush()
+            sizes[stem] = len(pcm)
+        with self._cond:
+            for stem, size in sizes.items():
+                self._written[stem] = self._written.get(stem, 0) + size
+            self._cond.notify_all()
+
+    def close(self, error: Optional[str] = None):
+        """Mark the stream finished; readers drain what is left and stop."""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        with self._cond:
+            self.closed = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait_for_data(self, stem: str, timeout: Optional[float] = None) -> bool:
+        """Block until ``stem`` has data or the stream closes; True if there is data."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._written.get(stem, 0) > 0 or self.closed, timeout)
+            return self._written.get(stem, 0) > 0
+
+    def iter_pcm(self, stem: str, chunk_bytes: int = 1 << 16, timeout: Optional[float] = None) -> Iterator[bytes]:
+        """
+        Yield the PCM of ``stem`` from the start, following it until the stream closes.
+
+        With a ``timeout``, an empty chunk is yielded whenever no new data
+        arrived within it, so callers can poll instead of blocking.
+        """
+        while not self.wait_for_data(stem, timeout):
+            if self.closed:
+                return
+            yield b""
+        position = 0
+        with open(self.path(stem), 'rb') as f:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._written.get(stem, 0) > position or self.closed, timeout)
+                    available = self._written.get(stem, 0) - position
+                    if available <= 0 and self.closed:
+                        return
+                if available <= 0:
+                    yield b""
+                    continue
+                while available > 0:
+                    data = f.read(min(chunk_bytes, available))
+                    if not data:
+                        break
+                    position += len(data)
+                    available -= len(data)
+                    yield data
+
+
+class StreamRegistry:
+    """Tracks the live stem streams of running jobs and removes them after a grace period."""
+
+    def __init__(self, root: str, retention_seconds: float = 60):
+        self.root = root
+        self.retention_seconds = retention_seconds
+        self._streams: Dict[str, StemStream] = {}
+        self._lock = threading.Lock()
+        # Spools from a previous run can no longer be followed
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+
+    def open(self, job_id: str, sample_rate: int, channels: int) -> StemStream:
+        stream = StemStream(os.path.join(self.root, job_id), sample_rate, channels)
+        with self._lock:
+            self._streams[job_id] = stream
+        return stream
+
+    def get(self, job_id: str) -> Optional[StemStream]:
+        with self._lock:
+            return self._streams.get(job_id)
+
+    def release(self, job_id: str, error: Optional[str] = None):
+        """Close a job's stream and schedule its spool for deletion."""
+        stream = self.get(job_id)
+        if stream is None:
+            return
+        stream.close(error)
+        timer = threading.Timer(self.retention_seconds, self._remove, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _remove(self, job_id: str):
+        with self._lock:
+            stream = self._streams.pop(job_id, None)
+        if stream is not None:
+            shutil.rmtree(stream.directory, ignore_errors=True)
@@ -0,0 +1,171 @@
+import json
+import logging
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from result_cache import MANIFEST_NAME
+
+logger = logging.getLogger(__name__)
+
+# Stems above this size are uploaded in parts, several at a time
+MULTIPART_THRESHOLD = 8 * 1024 ** 2
+MULTIPART_CHUNKSIZE = 8 * 1024 ** 2
+
+
+class LocalStorage:
+    """
+    Results served from the local cache directory through the ``/processed`` mount.
+
+    Nothing is copied anywhere; URLs point at the files ``ResultCache`` keeps.
+    Not being ``remote``, it has none of the transfer methods (``upload_entry``,
+    ``fetch_manifest``, ``download_entry``) the cache uses with ``S3Storage``.
+    """
+
+    remote = False
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def url(self, key: str, name: str) -> str:
+        return f"{self.base_url}/{key}/{quote(name)}"
+
+    def status(self) -> Dict[str, Any]:
+        return {'backend': 'local', 'base_url': self.base_url}
+
+
+class S3Storage:
+    """
+    Results in an S3-compatible bucket (AWS S3, MinIO), shared by every replica.
+
+    Each cache entry is stored under ``<prefix><key>/`` with its files and
+    manifest. Files are uploaded in parallel, large ones as multipart
+    uploads, and the manifest goes last so a partial upload is never seen
+    as a result. Clients download straight from the bucket through
+    presigned URLs.
+
+    Args:
+        bucket: Bucket name; created on ``ensure_bucket`` if missing
+        client: boto3 S3 client; built for ``endpoint_url`` when omitted,
+            with credentials from the usual AWS environment variables
+        endpoint_url: Endpoint the server talks to, e.g. ``http://minio:9000``
+        public_endpoint_url: Endpoint presigned URLs point at, for when
+            clients reach the bucket by another address than the server
+        prefix: Key prefix for cache entries
+        url_expiry: Lifetime of presigned URLs in seconds
+        max_workers: Files transferred at once
+    """
+
+    remote = True
+
+    def __init__(
+        self,
+        bucket: str,
+        client=None,
+        endpoint_url: Optional[str] = None,
+        public_endpoint_url: Optional[str] = None,
+        prefix: str = "results/",
+        url_expiry: int = 3600,
+        max_workers: int = 4,
+    ):
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.client = client or self._make_client(endpoint_url)
+        # Signing is local, so a client for the public address makes no requests
+        self.presign_client = self._make_client(public_endpoint_url) if public_endpoint_url else self.client
+        self.prefix = prefix
+        self.url_expiry = url_expiry
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=max_workers,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+
+    @staticmethod
+    def _make_client(endpoint_url: Optional[str]):
+        import boto3
+        from botocore.config import Config
+
+        # Path-style addressing, which MinIO needs and AWS still accepts
+        return boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            config=Config(signature_version='s3v4', s3={'addressing_style': 'path'}),
+        )
+
+    def object_key(self, key: str, name: str) -> str:
+        return f"{self.prefix}{key}/{name}"
+
+    def ensure_bucket(self):
+        """Create the bucket if it does not exist yet (a fresh MinIO has none)."""
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except ClientError:
+            self.client.create_bucket(Bucket=self.bucket)
+            logger.info("Created bucket %s", self.bucket)
+
+    def url(self, key: str, name: str) -> str:
+        return self.presign_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.object_key(key, name)},
+            ExpiresIn=self.url_expiry,
+        )
+
+    def upload_entry(self, key: str, local_dir: str, files: Dict[str, Dict[str, Any]]):
+        """Upload the files of a cache entry in parallel, then its manifest."""
+        names = [info['file'] for info in files.values()]
+        self._map(lambda name: self._upload(local_dir, key, name), names)
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.object_key(key, MANIFEST_NAME),
+            Body=json.dumps(files).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+    def fetch_manifest(self, key: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Manifest of a stored entry, or None if the bucket does not have it."""
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key, MANIFEST_NAME))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.warning("Could not read %s from storage: %s", key, e)
+            return None
+        return json.loads(response['Body'].read())
+
+    def download_entry(self, key: str, local_dir: str, files: Dict[str, Dict[str, Any]]):
+        """Download the files of a stored entry into ``local_dir`` in parallel."""
+        names = [info['file'] for info in files.values()]
+        self._map(
+            lambda name: self.client.download_file(
+                self.bucket, self.object_key(key, name), os.path.join(local_dir, name),
+                Config=self.transfer_config,
+            ),
+            names,
+        )
+
+    def status(self) -> Dict[str, Any]:
+        return {'backend': 's3', 'bucket': self.bucket, 'prefix': self.prefix}
+
+    def _upload(self, local_dir: str, key: str, name: str):
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.upload_file(
+            os.path.join(local_dir, name), self.bucket, self.object_key(key, name),
+            ExtraArgs={'ContentType': content_type},
+            Config=self.transfer_config,
+        )
+
+    def _map(self, function, items: List[str]):
+        # Re-raise the first failure once every transfer has finished
+        futures = [self._executor.submit(function, item) for item in items]
+        for future in futures:
+            future.exception()
+        for future in futures:
+            future.result()
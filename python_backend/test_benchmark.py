@@ -0,0 +1,15 @@
+def test_benchmark_comparison_flags_regressions():
+    from benchmark import compare_reports
+
+    def report(wall, rss):
+        return {'results': [
+            {'fixture': 'audio-60s-2ch-mp3', 'stage': 'decode', 'wall_seconds': wall, 'peak_rss_mb': rss},
+            {'fixture': 'audio-60s-2ch-mp3', 'stage': 'separate', 'skipped': 'spleeter separator unavailable'},
+        ]}
+
+    baseline = report(1.0, 100.0)
+    assert compare_reports(baseline, report(1.05, 110.0)) == []
+    # Relative change above the threshold but below the absolute floor is noise
+    assert compare_reports(report(0.01, 100.0), report(0.03, 100.0)) == []
+    regressions = compare_reports(baseline, report(1.5, 200.0))
+    assert [(r['metric'], r['change']) for r in regressions] == [('wall_seconds', 0.5), ('peak_rss_mb', 1.0)]
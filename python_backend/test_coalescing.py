@@ -0,0 +1,37 @@
+def test_single_flight_shares_one_run_between_concurrent_callers():
+    import threading
+    from coalescing import KeyedLocks, SingleFlight
+
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'files': {'vocals': 'path'}}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.run('key', work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.run('key', work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.coalesced < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert len(calls) == 1 and len(results) == 4
+    # Each caller owns its copy
+    results[0]['files'].clear()
+    assert results[1] == {'files': {'vocals': 'path'}}
+    assert flight.in_flight() == 0
+
+    locks = KeyedLocks()
+    with locks.hold('dir'):
+        assert not locks._locks['dir'].acquire(blocking=False)
+    assert locks._locks == {}
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from separation import ChunkedSeparator, SeparatorPool
+from test_separation import ArrayReader, CountingSeparator
+
+
+def test_job_store_resumes_from_saved_windows(tmp_path):
+    from job_store import JobStore
+
+    class CrashingSeparator(CountingSeparator):
+        def separate(self, waveform):
+            if self.frames >= 300:
+                raise RuntimeError("killed")
+            return super().separate(waveform)
+
+    audio = np.random.default_rng(6).standard_normal((1000, 2)).astype(np.float32)
+    upload = tmp_path / "upload.wav"
+    upload.write_bytes(b"audio")
+    store = JobStore(str(tmp_path / "jobs"))
+    input_path = store.create("job", str(upload), "song.wav", {'stems': ['vocals']}, upload_bytes=5)
+
+    def engine(separator):
+        # One window at a time, so the crash point is deterministic
+        return ChunkedSeparator(SeparatorPool(lambda: separator), chunk_seconds=0.1, overlap_seconds=0.01,
+                                max_workers=1, sample_rate=1000)
+
+    with pytest.raises(RuntimeError):
+        engine(CrashingSeparator()).separate(ArrayReader(audio), lambda b: None, store.start("job"))
+    # The process died here; on restart the job is still listed
+    store = JobStore(str(tmp_path / "jobs"))
+    assert [(job['job_id'], job['upload_bytes']) for job in store.unfinished()] == [("job", 5)]
+    assert store.get("job")['windows_done'] == 3
+
+    separator = CountingSeparator()
+    checkpoint = store.start("job")
+    blocks = {}
+    engine(separator).separate(ArrayReader(audio), lambda b: [blocks.setdefault(k, []).append(v) for k, v in b.items()], checkpoint)
+    assert checkpoint.loaded == 3
+    assert separator.frames == 800  # 8 of the 11 windows; the first 3 come from the checkpoint
+    # Checkpointed windows are stored in half precision
+    np.testing.assert_allclose(np.concatenate(blocks['vocals']), audio * 0.25, rtol=1e-3, atol=1e-3)
+
+    # Windows cut with another layout are not spliced in
+    resumed = store.start("job")
+    separator = CountingSeparator()
+    ChunkedSeparator(SeparatorPool(lambda: separator), chunk_seconds=0.2, overlap_seconds=0.01,
+                     max_workers=1, sample_rate=1000).separate(ArrayReader(audio), lambda b: None, resumed)
+    assert resumed.loaded == 0 and separator.frames == 1050  # six 200-frame windows, all separated again
+
+    # Frames skipped as silence are saved with each window, so resumed runs report them too
+    quiet = tmp_path / "quiet.wav"
+    quiet.write_bytes(b"audio")
+    store.create("quiet", str(quiet), "quiet.wav")
+
+    def quiet_engine():
+        return ChunkedSeparator(SeparatorPool(CountingSeparator), chunk_seconds=0.1, overlap_seconds=0.01, max_workers=1,
+                                sample_rate=1000, stems=['vocals'], silence_threshold_db=-60)
+
+    silence = np.zeros((1000, 2), dtype=np.float32)
+    first = quiet_engine()
+    first.separate(ArrayReader(silence), lambda b: None, store.start("quiet"))
+    again, checkpoint = quiet_engine(), store.start("quiet")
+    again.separate(ArrayReader(silence), lambda b: None, checkpoint)
+    assert checkpoint.loaded == 11 and again.skipped_frames == first.skipped_frames == 1000
+    store.finish("quiet", {'status': 'success'})
+
+    store.finish("job", {'status': 'success'})
+    assert store.unfinished() == [] and store.get("job")['status'] == 'succeeded'
+    assert not os.path.exists(input_path)
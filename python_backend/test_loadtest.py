@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+
+def test_fake_separator_cost_and_load_test_report():
+    import time
+    from loadtest import parse_mix, percentile, summarize
+    from model_registry import FakeSeparator, fake_factory
+
+    separator = fake_factory(cost=0.1)(2)()
+    waveform = np.ones((44100, 2), dtype=np.float32)
+    started = time.perf_counter()
+    stems = separator.separate(waveform)
+    assert time.perf_counter() - started >= 0.1
+    assert list(stems) == ['vocals', 'accompaniment']
+    np.testing.assert_allclose(sum(stems.values()), waveform)
+    assert isinstance(separator, FakeSeparator) and not separator.busy
+
+    assert parse_mix("mp3:30:3,wav:10") == [
+        {'format': 'mp3', 'seconds': 30.0, 'weight': 3.0},
+        {'format': 'wav', 'seconds': 10.0, 'weight': 1.0},
+    ]
+    with pytest.raises(ValueError):
+        parse_mix("aiff:10")
+    assert percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    samples = [{'fixture': 'mp3_30s', 'audio_seconds': 30, 'ok': True, 'status': 200, 'latency': float(n)} for n in range(1, 101)]
+    samples.append({'fixture': 'mp3_30s', 'audio_seconds': 30, 'ok': False, 'status': 429, 'latency': 0.001})
+    summary = summarize(samples, wall_seconds=10.0)
+    assert summary['errors'] == 1 and summary['statuses'] == {'200': 100, '429': 1}
+    assert (summary['latency_p50'], summary['latency_p99']) == (50.5, 99.01)
+    assert summary['throughput_rps'] == 10.0 and summary['audio_seconds_per_second'] == 300.0
@@ -8,6 +8,7 @@ import soundfile as sf
 from midi_processor import MidiProcessor
 import mido
 import shutil
+import io
 
 @pytest.fixture
 def client():
@@ -34,7 +35,36 @@ def test_process_audio_invalid_file():
                     files={"file": ("test.txt", test_file, "text/plain")}
                 )
             
-            assert response.status_code == 500
+            # Rejected from the first bytes, before any processing
+            assert response.status_code == 415
+
+def test_process_audio_rejects_overlong_header():
+    """Test that a WAV whose header states too long a duration is refused before decoding."""
+    import struct
+    from main import MAX_DURATION_SECONDS
+    byte_rate = 44100 * 2 * 2
+    data_size = int((MAX_DURATION_SECONDS + 60) * byte_rate)
+    header = (
+        b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 2, 44100, byte_rate, 4, 16)
+        + b"data" + struct.pack("<I", data_size)
+    )
+    with TestClient(app) as client:
+        response = client.post(
+            "/process-audio",
+            files={"file": ("long.wav", header + bytes(4096), "audio/wav")}
+        )
+    assert response.status_code == 400
+    assert "too long" in response.json()["detail"]
+
+def test_process_audio_rejects_reserved_mp3_header():
+    """Test that junk whose first bytes carry a reserved MPEG version is a client error."""
+    with TestClient(app) as client:
+        response = client.post(
+            "/process-audio",
+            files={"file": ("x.mp3", b"\xff\xe8\x90\x00" + bytes(4096), "audio/mpeg")}
+        )
+    assert response.status_code in (400, 415)
 
 def test_process_audio():
     """Test audio file processing functionality."""
@@ -102,3 +132,165 @@ def test_midi_processing():
         assert 'track_info' in result
         assert 'Test Track' in result['track_info']
         assert result['track_info']['Test Track']['length'] == 5  # Including all metadata messages
+
+def test_midi_analysis_endpoint(client):
+    """Test that MIDI analysis answers without synthesizing audio."""
+    midi_file = mido.MidiFile()
+    track = mido.MidiTrack()
+    track.append(mido.MetaMessage('track_name', name='Lead', time=0))
+    track.append(mido.Message('note_on', note=60, velocity=100, time=0))
+    track.append(mido.Message('note_on', note=64, velocity=80, time=0))
+    track.append(mido.Message('note_off', note=60, velocity=0, time=480))
+    track.append(mido.Message('note_off', note=64, velocity=0, time=0))
+    midi_file.tracks.append(track)
+    buffer = io.BytesIO()
+    midi_file.save(file=buffer)
+
+    response = client.post("/analyze-midi", files={"file": ("test.mid", buffer.getvalue(), "audio/midi")})
+    assert response.status_code == 200
+    analysis = response.json()["analysis"]
+    assert analysis["track_info"]["Lead"]["note_count"] == 2
+    assert analysis["statistics"]["polyphony"]["max"] == 2
+    assert analysis["statistics"]["tempo_map"][0]["bpm"] == 120.0
+
+def test_job_status_unknown(client):
+    response = client.get("/jobs/does-not-exist")
+    assert response.status_code == 404
+
+def test_job_submission_returns_id():
+    """Test that the job endpoint answers before processing finishes."""
+    audio = io.BytesIO()
+    sf.write(audio, np.zeros(44100, dtype=np.float32), 44100, format='WAV')
+    with TestClient(app) as client:
+        response = client.post(
+            "/jobs",
+            files={"file": ("test.wav", audio.getvalue(), "audio/wav")}
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        status = client.get(f"/jobs/{job_id}")
+        assert status.status_code == 200
+        assert status.json()["status"] in ("queued", "running", "failed")
+
+def test_job_queue_backpressure():
+    """Test that the queue refuses work once every slot is taken."""
+    import threading
+    from job_queue import JobQueue, QueueFullError
+
+    release = threading.Event()
+    queue = JobQueue(max_workers=1, max_queue_size=1)
+    try:
+        queue.submit(release.wait)
+        queue.submit(release.wait)
+        with pytest.raises(QueueFullError):
+            queue.submit(release.wait)
+    finally:
+        release.set()
+        queue.shutdown()
+    assert queue.depth == 0
+
+def test_readiness_check(client):
+    response = client.get("/ready")
+    assert response.status_code in (200, 503)
+    assert "models" in response.json()
+
+def test_process_batch_reports_per_file_errors():
+    """Test that a bad file in a batch yields an error line instead of failing the batch."""
+    import json
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/process-batch",
+            files=[("files", ("test.txt", b"This is not an audio file", "text/plain"))]
+        )
+        assert response.status_code == 200
+        lines = [json.loads(line) for line in response.text.splitlines() if line]
+        assert len(lines) == 1
+        assert lines[0]["filename"] == "test.txt"
+        assert lines[0]["status"] == "error"
+
+def test_stem_range_requests(client):
+    """Test serving a cached stem by byte range from its stem container."""
+    import hashlib
+    from main import result_cache
+    from stem_container import CONTAINER_FILE, StemContainerWriter
+
+    key = hashlib.sha256(b"test_stem_range_requests").hexdigest()
+    staging = result_cache.create_staging()
+    audio = np.linspace(-0.5, 0.5, 44100 * 2, dtype=np.float32).reshape(-1, 2)
+    with StemContainerWriter(os.path.join(staging, CONTAINER_FILE), {'vocals': 'vocals', 'other': 'other'}, 44100, 2) as writer:
+        writer({'vocals': audio, 'other': audio * 0.5})
+    result_cache.publish(key, staging, {'container': {'file': CONTAINER_FILE, 'format': 'afs'}}, upload=False)
+
+    try:
+        whole = client.get(f"/results/{key}/vocals")
+        assert whole.status_code == 200
+        assert whole.headers["accept-ranges"] == "bytes"
+        assert len(whole.content) == 44 + len(audio) * 4
+
+        partial = client.get(f"/results/{key}/vocals", headers={"Range": "bytes=100-199"})
+        assert partial.status_code == 206
+        assert partial.headers["content-range"] == f"bytes 100-199/{len(whole.content)}"
+        assert partial.content == whole.content[100:200]
+
+        mixed = client.get(f"/results/{key}/mix", params={"gains": "vocals=1,other=0", "start": 0.1, "end": 0.2})
+        assert mixed.status_code == 200
+        assert mixed.content[44:] == whole.content[44 + 4410 * 4:44 + 8820 * 4]
+
+        assert client.get(f"/results/{key}/vocals", headers={"Range": "bytes=999999-"}).status_code == 416
+        assert client.get(f"/results/{key}/drums").status_code == 404
+    finally:
+        shutil.rmtree(os.path.join(result_cache.root, key), ignore_errors=True)
+
+def test_mix_endpoint_remixes_cached_stems(client, monkeypatch, tmp_path):
+    """Test remixing a finished job's stems with gains and mutes."""
+    import hashlib
+    import main
+    from job_store import JobStore
+    from main import job_queue, result_cache
+    from stem_container import CONTAINER_FILE, StemContainerWriter
+
+    key = hashlib.sha256(b"test_mix_endpoint_remixes_cached_stems").hexdigest()
+    staging = result_cache.create_staging()
+    audio = np.full((1000, 2), 0.25, dtype=np.float32)
+    with StemContainerWriter(os.path.join(staging, CONTAINER_FILE), {s: s for s in ('vocals', 'drums', 'bass')}, 44100, 2) as writer:
+        writer({'vocals': audio, 'drums': audio * 2, 'bass': -audio})
+    for stem in ('vocals', 'drums', 'bass'):
+        open(os.path.join(staging, f"{stem}.wav"), "wb").close()
+    result_cache.publish(key, staging, {
+        **{stem: {'file': f"{stem}.wav", 'format': 'wav'} for stem in ('vocals', 'drums', 'bass')},
+        'container': {'file': CONTAINER_FILE, 'format': 'afs'},
+    }, upload=False)
+    job = job_queue.submit(lambda: {'status': 'success', 'type': 'audio', 'cache_key': key})
+    job.future.result(timeout=10)
+
+    try:
+        def mix(**params):
+            response = client.get("/mix", params={"job_id": job.id, **params})
+            assert response.status_code == 200
+            return np.frombuffer(response.content[44:], dtype='<i2').reshape(-1, 2) / 32767
+
+        np.testing.assert_allclose(mix(), 0.5, atol=1e-4)
+        np.testing.assert_allclose(mix(mute="drums"), 0.0, atol=1e-4)
+        np.testing.assert_allclose(mix(gains="drums=0.5", mute="bass"), 0.5, atol=1e-4)
+        assert client.get("/mix", params={"job_id": job.id, "mute": "piano"}).status_code == 400
+        assert client.get("/mix", params={"job_id": "unknown"}).status_code == 404
+        # Seekable like /results/<key>/mix
+        response = client.get("/mix", params={"job_id": job.id}, headers={"Range": "bytes=44-47"})
+        assert response.status_code == 206 and response.content == (16384).to_bytes(2, 'little') * 2
+
+        # Jobs finished before a restart are found in the job store
+        job_store = JobStore(str(tmp_path / "job_store"))
+        monkeypatch.setattr(main, "job_store", job_store)
+        upload = str(tmp_path / "mix_upload.wav")
+        open(upload, "wb").close()
+        job_store.create("restarted-mix-job", upload, "song.wav")
+        job_store.finish("restarted-mix-job", {'status': 'success', 'type': 'audio', 'cache_key': key})
+        np.testing.assert_allclose(
+            np.frombuffer(client.get("/mix", params={"job_id": "restarted-mix-job"}).content[44:], dtype='<i2') / 32767,
+            0.5, atol=1e-4,
+        )
+        job_store.close()
+    finally:
+        shutil.rmtree(os.path.join(result_cache.root, key), ignore_errors=True)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from test_separation import ArrayReader
+
+
+def test_stage_clock_books_time_to_stage_histograms():
+    from prometheus_client import CollectorRegistry, Histogram, generate_latest
+    from metrics import StageClock, TimedReader
+
+    registry = CollectorRegistry()
+    stages = Histogram("stage_seconds", "Stages.", ["stage"], buckets=(0.1, 1), registry=registry)
+    clock = StageClock()
+    reader = TimedReader(ArrayReader(np.zeros((10, 2), dtype=np.float32)), clock)
+    reader.read(5)
+    clock.wrap("export", lambda: None)()
+    clock.observe(stages)
+
+    text = generate_latest(registry).decode()
+    assert set(clock.totals) == {"decode", "export"}
+    assert 'stage_seconds_bucket{le="0.1",stage="decode"} 1.0' in text
+    assert 'stage_seconds_count{stage="export"} 1.0' in text
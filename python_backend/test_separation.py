@@ -0,0 +1,365 @@
+import os
+
+import numpy as np
+import pytest
+
+from separation import ChunkedSeparator, SeparatorPool
+
+
+class ArrayReader:
+    """Minimal stand-in for soundfile.SoundFile.read over an in-memory buffer."""
+
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def read(self, frames, dtype='float32', always_2d=True):
+        block = self.data[self.position:self.position + frames]
+        self.position += len(block)
+        return block.astype(dtype)
+
+
+class ScalingSeparator:
+    """Fake separator whose stems are fixed multiples of the input."""
+
+    def separate(self, waveform):
+        return {'vocals': waveform * 0.25, 'other': waveform * 0.75}
+
+
+def collect(engine, data):
+    blocks = {}
+    engine.separate(ArrayReader(data), lambda b: [blocks.setdefault(k, []).append(v) for k, v in b.items()])
+    return {k: np.concatenate(v) for k, v in blocks.items()}
+
+
+@pytest.mark.parametrize("frames", [10, 100, 101, 250, 1000])
+def test_chunked_separation_is_seam_free(frames):
+    """Stitched stems must match a single-pass separation sample for sample."""
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((frames, 2)).astype(np.float32)
+    engine = ChunkedSeparator(
+        SeparatorPool(ScalingSeparator, size=2),
+        chunk_seconds=100, overlap_seconds=20, sample_rate=1,
+    )
+    stems = collect(engine, data)
+    assert np.allclose(stems['vocals'], data * 0.25, atol=1e-6)
+    assert np.allclose(stems['other'], data * 0.75, atol=1e-6)
+
+
+def test_chunked_separation_rejects_large_overlap():
+    with pytest.raises(ValueError):
+        ChunkedSeparator(SeparatorPool(ScalingSeparator), chunk_seconds=10, overlap_seconds=6, sample_rate=1)
+
+
+def test_result_cache_hits_and_evicts(tmp_path):
+    from result_cache import ResultCache, make_cache_key
+
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1500)
+    keys = [make_cache_key(f"audio{i}", "spleeter:5stems", {}) for i in range(3)]
+    for key in keys:
+        assert cache.get(key) is None
+        staging = cache.create_staging()
+        with open(f"{staging}/vocals.wav", "wb") as f:
+            f.write(b"\0" * 600)
+        files = cache.publish(key, staging, {"vocals": {"file": "vocals.wav", "format": "wav"}})
+        assert files["vocals"]["path"].endswith(f"{key}/vocals.wav")
+        assert files["vocals"]["format"] == "wav"
+
+    # The oldest entry was evicted to respect the size limit
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) is not None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 4
+    assert stats["entries"] == 2
+
+
+def test_model_registry_loads_lazily_and_warms_up():
+    from model_registry import ModelRegistry
+
+    built = []
+
+    def factory(stems):
+        def create():
+            built.append(stems)
+            return ScalingSeparator()
+        return create
+
+    registry = ModelRegistry(pool_size=2, factory=factory)
+    assert built == []
+    assert not registry.is_ready(5)
+
+    registry.warm_up(5)
+    assert built == [5, 5]
+    assert registry.is_ready(5)
+    assert registry.status()['spleeter:5stems']['state'] == 'ready'
+
+    with pytest.raises(ValueError):
+        registry.pool(3)
+
+
+def test_batch_separation_splits_packed_tracks():
+    from batch import BatchSeparator, iter_batches
+
+    rng = np.random.default_rng(1)
+    tracks = [rng.standard_normal((n, 2)).astype(np.float32) for n in (50, 130, 7)]
+    batcher = BatchSeparator(SeparatorPool(ScalingSeparator), segment_frames=64, guard_frames=16)
+
+    packed, offsets = batcher.pack(tracks)
+    assert all(offset % 64 == 0 for offset in offsets)
+    assert offsets == [0, 128, 320]
+
+    for track, stems in zip(tracks, batcher.separate(tracks)):
+        assert np.allclose(stems['vocals'], track * 0.25)
+
+    # Tracks are charged the segments they fill once packed: 128, 192 and 64 frames
+    batches = list(iter_batches(enumerate(tracks), max_frames=320, segment_frames=64, guard_frames=16))
+    assert [[key for key, _ in batch] for batch in batches] == [[0, 1], [2]]
+
+
+def test_batches_of_short_tracks_pack_within_the_budget():
+    from batch import BatchSeparator, iter_batches
+
+    # Many short tracks, each padded to a whole segment when packed
+    tracks = [np.ones((10, 2), dtype=np.float32) for _ in range(300)]
+    batcher = BatchSeparator(SeparatorPool(ScalingSeparator), segment_frames=64, guard_frames=16)
+    batches = list(iter_batches(enumerate(tracks), max_frames=3000, segment_frames=64, guard_frames=16))
+    assert sum(len(batch) for batch in batches) == 300
+    for batch in batches:
+        packed, _ = batcher.pack([waveform for _, waveform in batch])
+        assert len(packed) <= 3000
+
+
+def test_stem_stream_follows_writer(tmp_path):
+    import threading
+    from stem_stream import StemStream
+
+    stream = StemStream(str(tmp_path / "job"), sample_rate=1, channels=2)
+    blocks = [np.full((5, 2), 0.5, dtype=np.float32), np.full((3, 2), -0.5, dtype=np.float32)]
+
+    def produce():
+        for block in blocks:
+            stream.write({'vocals': block})
+        stream.close()
+
+    threading.Thread(target=produce).start()
+    pcm = np.frombuffer(b"".join(stream.iter_pcm('vocals')), dtype='<i2').reshape(-1, 2)
+    assert len(pcm) == 8
+    assert pcm[0, 0] == 16383 and pcm[-1, 0] == -16383
+    assert not stream.wait_for_data('drums')
+
+    # Polling readers get empty chunks instead of blocking while the writer is idle
+    polled = StemStream(str(tmp_path / "polled"), sample_rate=1, channels=2)
+    chunks = polled.iter_pcm('vocals', timeout=0)
+    assert next(chunks) == b""
+    polled.write({'vocals': blocks[0]})
+    assert len(next(chunks)) == 20 and next(chunks) == b""
+    polled.close()
+    assert list(chunks) == []
+
+
+def test_select_model_picks_cheapest_cover():
+    from model_registry import select_model
+
+    assert select_model(['vocals']) == 2
+    assert select_model(['vocals', 'accompaniment']) == 2
+    assert select_model(['drums', 'bass']) == 4
+    assert select_model(['guitar']) == 5
+    with pytest.raises(ValueError):
+        select_model(['accompaniment', 'drums'])
+    with pytest.raises(ValueError):
+        select_model(['kazoo'])
+
+
+def test_chunked_separation_keeps_requested_stems():
+    data = np.ones((30, 2), dtype=np.float32)
+    engine = ChunkedSeparator(SeparatorPool(ScalingSeparator), chunk_seconds=10, overlap_seconds=2, sample_rate=1, stems=['vocals'])
+    assert set(collect(engine, data)) == {'vocals'}
+
+
+@pytest.mark.parametrize("output_format", ["wav", "flac"])
+def test_stem_writer_encodes_each_stem(tmp_path, output_format):
+    import soundfile as sf
+    from separation import StemFileWriter
+
+    paths = {stem: str(tmp_path / f"{stem}.{output_format}") for stem in ("vocals", "drums")}
+    block = np.full((100, 2), 0.25, dtype=np.float32)
+    with StemFileWriter(paths, sample_rate=8000, output_format=output_format) as writer:
+        writer({'vocals': block, 'drums': block, 'bass': block})
+        writer({'vocals': block, 'drums': block})
+    assert writer.frames == 200
+    for path in paths.values():
+        data, sample_rate = sf.read(path)
+        assert sample_rate == 8000
+        assert data.shape == (200, 2)
+
+
+@pytest.mark.parametrize("spec", [
+    {'type': 'lowpass', 'cutoff': 2000},
+    {'type': 'highpass', 'cutoff': 200, 'design': 'fir', 'numtaps': 101},
+    {'type': 'eq', 'bands': [{'freq': 1000, 'gain_db': 6, 'q': 2}]},
+])
+def test_block_filtering_matches_whole_signal(spec):
+    from filters import FilterChain, FilteredReader
+
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((10000, 2)).astype(np.float32)
+    whole = FilterChain([spec], 44100, 2).process(data)
+    reader = FilteredReader(ArrayReader(data), FilterChain([spec], 44100, 2))
+    blocks = np.concatenate([reader.read(777) for _ in range(13)])
+    np.testing.assert_allclose(blocks, whole, atol=1e-5)
+
+
+@pytest.mark.parametrize("spec", [
+    {'type': 'eq', 'bands': [{'freq': 1000, 'gain_db': 6, 'q': 0}]},
+    {'type': 'notch', 'freq': 50, 'q': -1},
+    {'type': 'lowpass', 'cutoff': 2000, 'design': 'fir', 'numtaps': 10 ** 7},
+    {'type': 'lowpass', 'cutoff': 2000, 'order': 500},
+])
+def test_filter_designs_reject_degenerate_or_huge_parameters(spec):
+    from filters import FilterChain
+
+    with pytest.raises(ValueError):
+        FilterChain([spec], 44100, 2)
+
+
+def test_features_are_block_size_invariant_and_cached(tmp_path):
+    from features import N_FEATURES, FeatureStore, extract_features
+
+    rng = np.random.default_rng(2)
+    data = rng.standard_normal((50000, 2)).astype(np.float32)
+    whole = extract_features(ArrayReader(data), 44100, block_frames=len(data) + 1)
+    blocks = extract_features(ArrayReader(data), 44100, block_frames=3001)
+    assert whole.shape == (-(-(len(data) - 4096) // 1024) + 1, N_FEATURES)
+    np.testing.assert_allclose(blocks, whole, atol=1e-3)
+
+    store = FeatureStore(str(tmp_path))
+    calls = []
+    for _ in range(2):
+        cached = store.get_or_compute('abc', lambda: calls.append(1) or whole)
+    assert len(calls) == 1
+    assert np.load(store.path('abc')).dtype == np.float16
+    np.testing.assert_allclose(cached, whole, rtol=1e-2, atol=1e-2)
+
+
+def test_detect_instruments_on_synthetic_sources():
+    from features import detect_instruments, extract_features
+
+    sample_rate = 44100
+    t = np.arange(sample_rate * 4) / sample_rate
+    rng = np.random.default_rng(3)
+    sources = {
+        'bass': 0.5 * np.sin(2 * np.pi * 55 * t),
+        'drums': 0.5 * rng.standard_normal(len(t)) * np.exp(-(t % 0.25) * 40),
+        None: np.zeros_like(t),
+    }
+    for expected, signal in sources.items():
+        features = extract_features(ArrayReader(signal[:, None]), sample_rate)
+        detected = detect_instruments(features, sample_rate)
+        present = {name for name, info in detected.items() if info['present']}
+        assert present == ({expected} if expected else set())
+
+
+def test_upload_sniffing_and_header_duration(tmp_path):
+    import io
+    import soundfile as sf
+    from ingest import probe_duration, sniff_format
+
+    for format_name, container in (('WAV', 'wav'), ('FLAC', 'flac'), ('OGG', 'ogg')):
+        encoded = io.BytesIO()
+        sf.write(encoded, np.zeros((22050, 2), dtype=np.float32), 11025, format=format_name)
+        head = encoded.getvalue()[:1 << 16]
+        assert sniff_format(head) == container
+        if container != 'ogg':
+            assert probe_duration(head, container) == pytest.approx(2.0)
+    assert sniff_format(b'MThd\x00\x00\x00\x06') == 'midi'
+    assert sniff_format(b'ID3\x04\x00\x00\x00\x00\x00\x00') == 'mp3'
+    assert sniff_format(b'This is not an audio file') is None
+    # Reserved MPEG version and sample-rate index bits are not frame headers
+    assert probe_duration(b'\xff\xe8\x90\x00' + bytes(64), 'mp3') is None
+    assert probe_duration(b'\xff\xfb\x9c\x00' + bytes(64), 'mp3') is None
+
+
+def test_process_separator_round_trips_through_shared_memory():
+    from model_registry import FakeSeparator
+    from separation_workers import ProcessSeparator, cpu_slices
+
+    assert cpu_slices(3, range(8)) == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert cpu_slices(3, [0, 1]) == [[0], [1], [0]]
+
+    pool = SeparatorPool(lambda: ProcessSeparator(FakeSeparator, (2, 0.0), stems=2, max_frames=100))
+    engine = ChunkedSeparator(pool, chunk_seconds=0.3, overlap_seconds=0.05, sample_rate=1000)
+    audio = np.random.default_rng(3).standard_normal((1000, 2)).astype(np.float32)
+    try:
+        # Windows are larger than the initial buffers, so they grow on the way
+        out = collect(engine, audio)
+        with pool.acquire() as separator:
+            assert separator.pid != os.getpid()
+    finally:
+        pool.close()
+    np.testing.assert_allclose(out['vocals'], audio / 2, atol=1e-6)
+
+
+class CountingSeparator(ScalingSeparator):
+    """ScalingSeparator that records how many frames it was asked to separate."""
+
+    def __init__(self):
+        self.frames = 0
+
+    def separate(self, waveform):
+        self.frames += len(waveform)
+        return super().separate(waveform)
+
+
+def test_chunked_separation_skips_silence():
+    separator = CountingSeparator()
+    engine = ChunkedSeparator(
+        SeparatorPool(lambda: separator), chunk_seconds=1.0, overlap_seconds=0.1,
+        sample_rate=10000, silence_threshold_db=-60, silence_margin_seconds=0.05,
+    )
+    audio = np.zeros((60000, 2), dtype=np.float32)
+    audio[25000:32000] = np.random.default_rng(4).standard_normal((7000, 2)).astype(np.float32)
+    audio[40000:40010] = 1e-5  # Below the threshold
+
+    out = collect(engine, audio)
+    expected = audio * 0.25
+    expected[40000:40010] = 0.0
+    np.testing.assert_allclose(out['vocals'], expected, atol=1e-6)
+    # Everything far from the loud part comes back as exact zeros and is never separated
+    assert not out['vocals'][:20000].any() and not out['other'][36000:].any()
+    assert separator.frames < 15000
+    assert engine.skipped_frames > 45000
+
+    # Frame RMS from cached features stands in for the sample scan
+    from features import extract_features, frame_levels
+    levels = frame_levels(extract_features(ArrayReader(audio), 10000))
+    separator.frames = 0
+    blocks = {}
+    engine.separate(ArrayReader(audio), lambda b: [blocks.setdefault(k, []).append(v) for k, v in b.items()], levels=levels)
+    np.testing.assert_allclose(np.concatenate(blocks['vocals']), expected, atol=1e-6)
+    # Frames are longer than scan blocks, so the spans come out a little wider
+    assert separator.frames < 20000 and engine.skipped_frames > 40000
+
+
+def test_stem_container_serves_ranges_and_mixes(tmp_path):
+    from stem_container import StemContainer, StemContainerWriter
+
+    rng = np.random.default_rng(5)
+    stems = {s: rng.uniform(-0.5, 0.5, (10000, 2)).astype(np.float32) for s in ('vocals', 'piano')}
+    path = str(tmp_path / "stems.afs")
+    with StemContainerWriter(path, {'vocals': 'vocals', 'piano': 'guitar'}, 1000, 2, block_frames=64) as writer:
+        for start in range(0, 10000, 777):
+            writer({s: data[start:start + 777] for s, data in stems.items()})
+
+    with StemContainer(path) as container:
+        assert (container.stems, container.frames) == (['vocals', 'guitar'], 10000)
+        vocals = container.read('vocals', 100, 5000) / 32767
+        np.testing.assert_allclose(vocals, stems['vocals'][100:5000], atol=1e-4)
+        mixed = container.mix({'vocals': 1.0, 'guitar': 0.5}, 3000, 3100) / 32767
+        np.testing.assert_allclose(mixed, stems['vocals'][3000:3100] + stems['piano'][3000:3100] * 0.5, atol=2e-4)
+
+        whole = b"".join(container.iter_wav('guitar', 0, 2000))
+        assert len(whole) == container.wav_size(0, 2000) == 44 + 2000 * 4
+        # Any byte range of the virtual file matches the same slice of the whole file
+        for first, last in [(0, 10), (40, 47), (45, 4000), (1001, 8043)]:
+            assert b"".join(container.iter_wav('guitar', 0, 2000, first, last, chunk_frames=100)) == whole[first:last + 1]
@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def test_soundfont_renders_notes_at_their_onsets():
+    import os
+    from soundfont import load_soundfont, render_track
+
+    path = os.path.join(os.path.dirname(__file__), "soundfont.sf2")
+    soundfont = load_soundfont(path)
+    assert soundfont.regions_for(soundfont.preset(0), 60, 100)
+    assert soundfont.preset(0, is_drum=True)['regions']
+
+    notes = np.array([[0.5, 1.0, 60, 100]])
+    result = render_track(path, notes, 0, False, 22050)
+    audio = result['audio']
+    assert audio.shape == (result['frames'], 2)
+    assert not audio[:int(0.5 * 22050)].any()
+    assert 0 < result['peak'] == np.abs(audio).max()
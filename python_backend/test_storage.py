@@ -0,0 +1,52 @@
+class FakeS3Client:
+    """In-memory stand-in for the few S3 calls ``S3Storage`` makes."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, path, bucket, key, ExtraArgs=None, Config=None):
+        with open(path, 'rb') as f:
+            self.objects[key] = f.read()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        import io
+        from botocore.exceptions import ClientError
+
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def download_file(self, bucket, key, path, Config=None):
+        with open(path, 'wb') as f:
+            f.write(self.objects[key])
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def test_s3_storage_shares_results_between_replicas(tmp_path):
+    from result_cache import ResultCache
+    from storage import S3Storage
+
+    storage = S3Storage("bucket", client=FakeS3Client(), prefix="results/")
+    first = ResultCache(str(tmp_path / "first"), max_bytes=10 ** 6, storage=storage)
+    second = ResultCache(str(tmp_path / "second"), max_bytes=10 ** 6, storage=storage)
+
+    staging = first.create_staging()
+    with open(f"{staging}/vocals.wav", "wb") as f:
+        f.write(b"\1" * 600)
+    first.publish("key", staging, {"vocals": {"file": "vocals.wav", "format": "wav"}})
+    assert set(storage.client.objects) == {"results/key/vocals.wav", "results/key/manifest.json"}
+
+    # The other replica misses locally, fills its hot tier from the bucket, then hits locally
+    files = second.get("key")
+    with open(files["vocals"]["path"], "rb") as f:
+        assert f.read() == b"\1" * 600
+    assert second.get("key") is not None
+    assert second.get("other") is None
+    stats = second.stats()
+    assert (stats["hits"], stats["remote_hits"], stats["misses"]) == (1, 1, 1)
+    assert storage.url(files["vocals"]["key"], "vocals.wav").startswith("https://s3.test/bucket/results/key/vocals.wav")